@@ -1,10 +1,14 @@
+import sys
+sys.path.append("../db")
+
 import boto3
 import os
 import argparse
 import redis
 import configparser
-from hashlib import sha256
 import json
+from run_identity import make_run_id
+from run_index import add_run
 
 config = configparser.ConfigParser()
 config.read('../REST-Server/config.ini')
@@ -69,10 +73,10 @@ if __name__ == "__main__":
               "name": model_name
             }
             
-            run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+            run_id = make_run_id(model_config)
             
-            # Add to model set in Redis
-            r.sadd(model_name, run_id)
+            # Add to model set in Redis and its timestamp index
+            add_run(r, model_name, run_id)
             
             run_obj = {'status': 'SUCCESS',
              'name': model_name,
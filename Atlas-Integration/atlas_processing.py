@@ -2,87 +2,54 @@ import sys
 import os
 import warnings
 sys.path.append("../db")
+sys.path.append("../REST-Server")
 
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import make_run_id
+from loader import register_run
+from openapi_server import raster
+from openapi_server.admin_grid import load_admin_grid
+from openapi_server import gadm
 
-from shapely.geometry import Point
-import geopandas as gpd
-import numpy as np
 from osgeo import gdal
 from osgeo import gdalconst
 
 from datetime import datetime
-from hashlib import sha256
-from collections import OrderedDict
-import json
+import configparser
 
-def raster2gpd(InRaster,feature_name,band=1,nodataval=-9999):
+config = configparser.ConfigParser()
+config.read('../REST-Server/config.ini')
+
+def warp_raster(InRaster):
     '''
     Description: 
-        Takes the path of a raster (.tiff) file and produces a Geopandas Data Frame.
+        Opens a raster (.tiff) file, warped to EPSG:4326.
     Params:
         - InRaster: the path of the input raster file
-        - feature_name: the name of the feature represented by the pixel values 
     '''
+    ds = gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
+    return gdal.Warp('out_raster.tif', ds, dstSRS='EPSG:4326') # fixes projection issue
+
 
-    # open the raster and get some properties
-    ds       = gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
-    ds       = gdal.Warp('out_raster.tif', ds, dstSRS='EPSG:4326') # fixes projection issue
-    GeoTrans = ds.GetGeoTransform()
-    ColRange = range(ds.RasterXSize)
-    RowRange = range(ds.RasterYSize)
-    rBand    = ds.GetRasterBand(band) # first band
-    nData    = rBand.GetNoDataValue()
-    if nData == None:
-        print("No nodataval for raster")
-        nData = nodataval # set it to something if not set
-    else:
-        print("NoData value is {0}".format(nData))
-
-    # specify the center offset (takes the point in middle of pixel)
-    HalfX    = GeoTrans[1] / 2
-    HalfY    = GeoTrans[5] / 2
-
-    points = []
-    for ThisRow in RowRange:
-        RowData = rBand.ReadAsArray(0,ThisRow,ds.RasterXSize,1)[0]
-        for ThisCol in ColRange:
-            # need to exclude NaN values since there is no nodataval
-            if (RowData[ThisCol] != nData) and not (np.isnan(RowData[ThisCol])):
-                
-                # TODO: implement filters on valid pixels
-                # for example, the below would ensure pixel values are between -100 and 100
-                #if (RowData[ThisCol] <= 100) and (RowData[ThisCol] >= -100):
-
-                X = GeoTrans[0] + ( ThisCol * GeoTrans[1] )
-                Y = GeoTrans[3] + ( ThisRow * GeoTrans[5] ) # Y is negative so it's a minus
-                # this gives the upper left of the cell, offset by half a cell to get centre
-                X += HalfX
-                Y += HalfY
-
-                points.append([Point(X, Y),X,Y,RowData[ThisCol],feature_name])
-
-    return gpd.GeoDataFrame(points, columns=['geometry','longitude','latitude','feature_value','feature_name'])
+def load_admin2():
+    '''
+    Description:
+        Load Admin2 shape from GADM. Only needed when the admin grid for
+        the Atlas rasters has not been built yet.
+    '''
+    admin2 = gadm.load_admin2('../gadm2')
+    print("...loaded\n")
+    return admin2
 
 
 if __name__ == "__main__":
 
     init_db()
 
-    # Load Admin2 shape from GADM
-    print("Loading GADM shapes...")
-    admin2 = gpd.read_file('../gadm2/gadm36_2.shp')
-    admin2['country'] = admin2['NAME_0']
-    admin2['state'] = admin2['NAME_1']
-    admin2['admin1'] = admin2['NAME_1']
-    admin2['admin2'] = admin2['NAME_2']
-    admin2 = admin2[['geometry','country','state','admin1','admin2']]
-    print("...loaded\n")
-
     models = ['consumption_model','asset_wealth_model']
     formats = ['tif','geojson']
     atlas_lookup = {
@@ -112,7 +79,7 @@ if __name__ == "__main__":
           "name": model_name
         }
         
-        run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+        run_id = make_run_id(model_config)
 
         # Add metadata object to DB
         meta = Metadata(run_id=run_id, 
@@ -120,35 +87,36 @@ if __name__ == "__main__":
                         raw_output_link= f"https://model-service.worldmodelers.com/result_file/{run_id}.tif",
                         run_label=model_name.replace('_', ' ').title(),
                         point_resolution_meters=2000)
-        db_session.add(meta)
-        db_session.commit()
             
+        # warp once per model; all 4 bands share the warped grid and
+        # therefore the same cached admin grid
+        ds = warp_raster(f"data/{atlas_lookup[model_name]['tif']}")
+        admin_grid = load_admin_grid(ds, config['GADM']['ADMIN_GRID_PATH'], load_admin2)
+
         # iterate over the 4 bands
-        for band, years in bands.items():
-            print(f"Processing {model_name} band {band}")
-            # Convert Raster to GeoPandas
-            InRaster = f"data/{atlas_lookup[model_name]['tif']}"
-            feature_name = atlas_lookup[model_name]['feature_name']
-            feature_description = atlas_lookup[model_name]['feature_description']
-            gdf = raster2gpd(InRaster,feature_name,band=band)
-
-            print(f"Performing spatial merge")
-            # Spatial merge on GADM to obtain admin areas
-            gdf = gpd.sjoin(gdf, admin2, how="left", op='intersects')
-            
-            # Iterate over years for each band to ensure that there is continous
-            # annual data
-            for year in years:
-                # Set run fields: datetime, run_id, model
-                gdf['datetime'] = datetime(year=year, month=1, day=1)
-                gdf['run_id'] = run_id
-                gdf['model'] = model_config['name']
-                gdf['feature_description'] = feature_description
-                if 'geometry' in gdf:
-                    del(gdf['geometry'])
-                    del(gdf['index_right'])
-
-                # perform bulk insert of entire geopandas DF
-                print(f"Ingesting {year} of {model_name} to database\n")
-                db_session.bulk_insert_mappings(Output, gdf.to_dict(orient="records"))
-                db_session.commit()
\ No newline at end of file
+        with register_run(meta) as loader:
+            for band, years in bands.items():
+                print(f"Processing {model_name} band {band}")
+                # Convert Raster to points, one chunk at a time
+                feature_name = atlas_lookup[model_name]['feature_name']
+                feature_description = atlas_lookup[model_name]['feature_description']
+                chunks = raster.iter_raster_chunks(ds,feature_name,band=band,
+                                                   chunk_size=int(config['INGEST']['CHUNK_SIZE']),
+                                                   geometry=False,keep_index=True)
+
+                for gdf in chunks:
+                    # Look up admin areas from the admin grid
+                    gdf = admin_grid.attach(gdf)
+
+                    # Iterate over years for each band to ensure that there is continous
+                    # annual data
+                    for year in years:
+                        # Set run fields: datetime, run_id, model
+                        gdf['datetime'] = datetime(year=year, month=1, day=1)
+                        gdf['run_id'] = run_id
+                        gdf['model'] = model_config['name']
+                        gdf['feature_description'] = feature_description
+
+                        # copy the chunk into the output table
+                        print(f"Ingesting {len(gdf)} points of {year} of {model_name} to database\n")
+                        loader.copy(gdf)
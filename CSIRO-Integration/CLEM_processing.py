@@ -6,8 +6,11 @@ sys.path.append("../db")
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id, run_exists
+from run_index import add_run
+from loader import register_run
 
 import pandas as pd
 import geopandas as gpd
@@ -19,8 +22,6 @@ import configparser
 import redis
 import boto3
 from datetime import datetime
-from collections import OrderedDict
-from hashlib import sha256
 import urllib.request
 import time
 
@@ -73,11 +74,11 @@ def gen_run(model_name, params):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    model_config = canonical_config(model_config)
+    run_id = make_run_id(model_config)
 
-    # Add to model set in Redis
-    r.sadd(model_name, run_id)
+    # Add to model set in Redis and its timestamp index
+    add_run(r, model_name, run_id)
     
     run_obj = {'status': 'SUCCESS',
      'name': model_name,
@@ -113,20 +114,10 @@ def check_run_in_redis(model_name,scenarios,scen,crop_type):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()    
+    run_id = make_run_id(model_config)
 
-    # Check if run in Redis
-    return r.sismember(model_name, run_id), run_id
-
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res                                
+    # Check if run in Redis, also under the id it had before numbers were canonical
+    return run_exists(r, model_name, model_config), run_id
 
 def process_crops_(crops_, scen, crop_type, scenarios, clem):
     """
@@ -164,10 +155,9 @@ def process_crops_(crops_, scen, crop_type, scenarios, clem):
                     raw_output_link= f"https://model-service.worldmodelers.com/results/{model_name}_results/{run_id}.csv",
                     run_label=crops_.description.iloc[0],
                     point_resolution_meters=25000)
-    db_session.add(meta)
-    db_session.commit()
 
     # Add parameters to DB
+    parameters = []
     for param in clem['parameters']:
         try:
             # ensure that no null parameters are stored
@@ -186,8 +176,7 @@ def process_crops_(crops_, scen, crop_type, scenarios, clem):
                                   parameter_value=p_value,
                                   parameter_type=p_type
                                   )
-                db_session.add(param)
-                db_session.commit()
+                parameters.append(param)
         except:
             # skip LT historicals
             pass
@@ -200,7 +189,7 @@ def process_crops_(crops_, scen, crop_type, scenarios, clem):
         del(gdf['geometry'])
         del(gdf['index_right'])
         
-    return gdf, run_id
+    return gdf, run_id, meta, parameters
 
 
 ##################################################
@@ -321,18 +310,18 @@ if __name__ == "__main__":
                     # drop rows where yield fields are NA
                     crops_ = crops_.dropna(subset=['mean_kcal_intake_from_farm','percent_cereal_reqt_from_farm','mean_stored_supply','sales','demand'])
                     
-                    gdf, run_id = process_crops_(crops_, scen, crop_type, scenarios, clem)
+                    gdf, run_id, meta, parameters = process_crops_(crops_, scen, crop_type, scenarios, clem)
 
                     print(f"Processing {crop_type} with run_id {run_id}")
                         
-                    for feature in ['mean_kcal_intake_from_farm','percent_cereal_reqt_from_farm','mean_stored_supply','sales','demand']:
-                        gdf_ = gdf
-                        gdf_['feature_name'] = feature
-                        gdf_['feature_value'] = gdf_[feature]
-                        gdf_['feature_description'] = outputs[feature]['description']
-                        
-                        db_session.bulk_insert_mappings(Output, gdf_.to_dict(orient="records"))
-                        db_session.commit()    
+                    with register_run(meta, parameters) as loader:
+                        for feature in ['mean_kcal_intake_from_farm','percent_cereal_reqt_from_farm','mean_stored_supply','sales','demand']:
+                            gdf_ = gdf
+                            gdf_['feature_name'] = feature
+                            gdf_['feature_value'] = gdf_[feature]
+                            gdf_['feature_description'] = outputs[feature]['description']
+
+                            loader.copy(gdf_)
 
                 else: 
                     print(f"Run {run_id} already in Redis for scenario {scen}")
\ No newline at end of file
@@ -6,8 +6,11 @@ sys.path.append("../db")
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id, run_exists
+from run_index import add_run
+from loader import register_run
 
 import pandas as pd
 import geopandas as gpd
@@ -19,8 +22,6 @@ import configparser
 import redis
 import boto3
 from datetime import datetime
-from collections import OrderedDict
-from hashlib import sha256
 import urllib.request
 import time
 
@@ -67,11 +68,11 @@ def gen_run(model_name, params):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    model_config = canonical_config(model_config)
+    run_id = make_run_id(model_config)
 
-    # Add to model set in Redis
-    r.sadd(model_name, run_id)
+    # Add to model set in Redis and its timestamp index
+    add_run(r, model_name, run_id)
     
     run_obj = {'status': 'SUCCESS',
      'name': model_name,
@@ -102,20 +103,10 @@ def check_run_in_redis(model_name,scenarios,scen):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()    
+    run_id = make_run_id(model_config)
 
-    # Check if run in Redis
-    return r.sismember(model_name, run_id), run_id      
-
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res                                
+    # Check if run in Redis, also under the id it had before numbers were canonical
+    return run_exists(r, model_name, model_config), run_id      
 
 def process_herbage(herbage, scen, scenarios, grange):
     """
@@ -152,10 +143,9 @@ def process_herbage(herbage, scen, scenarios, grange):
                     raw_output_link= f"https://model-service.worldmodelers.com/results/{model_name}_results/{run_id}.csv",
                     run_label=herbage.description.iloc[0],
                     point_resolution_meters=25000)
-    db_session.add(meta)
-    db_session.commit()
 
     # Add parameters to DB
+    parameters = []
     for param in grange['parameters']:
         # ensure that no null parameters are stored
         if not pd.isna(params[param['name']]):
@@ -173,8 +163,7 @@ def process_herbage(herbage, scen, scenarios, grange):
                               parameter_value=p_value,
                               parameter_type=p_type
                               )
-            db_session.add(param)
-            db_session.commit()
+            parameters.append(param)
         
     gdf = gpd.GeoDataFrame(herbage)
     gdf = gpd.sjoin(gdf, admin2, how="left", op='intersects')
@@ -184,7 +173,7 @@ def process_herbage(herbage, scen, scenarios, grange):
         del(gdf['geometry'])
         del(gdf['index_right'])
         
-    return gdf, run_id
+    return gdf, run_id, meta, parameters
 
 
 ##################################################
@@ -268,19 +257,19 @@ if __name__ == "__main__":
             # drop rows where yield fields are NA
             # herbage = herbage.dropna(subset=['yield','rel_anomaly_yield'])
 
-            gdf, run_id = process_herbage(herbage_, scen, scenarios, grange)
+            gdf, run_id, meta, parameters = process_herbage(herbage_, scen, scenarios, grange)
 
             print(f"Processing G-Range with run_id {run_id}")
 
-            for feature in [i['name'] for i in grange['outputs']]:
-                gdf_ = gdf
-                gdf_['feature_name'] = feature
-                gdf_['feature_value'] = gdf_[feature]
-                gdf_['feature_description'] = outputs[feature]['description']
-                gdf_ = gdf_.dropna(subset=['feature_name','feature_value'])
+            with register_run(meta, parameters) as loader:
+                for feature in [i['name'] for i in grange['outputs']]:
+                    gdf_ = gdf
+                    gdf_['feature_name'] = feature
+                    gdf_['feature_value'] = gdf_[feature]
+                    gdf_['feature_description'] = outputs[feature]['description']
+                    gdf_ = gdf_.dropna(subset=['feature_name','feature_value'])
 
-                db_session.bulk_insert_mappings(Output, gdf_.to_dict(orient="records"))
-                db_session.commit()    
+                    loader.copy(gdf_)
 
         else:
             print(f"Run {run_id} already in Redis for scenario {scen}")
\ No newline at end of file
@@ -6,8 +6,11 @@ sys.path.append("../db")
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id, legacy_run_id, check_runs_exist
+from run_index import add_run
+from loader import register_run
 
 import pandas as pd
 import geopandas as gpd
@@ -19,8 +22,6 @@ import configparser
 import redis
 import boto3
 from datetime import datetime, timedelta
-from collections import OrderedDict
-from hashlib import sha256
 import urllib.request
 import shutil
 import time
@@ -60,11 +61,11 @@ def gen_run(model_name, params, file):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    model_config = canonical_config(model_config)
+    run_id = make_run_id(model_config)
 
-    # Add to model set in Redis
-    r.sadd(model_name, run_id)
+    # Add to model set in Redis and its timestamp index
+    add_run(r, model_name, run_id)
     
     run_obj = {'status': 'SUCCESS',
      'name': model_name,
@@ -82,28 +83,16 @@ def gen_run(model_name, params, file):
     return run_id, model_config, run_obj
 
 
-def check_run_in_redis(model_name, params):
-    
-    model_config = {
-                    'config': params,
-                    'name': model_name
-                   }
-
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
-
-    # Check if run in Redis
-    return r.sismember(model_name, run_id)
-      
+def runs_in_redis(model_name, params_list):
+    """
+    Whether the run of each of `params_list` is already in Redis.
+    """
+    model_configs = [{'config': params, 'name': model_name} for params in params_list]
+    # runs ingested before numbers were canonical are stored under their legacy id
+    return check_runs_exist(r, model_name,
+                            [make_run_id(c) for c in model_configs],
+                            [legacy_run_id(c) for c in model_configs])
 
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res                                
 
 def process_dssat(df, params, dssat, model_name, file):
     """
@@ -131,10 +120,9 @@ def process_dssat(df, params, dssat, model_name, file):
                     raw_output_link= f"https://model-service.worldmodelers.com/results/{model_name}_results/{file}",
                     run_label=df.RUN_NAME.iloc[0],
                     point_resolution_meters=10000)
-    db_session.add(meta)
-    db_session.commit()
 
     # Add parameters to DB
+    parameters = []
     for p_name, p_value in params.items():
         if p_name == 'rainfall':
             p_value = float(p_value)        
@@ -144,8 +132,7 @@ def process_dssat(df, params, dssat, model_name, file):
                           parameter_value=p_value,
                           parameter_type=param_types[p_name]
                           )
-        db_session.add(param)
-        db_session.commit()
+        parameters.append(param)
         
     gdf = gpd.GeoDataFrame(df)
     gdf = gpd.sjoin(gdf, admin2, how="left", op='intersects')
@@ -155,7 +142,7 @@ def process_dssat(df, params, dssat, model_name, file):
         del(gdf['geometry'])
         del(gdf['index_right'])
         
-    return gdf, run_id
+    return gdf, run_id, meta, parameters
 
 
 ##################################################
@@ -228,8 +215,8 @@ if __name__ == "__main__":
     ###############################
     for run_type, runs in all_runs.items():
         print(f"#####################\nPROCESSING {run_type} RUNS\n#####################\n\n")
+        candidates = []
         for filename in runs:
-            print(f"Processing {run_type} {filename}")
             if 'belg' in filename.lower():
                 season = "Belg"
             elif 'meher' in filename.lower():
@@ -261,11 +248,14 @@ if __name__ == "__main__":
                       'season': season,
                       'planting_window_shift': planting_window_shift,
                       'crop': crop}
+            candidates.append((filename, params))
 
+        # Ensure that runs are not already in Redis, checking them in one batch
+        in_redis = runs_in_redis(model_name, [params for filename, params in candidates])
 
-
-            # Ensure that run is not already in Redis
-            if not check_run_in_redis(model_name, params):
+        for (filename, params), exists in zip(candidates, in_redis):
+            print(f"Processing {run_type} {filename}")
+            if not exists:
                 print(params)
                 df = pd.read_csv(filename, index_col=False)
                 df['geometry'] = df.apply(lambda x: Point(x.LONGITUDE, x.LATITUDE), axis=1)
@@ -278,16 +268,16 @@ if __name__ == "__main__":
                 df['datetime'] = df.apply(lambda x: datetime(year=x.year, month=1, day=1) + timedelta(days=x.days-1), axis=1)
 
                 file = filename.split('/')[2]
-                gdf, run_id = process_dssat(df, params, dssat, model_name, file)
-                    
-                for feature in ['Production','HARVEST_AREA','HWAH']:
-                    gdf_ = gdf
-                    gdf_['feature_name'] = feature
-                    gdf_['feature_value'] = gdf_[feature]
-                    gdf_['feature_description'] = outputs[feature]['description']
+                gdf, run_id, meta, parameters = process_dssat(df, params, dssat, model_name, file)
                     
-                    db_session.bulk_insert_mappings(Output, gdf_.to_dict(orient="records"))
-                    db_session.commit()    
+                with register_run(meta, parameters) as loader:
+                    for feature in ['Production','HARVEST_AREA','HWAH']:
+                        gdf_ = gdf
+                        gdf_['feature_name'] = feature
+                        gdf_['feature_value'] = gdf_[feature]
+                        gdf_['feature_description'] = outputs[feature]['description']
+
+                        loader.copy(gdf_)
 
             else:
                 print(f"Run with params {params} already in Redis.")
\ No newline at end of file
@@ -8,19 +8,17 @@ if not sys.warnoptions:
 
 from database import init_db, db_session
 from models import Metadata, Output, Parameters
+from run_identity import canonical_config, make_run_id
 
 import pandas as pd
 import geopandas as gpd
 import numpy as np
 import shapely.geometry
-import json
 import yaml
 import configparser
 import redis
 import boto3
 from datetime import datetime, timedelta
-from collections import OrderedDict
-from hashlib import sha256
 import urllib.request
 import shutil
 import time
@@ -60,20 +58,11 @@ def gen_run_id(model_name, params):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    model_config = canonical_config(model_config)
+    run_id = make_run_id(model_config)
 
     return run_id
 
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res                                
-
 
 ##################################################
 #### DATA PREPARATION AND PREPROCESSING STEPS ####
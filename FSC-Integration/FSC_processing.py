@@ -6,8 +6,11 @@ sys.path.append("../db")
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id
+from run_index import add_run
+from loader import register_run
 
 import pandas as pd
 import json
@@ -16,8 +19,6 @@ import configparser
 import redis
 import boto3
 from datetime import datetime
-from collections import OrderedDict
-from hashlib import sha256
 import urllib.request
 import shutil
 import time
@@ -38,15 +39,6 @@ s3 = session.resource("s3")
 s3_client = session.client("s3")
 s3_bucket= s3.Bucket(bucket)
 
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res
-
 def generate_impact_level(row):
     if row.dR == 0 and row.dC == 0:
         return 0 #"No Impact"
@@ -63,12 +55,12 @@ def gen_run(model_name, params, input_file):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
+    model_config = canonical_config(model_config)
 
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    run_id = make_run_id(model_config)
     print(run_id)
-    # Add to model set in Redis
-    r.sadd(model_name, run_id)
+    # Add to model set in Redis and its timestamp index
+    add_run(r, model_name, run_id)
     
     run_obj = {'status': 'SUCCESS',
      'name': model_name,
@@ -97,10 +89,9 @@ def ingest2db(df_, fsc, params, run_id, model_name):
                     raw_output_link= f"https://model-service.worldmodelers.com/results/{model_name}_results/{run_id}.csv",
                     run_label=f"{model_name} run for {params['shocked_region']} region.",
                     point_resolution_meters=100000)
-    db_session.add(meta)
-    db_session.commit()
 
     # Add parameters to DB
+    parameters = []
     for pp, vv in params.items():
         param = Parameters(run_id=run_id,
                           model=model_name,
@@ -108,8 +99,7 @@ def ingest2db(df_, fsc, params, run_id, model_name):
                           parameter_value=vv,
                           parameter_type="string"
                           )
-        db_session.add(param)
-        db_session.commit()    
+        parameters.append(param)
 
     # Ingest outputs to DB
     feature_name = fsc['outputs'][0]['name']
@@ -121,8 +111,8 @@ def ingest2db(df_, fsc, params, run_id, model_name):
     df_['feature_description'] = feature_description
     df_['feature_value'] = df_[feature_name].apply(lambda x: int(x))
 
-    db_session.bulk_insert_mappings(Output, df_.to_dict(orient="records"))
-    db_session.commit()         
+    with register_run(meta, parameters) as loader:
+        loader.copy(df_)
 
 if __name__ == "__main__":
     init_db()
@@ -1,12 +1,16 @@
 import sys
 import warnings
 sys.path.append("../db")
+sys.path.append("../REST-Server")
 
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id
+from loader import register_run
+from openapi_server import gadm
 
 import geopandas as gpd
 from shapely.geometry import Point
@@ -16,10 +20,7 @@ from netCDF4 import Dataset
 import datetime
 import pandas as pd
 import numpy as np
-import json
 import csv
-from collections import OrderedDict
-from hashlib import sha256
 import configparser
 
 config = configparser.ConfigParser()
@@ -63,20 +64,11 @@ def gen_run_id(year):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
+    model_config = canonical_config(model_config)
 
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    run_id = make_run_id(model_config)
     return run_id
 
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res
-
 def gen_monthly(file_name):
     rootgrp = Dataset(f"flood_results/{file_name}", "r", format="NETCDF4")
     time_var = rootgrp.variables['time']
@@ -127,13 +119,7 @@ def ingest2db(year, df, filename):
     init_db()
 
     # Load Admin2 shape from GADM
-    print("Loading GADM shapes...")
-    admin2 = gpd.read_file(f"{config['GADM']['GADM_PATH']}/gadm36_2.shp")
-    admin2['country'] = admin2['NAME_0']
-    admin2['state'] = admin2['NAME_1']
-    admin2['admin1'] = admin2['NAME_1']
-    admin2['admin2'] = admin2['NAME_2']
-    admin2 = admin2[['geometry','country','state','admin1','admin2']]
+    admin2 = gadm.load_admin2(config['GADM']['GADM_PATH'])
 
     # Add metadata object to DB
     # TODO: add run_label and run_description
@@ -145,10 +131,9 @@ def ingest2db(year, df, filename):
                     # 0.1 degrees (~10km)
                     point_resolution_meters=10000) 
     print("Storing metadata...")
-    db_session.add(meta)
-    db_session.commit()
 
     # Add parameters to DB
+    parameters = []
     print("Storing parameters...")
     param = Parameters(run_id=run_id,
                       model=model_name,
@@ -156,8 +141,7 @@ def ingest2db(year, df, filename):
                       parameter_value=year,
                       parameter_type="integer"
                       )
-    db_session.add(param)
-    db_session.commit()
+    parameters.append(param)
 
     # Process CSV and normalize it
     print("Processing points...")
@@ -180,18 +164,18 @@ def ingest2db(year, df, filename):
     # Need to iterate over features to generate one GDF per feature
     # then upload the GDF per feature to ensure that rows are added for each
     # feature
-    for feature_name, feature_description in features.items():
-        cols_to_select = base_cols + [feature_name]
-        gdf_ = gdf[cols_to_select] # generate new interim GDF
-        gdf_['feature_name'] = feature_name
-        gdf_['feature_description'] = feature_description
-        gdf_['feature_value'] = gdf_[feature_name]
-        gdf_ = gdf_[base_cols + feature_cols]
-
-        # perform bulk insert of entire geopandas DF
-        print(f"Storing point data output for {feature_name}...")
-        db_session.bulk_insert_mappings(Output, gdf_.to_dict(orient="records"))
-        db_session.commit()
+    with register_run(meta, parameters) as loader:
+        for feature_name, feature_description in features.items():
+            cols_to_select = base_cols + [feature_name]
+            gdf_ = gdf[cols_to_select] # generate new interim GDF
+            gdf_['feature_name'] = feature_name
+            gdf_['feature_description'] = feature_description
+            gdf_['feature_value'] = gdf_[feature_name]
+            gdf_ = gdf_[base_cols + feature_cols]
+
+            # perform bulk insert of entire geopandas DF
+            print(f"Storing point data output for {feature_name}...")
+            loader.copy(gdf_)
 
 if __name__ == "__main__":
 
@@ -2,7 +2,6 @@ import boto3
 import os
 import shutil
 import configparser
-import logging
 import redis
 import yaml
 import glob
@@ -11,28 +10,29 @@ import sys
 import os
 import warnings
 sys.path.append("../db")
+sys.path.append("../REST-Server")
 
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id, run_exists
+from run_index import add_run
+from loader import register_run
+from openapi_server import raster
+from openapi_server import gadm
 
-from shapely.geometry import Point
 import geopandas as gpd
 import rasterio
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 from pyproj import Proj, transform
 import pandas as pd
 import numpy as np
-from osgeo import gdal
-from osgeo import gdalconst
 import tarfile
 
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from hashlib import sha256
-from collections import OrderedDict
 import json
 import urllib.request
 
@@ -66,56 +66,19 @@ def raster2gpd(InRaster,feature_name,band=1,nodataval=-9999):
     '''
     Description: 
         Takes the path of a raster (.tiff) file and produces a Geopandas Data Frame.
+        Note that `nodataval` is always used, even if the raster sets its own.
     Params:
         - InRaster: the path of the input raster file
         - feature_name: the name of the feature represented by the pixel values 
     '''
+    columns = raster.raster2columns(InRaster,band=band,nodataval=np.float64(nodataval),
+                                    ignore_band_nodata=True)
+
+    # ROUND LAT/LON to 1 DECIMAL DEGREE
+    columns['longitude'] = np.round(columns['longitude'], 1)
+    columns['latitude'] = np.round(columns['latitude'], 1)
+    return raster.columns2gpd(columns, feature_name)
 
-    # open the raster and get some properties
-    ds       = gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
-    GeoTrans = ds.GetGeoTransform()
-    ColRange = range(ds.RasterXSize)
-    RowRange = range(ds.RasterYSize)
-    rBand    = ds.GetRasterBand(band) # first band
-    nData    = rBand.GetNoDataValue()
-    if nData == None:
-        logging.info(f"No nodataval found, setting to {nodataval}")
-        nData = np.float64(nodataval) # set it to something if not set
-    else:
-        nData = np.float64(nodataval)
-        logging.info(f"Nodataval is: {nData}")
-
-    # specify the center offset (takes the point in middle of pixel)
-    HalfX    = GeoTrans[1] / 2
-    HalfY    = GeoTrans[5] / 2
-
-    # Check that NoDataValue is of the same type as the raster data
-    RowData = rBand.ReadAsArray(0,0,ds.RasterXSize,1)[0]
-    if type(nData) != type(RowData[0]):
-        logging.warning(f"NoData type mismatch: NoDataValue is type {type(nData)} and raster data is type {type(RowData[0])}")
-        
-
-    points = []
-    for ThisRow in RowRange:
-        RowData = rBand.ReadAsArray(0,ThisRow,ds.RasterXSize,1)[0]
-        for ThisCol in ColRange:
-            # need to exclude NaN values since there is no nodataval
-            if (RowData[ThisCol] != nData) and not (np.isnan(RowData[ThisCol])):
-                
-                # TODO: implement filters on valid pixels
-                # for example, the below would ensure pixel values are between -100 and 100
-                #if (RowData[ThisCol] <= 100) and (RowData[ThisCol] >= -100):
-
-                X = GeoTrans[0] + ( ThisCol * GeoTrans[1] )
-                Y = GeoTrans[3] + ( ThisRow * GeoTrans[5] ) # Y is negative so it's a minus
-                # this gives the upper left of the cell, offset by half a cell to get centre
-                X += HalfX
-                Y += HalfY
-
-                # ROUND LAT/LON to 1 DECIMAL DEGREE
-                points.append([Point(round(X,1), round(Y,1)),round(X,1),round(Y,1),RowData[ThisCol],feature_name])
-
-    return gpd.GeoDataFrame(points, columns=['geometry','longitude','latitude','feature_value','feature_name'])
 
 def ingest_to_db(InRaster, run_id, *,
                 model_name, params, m):
@@ -126,10 +89,9 @@ def ingest_to_db(InRaster, run_id, *,
                     raw_output_link= f"https://model-service.worldmodelers.com/results/{model_name}_results/{run_id}.tif",
                     run_label=f"{model_name} run.",
                     point_resolution_meters=1000000)
-    db_session.add(meta)
-    db_session.commit()
 
     # Add parameters to DB
+    parameters = []
     print("Storing parameters...")
     for pp, vv in params.items():
         if pp == 'year' or pp=='month':
@@ -143,8 +105,7 @@ def ingest_to_db(InRaster, run_id, *,
                           parameter_value=vv,
                           parameter_type=p_type
                           )
-        db_session.add(param)
-        db_session.commit()       
+        parameters.append(param)
       
     band = bands[params['commodity']]
     # Convert Raster to GeoPandas
@@ -172,8 +133,8 @@ def ingest_to_db(InRaster, run_id, *,
         del(gdf['index_right'])
 
     # perform bulk insert of entire geopandas DF
-    db_session.bulk_insert_mappings(Output, gdf.to_dict(orient="records"))
-    db_session.commit()    
+    with register_run(meta, parameters) as loader:
+        loader.copy(gdf)
 
 def gen_run(model_name, params):
     model_config = {
@@ -181,12 +142,12 @@ def gen_run(model_name, params):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
+    model_config = canonical_config(model_config)
 
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    run_id = make_run_id(model_config)
     print(run_id)
-    # Add to model set in Redis
-    r.sadd(model_name, run_id)
+    # Add to model set in Redis and its timestamp index
+    add_run(r, model_name, run_id)
     
     run_obj = {'status': 'SUCCESS',
      'name': model_name,
@@ -214,26 +175,15 @@ def check_run_in_redis(model_name, params):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
-    checked = r.sismember(model_name, run_id)
+    run_id = make_run_id(model_config)
+    # Check if run in Redis, also under the id it had before numbers were canonical
+    checked = run_exists(r, model_name, model_config)
     if checked:
         print(f"run_id {run_id} found in Redis")
     else:
         print(f"run_id {run_id} NOT found in Redis")
 
-    # Check if run in Redis
-    return r.sismember(model_name, run_id)
-
-          
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res
+    return checked
 
 def main(f, *, model_name, params, m):
     ingest_to_db(f, run_id, model_name=model_name, params=params, m=m)    
@@ -253,13 +203,7 @@ if __name__ == "__main__":
     print(files)
 
     # Load Admin2 shape from GADM
-    print("Loading GADM shapes...")
-    admin2 = gpd.read_file(f"{config['GADM']['GADM_PATH']}/gadm36_2.shp")
-    admin2['country'] = admin2['NAME_0']
-    admin2['state'] = admin2['NAME_1']
-    admin2['admin1'] = admin2['NAME_1']
-    admin2['admin2'] = admin2['NAME_2']
-    admin2 = admin2[['geometry','country','state','admin1','admin2']]   
+    admin2 = gadm.load_admin2(config['GADM']['GADM_PATH'])
 
     with open('../metadata/models/market-price-model-metadata.yaml', 'r') as stream:
         m = yaml.safe_load(stream)
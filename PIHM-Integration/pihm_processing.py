@@ -11,28 +11,29 @@ import sys
 import os
 import warnings
 sys.path.append("../db")
+sys.path.append("../REST-Server")
 
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id, run_exists
+from run_index import add_run
+from loader import register_run
+from openapi_server import raster
+from openapi_server import gadm
+from openapi_server.cog import upload_cog
 
-from shapely.geometry import Point
 import geopandas as gpd
 import rasterio
 from rasterio.warp import calculate_default_transform, reproject, Resampling
 from pyproj import Proj, transform
 import pandas as pd
-import numpy as np
-from osgeo import gdal
-from osgeo import gdalconst
 import tarfile
 
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from hashlib import sha256
-from collections import OrderedDict
 import json
 import urllib.request
 
@@ -76,10 +77,11 @@ def PIHM_reproject(InRaster, OutRaster):
                     dst_crs=dst_crs,
                     resampling=Resampling.nearest)
 
-def raster2gpd(InRaster,feature_name,band=1,nodataval=-9999):
+def raster2chunks(InRaster,feature_name,band=1,nodataval=-9999,chunk_size=raster.CHUNK_SIZE):
     '''
     Description: 
-        Takes the path of a raster (.tiff) file and produces a Geopandas Data Frame.
+        Takes the path of a raster (.tiff) file and streams it as Geopandas
+        Data Frames of at most `chunk_size` points, reprojected to WGS84.
     Params:
         - InRaster: the path of the input raster file
         - feature_name: the name of the feature represented by the pixel values 
@@ -91,50 +93,14 @@ def raster2gpd(InRaster,feature_name,band=1,nodataval=-9999):
 
     p2 = Proj(proj='latlong',datum='WGS84')
 
+    for gdf in raster.iter_raster_chunks(InRaster,feature_name,chunk_size=chunk_size,band=band,
+                                         nodataval=nodataval,geometry=False):
+        X, Y = gdf.longitude.values, gdf.latitude.values
+        T = transform(p1, p2, X, Y)
+        gdf['latitude'] = T[1]
+        gdf['longitude'] = T[0]
+        yield gpd.GeoDataFrame(gdf, geometry=gpd.points_from_xy(gdf.longitude, gdf.latitude))
 
-    # open the raster and get some properties
-    ds       = gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
-    GeoTrans = ds.GetGeoTransform()
-    ColRange = range(ds.RasterXSize)
-    RowRange = range(ds.RasterYSize)
-    rBand    = ds.GetRasterBand(band) # first band
-    nData    = np.float32(rBand.GetNoDataValue())
-    if nData == None:
-        print("No nodataval for raster")
-        nData = nodataval # set it to something if not set
-    else:
-        print("NoData value is {0}".format(nData))
-
-    # specify the center offset (takes the point in middle of pixel)
-    HalfX    = GeoTrans[1] / 2
-    HalfY    = GeoTrans[5] / 2
-
-    points = []
-    for ThisRow in RowRange:
-        RowData = rBand.ReadAsArray(0,ThisRow,ds.RasterXSize,1)[0]
-        for ThisCol in ColRange:
-            # need to exclude NaN values since there is no nodataval
-            if (np.float32(RowData[ThisCol]) != nData) and not (np.isnan(RowData[ThisCol])):
-
-                # TODO: implement filters on valid pixels
-                # for example, the below would ensure pixel values are between -100 and 100
-                #if (RowData[ThisCol] <= 100) and (RowData[ThisCol] >= -100):
-
-                X = GeoTrans[0] + ( ThisCol * GeoTrans[1] )
-                Y = GeoTrans[3] + ( ThisRow * GeoTrans[5] ) # Y is negative so it's a minus
-                # this gives the upper left of the cell, offset by half a cell to get centre
-                X += HalfX
-                Y += HalfY
-
-                points.append([X,Y,RowData[ThisCol],feature_name])
-
-    gdf = gpd.GeoDataFrame(points, columns=['longitude','latitude','feature_value','feature_name'])
-    X, Y = list(gdf.longitude), list(gdf.latitude)
-    T = transform(p1, p2, X, Y)
-    gdf['latitude'] = T[1]
-    gdf['longitude'] = T[0]
-    gdf['geometry'] = gdf.apply(lambda x: Point(x.longitude, x.latitude),axis=1)
-    return gdf
 
 def ingest_to_db(InRaster, run_id, *,
                 model_name, start, included_months, total_months,
@@ -146,10 +112,9 @@ def ingest_to_db(InRaster, run_id, *,
                     raw_output_link= f"https://model-service.worldmodelers.com/results/PIHM_results/{run_id}.tif",
                     run_label=f"{model_name} run for {basin} Basin.",
                     point_resolution_meters=200)
-    db_session.add(meta)
-    db_session.commit()
 
     # Add parameters to DB
+    parameters = []
     print("Storing parameters...")
     for pp, vv in params.items():
 
@@ -164,38 +129,37 @@ def ingest_to_db(InRaster, run_id, *,
                           parameter_value=vv,
                           parameter_type=p_type
                           )
-        db_session.add(param)
-        db_session.commit()        
+        parameters.append(param)
         
     # iterate over the bands that should be included (1 per month)
-    for month in range(1, included_months + 2):
-        date_ = start + relativedelta(months=month-1)
-        date_str = date_.strftime("%m/%d/%Y")        
-        print(f"Processing {model_name} {date_str}")
-        # Convert Raster to GeoPandas
-        feature_name = m['outputs'][0]['name']
-        feature_description = m['outputs'][0]['description']
-        gdf = raster2gpd(InRaster,feature_name,band=month)
-
-        print(f"Performing spatial merge")
-        # Spatial merge on GADM to obtain admin areas
-        gdf = gpd.sjoin(gdf, admin2, how="left", op='intersects')
-        
-        # Iterate over years for each band to ensure that there is continous
-        # annual data
-        # Set run fields: datetime, run_id, model
-        gdf['datetime'] = date_
-        gdf['run_id'] = run_id
-        gdf['model'] = model_name
-        gdf['feature_description'] = feature_description
-        if 'geometry' in gdf:
-            del(gdf['geometry'])
-            del(gdf['index_right'])
-
-        # perform bulk insert of entire geopandas DF
-        print(f"Ingesting {date_str} of {model_name} for basin {basin} to database\n")
-        db_session.bulk_insert_mappings(Output, gdf.to_dict(orient="records"))
-        db_session.commit()    
+    with register_run(meta, parameters) as loader:
+        for month in range(1, included_months + 2):
+            date_ = start + relativedelta(months=month-1)
+            date_str = date_.strftime("%m/%d/%Y")        
+            print(f"Processing {model_name} {date_str}")
+            # Convert Raster to GeoPandas
+            feature_name = m['outputs'][0]['name']
+            feature_description = m['outputs'][0]['description']
+            chunks = raster2chunks(InRaster,feature_name,band=month,
+                                   chunk_size=int(config['INGEST']['CHUNK_SIZE']))
+
+            for gdf in chunks:
+                print(f"Performing spatial merge")
+                # Spatial merge on GADM to obtain admin areas
+                gdf = gpd.sjoin(gdf, admin2, how="left", op='intersects')
+
+                # Set run fields: datetime, run_id, model
+                gdf['datetime'] = date_
+                gdf['run_id'] = run_id
+                gdf['model'] = model_name
+                gdf['feature_description'] = feature_description
+                if 'geometry' in gdf:
+                    del(gdf['geometry'])
+                    del(gdf['index_right'])
+
+                # copy the chunk into the output table
+                print(f"Ingesting {len(gdf)} points of {date_str} of {model_name} for basin {basin} to database\n")
+                loader.copy(gdf)
 
 def gen_run(input_file, *, model_name, precipitation, temperature, evapotranspiration, basin):
     model_config = {
@@ -208,12 +172,12 @@ def gen_run(input_file, *, model_name, precipitation, temperature, evapotranspir
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
+    model_config = canonical_config(model_config)
 
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    run_id = make_run_id(model_config)
     print(run_id)
-    # Add to model set in Redis
-    r.sadd(model_name, run_id)
+    # Add to model set in Redis and its timestamp index
+    add_run(r, model_name, run_id)
     
     run_obj = {'status': 'SUCCESS',
      'name': model_name,
@@ -227,7 +191,7 @@ def gen_run(input_file, *, model_name, precipitation, temperature, evapotranspir
     
     # Upload file to S3
     print(f"Uploading {run_obj['key']}...")
-    s3_bucket.upload_file(input_file, run_obj['key'], ExtraArgs={'ACL':'public-read'})
+    upload_cog(s3_client, input_file, bucket, run_obj['key'], ExtraArgs={'ACL':'public-read'})
 
     # Create Redis object
     r.hmset(run_id, run_obj)
@@ -242,25 +206,15 @@ def check_run_in_redis(model_name, params):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
-    checked = r.sismember(model_name, run_id)
+    run_id = make_run_id(model_config)
+    # Check if run in Redis, also under the id it had before numbers were canonical
+    checked = run_exists(r, model_name, model_config)
     if checked:
         print(f"run_id {run_id} found in Redis")
     else:
         print(f"run_id {run_id} NOT found in Redis")
 
-    # Check if run in Redis
-    return r.sismember(model_name, run_id)
-          
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res
+    return checked
 
 def diff_month(d1, d2):
     return (d1.year - d2.year) * 12 + d1.month - d2.month
@@ -326,13 +280,7 @@ if __name__ == "__main__":
     init_db()
 
     # Load Admin2 shape from GADM
-    print("Loading GADM shapes...")
-    admin2 = gpd.read_file(f"{config['GADM']['GADM_PATH']}/gadm36_2.shp")
-    admin2['country'] = admin2['NAME_0']
-    admin2['state'] = admin2['NAME_1']
-    admin2['admin1'] = admin2['NAME_1']
-    admin2['admin2'] = admin2['NAME_2']
-    admin2 = admin2[['geometry','country','state','admin1','admin2']]   
+    admin2 = gadm.load_admin2(config['GADM']['GADM_PATH'])
 
     with open('../metadata/models/PIHM-model-metadata.yaml', 'r') as stream:
         m = yaml.safe_load(stream)
@@ -0,0 +1,97 @@
+"""
+Compares FSC run latency in a container of its own (cold: create, start,
+run, remove) against `docker exec` in a warm pool container, reporting the
+p50/p95 of each. Only the model itself is timed, not storing or ingesting
+its output.
+
+Needs the Docker daemon with the `fsc/latest` image, and Redis for the log
+lines the runs publish (a scratch database, flushed before and after).
+Outputs are written to a temporary directory. Usage (from the REST-Server
+directory):
+
+    python benchmarks/fsc_warm_pool_benchmark.py --runs 20 --db 15
+"""
+import argparse
+import configparser
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import docker
+import redis
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from openapi_server.docker_run import run_container, run_exec
+from openapi_server.warm_pool import lease_container, release_container
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+IMAGE = 'fsc/latest'
+SUCCESS_MSG = 'Writing output of'
+POOL = 'fsc-benchmark'
+
+
+def command(result_name):
+    return f"Rscript /main/main.R 2005 USA 0.4 0.5 {result_name}"
+
+
+def cold(client, r, volumes, result_name):
+    name = f"{POOL}-{result_name}"
+    try:
+        return run_container(client.containers, r, result_name, IMAGE, SUCCESS_MSG,
+                             volumes=volumes, entrypoint=command(result_name), name=name)[0]
+    finally:
+        client.containers.get(name).remove()
+
+
+def warm(client, r, volumes, result_name):
+    container = lease_container(client, r, POOL, IMAGE, 1, result_name, volumes=volumes)
+    try:
+        return run_exec(client, r, result_name, container, command(result_name), SUCCESS_MSG)[0]
+    finally:
+        release_container(r, container.name, result_name)
+
+
+def percentile(timings, p):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(round(p / 100 * (len(timings) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='runs timed per mode')
+    parser.add_argument('--host', default=config['REDIS']['HOST'])
+    parser.add_argument('--port', type=int, default=int(config['REDIS']['PORT']))
+    parser.add_argument('--db', type=int, default=15,
+                        help='scratch Redis database, flushed before and after')
+    args = parser.parse_args()
+
+    client = docker.from_env()
+    r = redis.Redis(host=args.host, port=args.port, db=args.db)
+    r.flushdb()
+    output_path = tempfile.mkdtemp(prefix='fsc-benchmark-')
+    volumes = {output_path: {'bind': '/outputs', 'mode': 'rw'}}
+    try:
+        # start the warm container before timing, as a running pool would be
+        release_container(r, lease_container(client, r, POOL, IMAGE, 1, 'start', volumes=volumes).name, 'start')
+        for mode, f in [('cold', cold), ('warm', warm)]:
+            timings = []
+            for i in range(args.runs):
+                start = time.perf_counter()
+                assert f(client, r, volumes, f"benchmark-{mode}-{i}"), f"{mode} run {i} failed"
+                timings.append(time.perf_counter() - start)
+            print(f"{mode:5s} p50 {statistics.median(timings):8.2f}s  p95 {percentile(timings, 95):8.2f}s")
+    finally:
+        client.containers.get(f"{POOL}-warm-0").remove(force=True)
+        shutil.rmtree(output_path, ignore_errors=True)
+        r.flushdb()
+
+
+if __name__ == "__main__":
+    main()
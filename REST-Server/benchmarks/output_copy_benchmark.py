@@ -0,0 +1,106 @@
+"""
+Compares loading model output rows with bulk_insert_mappings (one dict per
+row through SQLAlchemy's executemany) against the COPY based OutputLoader
+in db/loader.py.
+
+Run it against a throwaway database, e.g. a local PostGIS container:
+
+    docker run -d --name bench-db -p 5432:5432 -e POSTGRES_PASSWORD=postgres mdillon/postgis
+
+then point the [DATABASE] section of config.ini at it and run (from the
+REST-Server directory):
+
+    python benchmarks/output_copy_benchmark.py --rows 500000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'db'))
+
+from database import init_db, db_session
+from models import Metadata, Output
+from loader import OutputLoader
+
+RUN_ID = 'output-copy-benchmark'
+
+
+def make_chunks(rows, chunk_size, seed=0):
+    """
+    Synthetic output chunks shaped like the ones the raster ingest produces.
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_size):
+        n = min(chunk_size, rows - start)
+        yield pd.DataFrame({'longitude': rng.uniform(33, 48, n),
+                            'latitude': rng.uniform(3, 15, n),
+                            'feature_value': rng.random(n, dtype=np.float32) * 100,
+                            'feature_name': 'Rainfall',
+                            'country': 'Ethiopia',
+                            'state': 'Oromia',
+                            'admin1': 'Oromia',
+                            'admin2': 'Arsi',
+                            'datetime': datetime(2019, 1, 1),
+                            'run_id': RUN_ID,
+                            'model': 'benchmark',
+                            'feature_description': 'synthetic output'})
+
+
+def bulk_insert(chunks):
+    for gdf in chunks:
+        db_session.bulk_insert_mappings(Output, gdf.to_dict(orient="records"))
+        db_session.commit()
+
+
+def copy(chunks):
+    with OutputLoader() as loader:
+        for gdf in chunks:
+            loader.copy(gdf)
+
+
+def clear():
+    db_session.query(Output).filter(Output.run_id == RUN_ID).delete()
+    db_session.commit()
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500000,
+                        help='number of output rows to load')
+    parser.add_argument('--chunk-size', type=int, default=100000,
+                        help='rows per chunk')
+    args = parser.parse_args()
+
+    init_db()
+    if not db_session.query(Metadata).filter(Metadata.run_id == RUN_ID).count():
+        db_session.add(Metadata(run_id=RUN_ID, model='benchmark'))
+        db_session.commit()
+    clear()
+
+    try:
+        for name, f in [('bulk_insert_mappings', bulk_insert), ('COPY', copy)]:
+            elapsed = timed(f, make_chunks(args.rows, args.chunk_size))
+            stored = db_session.query(Output).filter(Output.run_id == RUN_ID).count()
+            assert stored == args.rows, (name, stored)
+            print(f"{name:22s} {elapsed:8.2f}s  {args.rows / elapsed:12,.0f} rows/s")
+            clear()
+    finally:
+        clear()
+        db_session.query(Metadata).filter(Metadata.run_id == RUN_ID).delete()
+        db_session.commit()
+
+
+if __name__ == "__main__":
+    main()
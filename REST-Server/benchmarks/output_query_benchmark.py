@@ -0,0 +1,92 @@
+"""
+Times the typical queries against the output table: by run, by run and
+feature over a date range, by model and feature, by admin region and by
+bounding box. Run it before and after db/db-setup/partition_output.sql to
+compare the unpartitioned heap against the partitioned, indexed table.
+
+Usage (from the REST-Server directory, against the database in config.ini):
+
+    python benchmarks/output_query_benchmark.py --repeat 5
+"""
+import argparse
+import configparser
+import statistics
+import time
+
+import psycopg2
+
+config = configparser.ConfigParser()
+config.read('./config.ini')
+
+
+def sample(cur):
+    """
+    Picks a run, feature, model and admin region which exist in the table
+    to parameterize the queries with.
+    """
+    cur.execute("SELECT run_id, feature_name, model, country, admin1, admin2, "
+                "longitude, latitude FROM output "
+                "WHERE admin2 IS NOT NULL LIMIT 1;")
+    row = cur.fetchone()
+    if row is None:
+        raise SystemExit("The output table has no rows to benchmark against")
+    keys = ['run_id', 'feature_name', 'model', 'country', 'admin1', 'admin2', 'x', 'y']
+    return dict(zip(keys, row))
+
+
+def has_geom(cur):
+    cur.execute("SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = 'output' AND column_name = 'geom';")
+    return cur.fetchone() is not None
+
+
+def queries(geom):
+    q = {
+        'run': "SELECT count(*) FROM output WHERE run_id = %(run_id)s;",
+        'run+feature+datetime': "SELECT datetime, avg(feature_value) FROM output "
+                                "WHERE run_id = %(run_id)s AND feature_name = %(feature_name)s "
+                                "AND datetime >= '1900-01-01' GROUP BY datetime;",
+        'model+feature': "SELECT count(*) FROM output "
+                         "WHERE model = %(model)s AND feature_name = %(feature_name)s;",
+        'admin region': "SELECT count(*) FROM output WHERE country = %(country)s "
+                        "AND admin1 = %(admin1)s AND admin2 = %(admin2)s;",
+    }
+    if geom:
+        q['bbox'] = "SELECT count(*) FROM output WHERE geom && "\
+                    "ST_MakeEnvelope(%(x)s - 0.5, %(y)s - 0.5, %(x)s + 0.5, %(y)s + 0.5, 4326);"
+    else:
+        q['bbox'] = "SELECT count(*) FROM output "\
+                    "WHERE longitude BETWEEN %(x)s - 0.5 AND %(x)s + 0.5 "\
+                    "AND latitude BETWEEN %(y)s - 0.5 AND %(y)s + 0.5;"
+    return q
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of times each query is run')
+    args = parser.parse_args()
+
+    con = psycopg2.connect(database=config["DATABASE"]["DB"], user=config["DATABASE"]["USER"],
+                           password=config["DATABASE"]["PASSWORD"], host=config["DATABASE"]["URL"],
+                           port=config["DATABASE"]["PORT"])
+    cur = con.cursor()
+    params = sample(cur)
+    geom = has_geom(cur)
+    print(f"Sampled run {params['run_id']} ({'geom' if geom else 'no geom'} column)")
+
+    for name, sql in queries(geom).items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            cur.execute(sql, params)
+            cur.fetchall()
+            timings.append(time.perf_counter() - start)
+        print(f"{name:22s} median {statistics.median(timings) * 1000:10.1f}ms  "
+              f"min {min(timings) * 1000:10.1f}ms")
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
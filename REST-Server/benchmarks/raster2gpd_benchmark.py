@@ -0,0 +1,122 @@
+"""
+Compares the row-by-row raster2gpd loop that the controllers used to run
+against the vectorized, block-windowed engine in openapi_server.raster.
+
+Usage (from the REST-Server directory):
+
+    python benchmarks/raster2gpd_benchmark.py --size 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import geopandas as gpd
+from shapely.geometry import Point
+from osgeo import gdal
+from osgeo import gdalconst
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from openapi_server.raster import raster2gpd
+
+
+def raster2gpd_rowwise(InRaster,feature_name,band=1,nodataval=-9999):
+    '''
+    Description:
+        The original per-pixel implementation of raster2gpd, kept here as the
+        reference the vectorized engine is checked against.
+    '''
+    ds       = gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
+    GeoTrans = ds.GetGeoTransform()
+    ColRange = range(ds.RasterXSize)
+    RowRange = range(ds.RasterYSize)
+    rBand    = ds.GetRasterBand(band)
+    nData    = rBand.GetNoDataValue()
+    if nData == None:
+        nData = np.float32(nodataval)
+
+    HalfX    = GeoTrans[1] / 2
+    HalfY    = GeoTrans[5] / 2
+
+    points = []
+    for ThisRow in RowRange:
+        RowData = rBand.ReadAsArray(0,ThisRow,ds.RasterXSize,1)[0]
+        for ThisCol in ColRange:
+            if (RowData[ThisCol] != nData) and not (np.isnan(RowData[ThisCol])):
+                X = GeoTrans[0] + ( ThisCol * GeoTrans[1] )
+                Y = GeoTrans[3] + ( ThisRow * GeoTrans[5] )
+                X += HalfX
+                Y += HalfY
+                points.append([Point(X, Y),X,Y,RowData[ThisCol],feature_name])
+
+    return gpd.GeoDataFrame(points, columns=['geometry','longitude','latitude','feature_value','feature_name'])
+
+
+def make_raster(path, size, nodata_fraction=0.3, nodataval=-9999, seed=0):
+    """
+    Write a synthetic single band, tiled float32 GeoTIFF on a 0.05 degree
+    grid (the CHIRPS resolution) with a mix of NoData and NaN pixels.
+    """
+    rng = np.random.default_rng(seed)
+    data = rng.random((size, size), dtype=np.float32) * 100
+    data[rng.random((size, size)) < nodata_fraction] = nodataval
+    data[rng.random((size, size)) < 0.01] = np.nan
+
+    driver = gdal.GetDriverByName('GTiff')
+    ds = driver.Create(path, size, size, 1, gdal.GDT_Float32,
+                       options=['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256'])
+    ds.SetGeoTransform((-20.0, 0.05, 0, 40.0, 0, -0.05))
+    band = ds.GetRasterBand(1)
+    band.SetNoDataValue(nodataval)
+    band.WriteArray(data)
+    band.FlushCache()
+    ds = None
+
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=5000,
+                        help='width and height of the synthetic raster in pixels')
+    parser.add_argument('--skip-rowwise', action='store_true',
+                        help='only time the vectorized engine')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'synthetic.tif')
+        make_raster(path, args.size)
+        print(f"Synthetic raster: {args.size}x{args.size} pixels")
+
+        columns, t_columns = timed(raster2gpd, path, 'Rainfall', geometry=False)
+        print(f"vectorized (no geometry): {t_columns:8.2f}s  {len(columns)} rows")
+
+        vectorized, t_vectorized = timed(raster2gpd, path, 'Rainfall')
+        print(f"vectorized (geometry):    {t_vectorized:8.2f}s  {len(vectorized)} rows")
+
+        if args.skip_rowwise:
+            return
+
+        rowwise, t_rowwise = timed(raster2gpd_rowwise, path, 'Rainfall')
+        print(f"row-by-row:               {t_rowwise:8.2f}s  {len(rowwise)} rows")
+        print(f"speedup: {t_rowwise / t_vectorized:.1f}x (geometry), "
+              f"{t_rowwise / t_columns:.1f}x (no geometry)")
+
+        assert len(rowwise) == len(vectorized)
+        for col in ['longitude', 'latitude', 'feature_value']:
+            assert np.array_equal(rowwise[col].values.astype(np.float64),
+                                  vectorized[col].values.astype(np.float64)), col
+        assert rowwise.geometry.geom_equals(vectorized.geometry).all()
+        print("Results match")
+
+
+if __name__ == "__main__":
+    main()
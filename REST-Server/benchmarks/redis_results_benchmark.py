@@ -0,0 +1,100 @@
+"""
+Compares the Redis access patterns behind /available_results and
+/list_models: one round trip per run or model (the previous controllers)
+against a single pipelined or MGET round trip (the current controllers).
+
+Populates a scratch Redis database with synthetic runs, so point it at a
+local Redis, e.g. `docker run -d -p 6379:6379 redis`, and a database that
+holds nothing else. Usage (from the REST-Server directory):
+
+    python benchmarks/redis_results_benchmark.py --runs 5000 --db 15
+"""
+import argparse
+import json
+import statistics
+import time
+
+import redis
+
+MODEL = 'BENCHMARK'
+
+
+def populate(r, runs, models):
+    pipe = r.pipeline(transaction=False)
+    for i in range(runs):
+        run_id = f"benchmark-run-{i}"
+        pipe.hmset(run_id, {'config': json.dumps({'rainfall': i}),
+                            'status': 'SUCCESS',
+                            'name': MODEL,
+                            'bucket': 'world-modelers',
+                            'key': f"results/{run_id}.csv",
+                            'timestamp': round(time.time()*1000,0)})
+        pipe.sadd(MODEL, run_id)
+    for i in range(models):
+        pipe.set(f"benchmark-model-{i}-meta", json.dumps({'id': f"benchmark-model-{i}"}))
+        pipe.sadd('benchmark-model-list', f"benchmark-model-{i}")
+    pipe.execute()
+
+
+def runs_sequential(r):
+    runs = []
+    for run_id in r.smembers(MODEL):
+        if r.exists(run_id):
+            runs.append(r.hgetall(run_id))
+    return runs
+
+
+def runs_pipelined(r):
+    run_ids = list(r.smembers(MODEL))
+    pipe = r.pipeline(transaction=False)
+    for run_id in run_ids:
+        pipe.hgetall(run_id)
+    return [run for run in pipe.execute() if run]
+
+
+def models_sequential(r):
+    return [r.get(f"{m.decode('utf-8')}-meta") for m in r.smembers('benchmark-model-list')]
+
+
+def models_mget(r):
+    ids = [m.decode('utf-8') for m in r.smembers('benchmark-model-list')]
+    return r.mget([f"{_id}-meta" for _id in ids])
+
+
+def timed(f, r, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f(r)
+        timings.append(time.perf_counter() - start)
+    return result, statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=15,
+                        help='scratch Redis database, flushed before and after')
+    parser.add_argument('--runs', type=int, default=5000)
+    parser.add_argument('--models', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    r = redis.Redis(host=args.host, port=args.port, db=args.db)
+    r.flushdb()
+    try:
+        populate(r, args.runs, args.models)
+        for name, f in [('available_results sequential', runs_sequential),
+                        ('available_results pipelined', runs_pipelined),
+                        ('list_models sequential', models_sequential),
+                        ('list_models MGET', models_mget)]:
+            result, elapsed = timed(f, r, args.repeat)
+            print(f"{name:30s} {elapsed * 1000:10.1f}ms  ({len(result)} items)")
+    finally:
+        r.flushdb()
+
+
+if __name__ == "__main__":
+    main()
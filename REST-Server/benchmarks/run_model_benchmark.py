@@ -0,0 +1,134 @@
+"""
+Times the request side of /run_model: registering the run in Redis and
+enqueuing its job (what run_model_post does now), against the same plus
+building the model's controller in the request (what it used to do).
+
+Building the controllers needs the Docker daemon, and the Kimetrica
+controller also starts the KiLuigi network and database container if they
+are not running. Jobs go to a scratch queue with no worker listening on a
+scratch Redis database, so no model is run. Usage (from the REST-Server
+directory):
+
+    python benchmarks/run_model_benchmark.py --requests 50 --db 15
+"""
+import argparse
+import configparser
+import json
+import os
+import statistics
+import sys
+import time
+from hashlib import sha256
+
+import redis
+from rq import Queue
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from openapi_server.kimetrica import KiController, run_kimetrica
+from openapi_server.fsc import FSCController, run_fsc
+from openapi_server.dssat import DSSATController, run_dssat
+from openapi_server.chirps import CHIRPSController, run_chirps
+from openapi_server.twist import TWISTController, run_twist
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+QUEUE = 'run-model-benchmark'
+
+
+def fsc(model_config):
+    return (run_fsc, (model_config, config['FSC']['OUTPUT_PATH']),
+            lambda: FSCController(model_config, config['FSC']['OUTPUT_PATH']))
+
+
+def dssat(model_config):
+    return (run_dssat, (model_config, config['DSSAT']['OUTPUT_PATH']),
+            lambda: DSSATController(model_config, config['DSSAT']['OUTPUT_PATH']))
+
+
+def chirps(model_config):
+    return (run_chirps, ('CHIRPS', model_config, config['CHIRPS']['OUTPUT_PATH']),
+            lambda: CHIRPSController('CHIRPS', model_config, config['CHIRPS']['OUTPUT_PATH']))
+
+
+def twist(model_config):
+    return (run_twist, (model_config,), lambda: TWISTController(model_config))
+
+
+def kimetrica(model_config):
+    full_config = {'name': 'malnutrition_model', 'config': model_config}
+    return (run_kimetrica, (full_config,), lambda: KiController(full_config))
+
+
+MODELS = {
+    'fsc': (fsc, {'year': 2010, 'country': 'Ethiopia', 'production_decrease': 0.2,
+                  'fractional_reserve_access': 0.5}),
+    'dssat': (dssat, {'management_practice': 'combined', 'samples': 10}),
+    'chirps': (chirps, {'dekad': '01', 'year': 2019, '_type': 'mm_data',
+                        'bbox': [33.512234, 2.719907, 49.98171, 16.501768]}),
+    'multi_twist': (twist, {'crop': 'wheat', 'start_year': 1975, 'end_year': 2019}),
+    'malnutrition_model': (kimetrica, {'year': 2018, 'month': 1, 'rainfall_scenario': 'normal',
+                                       'country': 'Ethiopia'}),
+}
+
+
+def submit(r, q, name, i, build):
+    """
+    The request side of one /run_model call for the i-th configuration;
+    the controller is built as well when `build` is set.
+    """
+    make, model_config = MODELS[name]
+    model_config = dict(model_config, benchmark=i)
+    run_id = sha256(json.dumps([name, model_config], sort_keys=True).encode('utf-8')).hexdigest()
+    model_config['run_id'] = run_id
+    f, args, controller = make(model_config)
+
+    timestamp = round(time.time()*1000,0)
+    pipe = r.pipeline()
+    pipe.hmset(run_id, {'config': json.dumps(model_config), 'status': 'PENDING',
+                        'name': name, 'timestamp': timestamp})
+    pipe.sadd(name, run_id)
+    pipe.zadd(f"{name}-by-time", {run_id: timestamp})
+    pipe.execute()
+    q.enqueue(f, *args, meta={'run_id': run_id})
+    if build:
+        controller()
+
+
+def percentile(timings, p):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(round(p / 100 * (len(timings) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=config['REDIS']['HOST'])
+    parser.add_argument('--port', type=int, default=int(config['REDIS']['PORT']))
+    parser.add_argument('--db', type=int, default=15,
+                        help='scratch Redis database, flushed before and after')
+    parser.add_argument('--requests', type=int, default=50,
+                        help='number of requests timed per model and mode')
+    parser.add_argument('--models', nargs='+', default=sorted(MODELS), choices=sorted(MODELS))
+    args = parser.parse_args()
+
+    r = redis.Redis(host=args.host, port=args.port, db=args.db)
+    q = Queue(QUEUE, connection=r)
+    r.flushdb()
+    try:
+        for name in args.models:
+            for mode, build in [('lazy', False), ('eager', True)]:
+                timings = []
+                for i in range(args.requests):
+                    start = time.perf_counter()
+                    submit(r, q, name, (mode, i), build)
+                    timings.append(time.perf_counter() - start)
+                print(f"{name:20s} {mode:6s} p50 {statistics.median(timings) * 1000:9.2f}ms  "
+                      f"p95 {percentile(timings, 95) * 1000:9.2f}ms")
+    finally:
+        r.flushdb()
+
+
+if __name__ == "__main__":
+    main()
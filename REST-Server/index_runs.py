@@ -0,0 +1,25 @@
+import configparser
+import sys
+
+import redis
+
+sys.path.append("../db")
+from run_index import rebuild
+
+# Rebuilds the timestamp index (`<model>-by-time`) of a model's runs from its
+# set of runs, e.g. for runs ingested before the ETL scripts maintained it:
+#
+#     python index_runs.py DSSAT
+
+config = configparser.ConfigParser()
+config.read('./config.ini')
+
+r = redis.Redis(host=config['REDIS']['HOST'],
+                port=config['REDIS']['PORT'],
+                db=config['REDIS']['DB'])
+
+MODEL = sys.argv[1]
+if MODEL.lower() in ['fsc','dssat','chirps','chirps-gefs','pihm']:
+    MODEL = MODEL.upper()
+
+print(f"Indexed {rebuild(r, MODEL)} runs of {MODEL}")
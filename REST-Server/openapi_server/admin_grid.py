@@ -0,0 +1,199 @@
+import os
+import json
+import logging
+from hashlib import sha256
+
+import numpy as np
+import pandas as pd
+from affine import Affine
+from rasterio import features
+from osgeo import gdal
+from osgeo import gdalconst
+
+from openapi_server.gadm import ADMIN_COLUMNS, clip
+
+logging.basicConfig(level=logging.INFO)
+
+# Bump this if the rasterization rules change so stale grids are not reused
+GRID_VERSION = 1
+
+# Admin grids already loaded by this process, keyed by grid key. This only
+# helps scripts ingesting many rasters in one process: RQ forks a work horse
+# for every job, which starts with the worker's (empty) dict
+_grids = {}
+
+
+def open_raster(InRaster):
+    if isinstance(InRaster, gdal.Dataset):
+        return InRaster
+    return gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
+
+
+def raster_grid(InRaster):
+    """
+    The (geotransform, CRS, shape) of a raster's grid.
+    """
+    ds = open_raster(InRaster)
+    return ds.GetGeoTransform(), ds.GetProjection(), (ds.RasterYSize, ds.RasterXSize)
+
+
+def grid_offset(grid, parent):
+    """
+    The (row, column) offset of `grid` within `parent`, both (geotransform,
+    CRS, shape) tuples, or None unless `grid` is a window of `parent`: the
+    same CRS and pixel size, whole pixel offsets, and within its extent.
+    """
+    GeoTrans, crs_wkt, shape = grid
+    pGeoTrans, pcrs_wkt, pshape = parent
+    if crs_wkt != pcrs_wkt or not np.allclose(GeoTrans[1:3] + GeoTrans[4:6],
+                                              pGeoTrans[1:3] + pGeoTrans[4:6],
+                                              rtol=0, atol=1e-9):
+        return None
+    if GeoTrans[2] != 0 or GeoTrans[4] != 0:
+        return None
+    col = (GeoTrans[0] - pGeoTrans[0]) / GeoTrans[1]
+    row = (GeoTrans[3] - pGeoTrans[3]) / GeoTrans[5]
+    if abs(col - round(col)) > 1e-6 or abs(row - round(row)) > 1e-6:
+        return None
+    row, col = int(round(row)), int(round(col))
+    if row < 0 or col < 0 or row + shape[0] > pshape[0] or col + shape[1] > pshape[1]:
+        return None
+    return row, col
+
+
+def grid_key(GeoTrans, crs_wkt, shape):
+    """
+    Stable identifier for a raster grid: its geotransform, CRS and shape.
+    Any two rasters sharing a key share the same admin grid.
+    """
+    grid = {'version': GRID_VERSION,
+            'geotransform': [float(g) for g in GeoTrans],
+            'crs': crs_wkt,
+            'shape': [int(s) for s in shape]}
+    return sha256(json.dumps(grid, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class AdminGrid(object):
+    """
+    An integer raster of admin unit ids aligned with a model output grid,
+    plus the table mapping those ids to GADM admin names. Id 0 means the
+    pixel centre does not fall within any admin unit.
+    """
+
+    def __init__(self, ids, admin):
+        self.ids = ids
+        self.admin = admin
+
+    def lookup(self, rows, cols):
+        """
+        Admin columns for the pixels at the given row/column indices,
+        gathered in one NumPy indexing operation.
+        """
+        idx = np.asarray(self.ids[rows, cols])
+        return {c: self.admin[c][idx] for c in ADMIN_COLUMNS}
+
+    def attach(self, df):
+        """
+        Adds the admin columns to a chunk of pixels carrying `row` and `col`
+        columns (see raster.iter_raster_chunks) and drops the indices.
+        """
+        for c, v in self.lookup(df['row'].values, df['col'].values).items():
+            df[c] = v
+        return df.drop(columns=['row','col'])
+
+    def window(self, row, col, shape):
+        """
+        The AdminGrid of a window of this grid, sharing its arrays.
+        """
+        ids = self.ids[row:row + shape[0], col:col + shape[1]]
+        return AdminGrid(ids, self.admin)
+
+
+def rasterize_admin(admin2, GeoTrans, crs_wkt, shape):
+    """
+    Burns admin2 polygons into an int32 grid of (1-based) admin ids. A pixel
+    gets the id of the polygon containing its centre, which is the same
+    point-in-polygon test the sjoin on pixel centres performs.
+    """
+    xmin = GeoTrans[0]
+    xmax = GeoTrans[0] + shape[1] * GeoTrans[1]
+    ymax = GeoTrans[3]
+    ymin = GeoTrans[3] + shape[0] * GeoTrans[5]
+    if crs_wkt and admin2.crs is not None:
+        admin2 = admin2.to_crs(crs_wkt)
+
+    # only polygons which overlap the raster need to be burned in
+    admin2 = clip(admin2, [min(xmin,xmax), min(ymin,ymax), max(xmin,xmax), max(ymin,ymax)])
+    admin2 = admin2.reset_index(drop=True)
+
+    ids = np.zeros(shape, dtype=np.int32)
+    if len(admin2) > 0:
+        shapes = zip(admin2.geometry, range(1, len(admin2) + 1))
+        ids = features.rasterize(shapes,
+                                 out_shape=shape,
+                                 transform=Affine.from_gdal(*GeoTrans),
+                                 fill=0,
+                                 all_touched=False,
+                                 dtype='int32')
+
+    # row 0 of the table is the "no admin unit" entry
+    admin = pd.concat([pd.DataFrame([[None] * len(ADMIN_COLUMNS)], columns=ADMIN_COLUMNS),
+                       admin2[ADMIN_COLUMNS]], ignore_index=True)
+    return ids, admin
+
+
+def load_admin_grid(InRaster, cache_dir, load_admin2, parent=None):
+    """
+    Returns the AdminGrid for the grid of `InRaster`. Grids are built once
+    per unique (geotransform, CRS, shape) and stored in `cache_dir`, so
+    `load_admin2` (a callable returning the GADM admin2 GeoDataFrame) is
+    only called when a new grid has to be rasterized.
+
+    Rasters cut from a larger raster, e.g. CHIRPS runs from a whole Africa
+    layer, pass that raster's grid (see `raster_grid`) as `parent`: when the
+    raster is a window of it, the parent's admin grid is used, so a single
+    grid serves every bounding box.
+    """
+    grid = raster_grid(InRaster)
+    if parent is not None:
+        offset = grid_offset(grid, parent)
+        if offset is not None:
+            return load_grid(parent, cache_dir, load_admin2).window(*offset, grid[2])
+    return load_grid(grid, cache_dir, load_admin2)
+
+
+def load_grid(grid, cache_dir, load_admin2):
+    """
+    The AdminGrid of a (geotransform, CRS, shape) grid.
+    """
+    GeoTrans, crs_wkt, shape = grid
+    key = grid_key(GeoTrans, crs_wkt, shape)
+
+    if key in _grids:
+        return _grids[key]
+
+    ids_path = os.path.join(cache_dir, f"{key}.npy")
+    admin_path = os.path.join(cache_dir, f"{key}.csv")
+
+    if os.path.exists(ids_path) and os.path.exists(admin_path):
+        logging.info(f"Loading admin grid {key}")
+        ids = np.load(ids_path, mmap_mode='r')
+        admin = pd.read_csv(admin_path, dtype=str, keep_default_na=False)
+        admin = admin.where(admin != '', None)
+    else:
+        logging.info(f"Rasterizing admin grid {key} for a {shape[1]}x{shape[0]} raster")
+        ids, admin = rasterize_admin(load_admin2(), GeoTrans, crs_wkt, shape)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # write to temporary files first so a concurrent reader never
+        # sees a partially written grid
+        tmp = f".{key}.{os.getpid()}"
+        np.save(os.path.join(cache_dir, f"{tmp}.npy"), ids)
+        admin.to_csv(os.path.join(cache_dir, f"{tmp}.csv"), index=False)
+        os.replace(os.path.join(cache_dir, f"{tmp}.csv"), admin_path)
+        os.replace(os.path.join(cache_dir, f"{tmp}.npy"), ids_path)
+
+    grid = AdminGrid(ids, {c: admin[c].values.astype(object) for c in ADMIN_COLUMNS})
+    _grids[key] = grid
+    return grid
+
@@ -5,13 +5,17 @@ sys.path.append("../db")
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from loader import register_run
 
-from openapi_server.util import raster2gpd    
+from openapi_server.raster import iter_raster_chunks
+from openapi_server.admin_grid import load_admin_grid, raster_grid
+from openapi_server import gadm
+from openapi_server.result_index import record_success
+from openapi_server.cog import upload_cog
+from openapi_server.chirps_tiles import TileCache, AFRICA_BBOX, mutable
 
-import geopandas as gpd
-import requests
 import logging
 import boto3
 import os
@@ -21,6 +25,9 @@ import redis
 from datetime import datetime, timedelta
 import json
 
+# configuration keys the controller requires
+REQUIRED_PARAMETERS = ['dekad', 'year', '_type', 'bbox']
+
 
 def run_chirps(name, model_config, output_path):
     """
@@ -48,23 +55,23 @@ class CHIRPSController(object):
         self.year = self.model_config["year"]
         self._type = self.model_config["_type"]
         self.bbox = self.model_config["bbox"]
-        self.min_pt, self.max_pt = self.convert_bbox(self.bbox)
-        self.url = f"http://chg-ewxtest.chg.ucsb.edu/proxies/wcsProxy.php?layerNameToUse=chirps:"\
-                   f"chirps_africa_1-dekad-{self.dekad}-{self.year}_{self._type}"\
-                   f"&lowerLeftXToUse={self.min_pt[0]}&lowerLeftYToUse={self.min_pt[1]}"\
-                   f"&upperRightXToUse={self.max_pt[0]}&upperRightYToUse={self.max_pt[1]}"\
-                   f"&wcsURLToUse=http://chg-ewxtest.chg.ucsb.edu:8080/geoserver/wcs?&resolution"\
-                   f"=0.05&srsToUse=EPSG:3857&outputSrsToUse=EPSG:4326"
-        self.url_gefs = f"http://chg-ewxtest.chg.ucsb.edu/proxies/wcsProxy.php?layerNameToUse="\
-                        f"chirpsgefslast:chirpsgefslast_africa_1-dekad-{self.dekad}-{self.year}_{self._type}"\
-                        f"&lowerLeftXToUse={self.min_pt[0]}&lowerLeftYToUse={self.min_pt[1]}"\
-                        f"&upperRightXToUse={self.max_pt[0]}&upperRightYToUse={self.max_pt[1]}"\
-                        f"&wcsURLToUse=http://chg-ewxtest.chg.ucsb.edu:8080/geoserver/wcs?&resolution"\
-                        f"=0.05&srsToUse=EPSG:3857&outputSrsToUse=EPSG:4326"
+        if self.name == 'CHIRPS-GEFS':
+            self.layer = f"chirpsgefslast:chirpsgefslast_africa_1-dekad-{self.dekad}-{self.year}_{self._type}"
+        else:
+            self.layer = f"chirps:chirps_africa_1-dekad-{self.dekad}-{self.year}_{self._type}"
+        self.wcs_proxy = config['CHIRPS'].get('WCS_PROXY', fallback='http://chg-ewxtest.chg.ucsb.edu/proxies/wcsProxy.php')
+        self.tiles = TileCache(os.path.join(output_path, 'tiles'),
+                               config['CHIRPS'].getint('TILE_CACHE_MB', fallback=2048) * 1024 * 1024)
+        # layers which may still change are only cached for a while
+        self.tile_ttl = None
+        if mutable(self.layer, self.dekad, self.year):
+            self.tile_ttl = config['CHIRPS'].getfloat('MUTABLE_TILE_HOURS', fallback=6) * 3600
         self.result_name = self.model_config['run_id']
         self.key = f"results/chirps/{self.result_name}.tiff"
         self.result_path = output_path
         self.gadm = config['GADM']['GADM_PATH']
+        self.admin_grid_path = config['GADM']['ADMIN_GRID_PATH']
+        self.chunk_size = int(config['INGEST']['CHUNK_SIZE'])
 
         # The Redis connection has to be instantiated by this Class
         # since once instantiated, it cannot be pickled by RQ
@@ -96,35 +103,37 @@ class CHIRPSController(object):
         logging.info(f"Running model run with ID: {self.run_id}")
 
         try:
-            # if CHIRPS-GEFS, use that URL
-            if self.name == 'CHIRPS-GEFS':
-                data = requests.get(self.url_gefs)
-
-            # otherwise, use CHRIPS URL 
-            else:
-                data = requests.get(self.url)
-                
+            # the run's bbox is cut from the whole layer, which is only
+            # fetched from the WCS proxy if it is not in the tile cache
+            tile = self.tiles.cut(self.layer, self.wcs_url(AFRICA_BBOX), self.bbox,
+                                  f"{self.output_path}/{self.result_name}.tiff", self.tile_ttl)
+            self.tile_grid = raster_grid(tile)
             logging.info("Model run: SUCCESS")
 
-            with open(f"{self.output_path}/{self.result_name}.tiff", "wb") as f:
-                f.write(data.content)
-
             self.storeResults()
             logging.info("Model output: STORED")
 
             self.ingest2db()
             logging.info("Model to DB: SUCCESS")
 
-            self.r.hmset(self.run_id, 
-                {'status': 'SUCCESS',
-                 'bucket': self.bucket,
-                 'key': self.key}
-                 )
+            record_success(self.r, self.run_id, self.bucket, self.key)
         except Exception as e:
             logging.info(f"Model run FAIL: {e}")
             self.r.hmset(self.run_id, {'status': 'FAIL', 'output': str(e)})
 
 
+    def wcs_url(self, bbox):
+        """
+        The WCS proxy URL of this run's layer within `bbox`.
+        """
+        min_pt, max_pt = self.convert_bbox(bbox)
+        return f"{self.wcs_proxy}?layerNameToUse={self.layer}"\
+               f"&lowerLeftXToUse={min_pt[0]}&lowerLeftYToUse={min_pt[1]}"\
+               f"&upperRightXToUse={max_pt[0]}&upperRightYToUse={max_pt[1]}"\
+               f"&wcsURLToUse=http://chg-ewxtest.chg.ucsb.edu:8080/geoserver/wcs?&resolution"\
+               f"=0.05&srsToUse=EPSG:3857&outputSrsToUse=EPSG:4326"
+
+
     def convert_bbox(self, bb):
         """
         Convert WGS84 coordinate system to Web Mercator
@@ -146,28 +155,32 @@ class CHIRPSController(object):
         if exists:    
             session = boto3.Session(profile_name="wmuser")
             s3 = session.client('s3')
-            s3.upload_file(result, 
-                           self.bucket, 
-                           self.key, 
-                           ExtraArgs={'ACL':'public-read'})
+            upload_cog(s3,
+                       result,
+                       self.bucket,
+                       self.key,
+                       ExtraArgs={'ACL':'public-read'})
             logging.info(f'Results stored at : https://s3.amazonaws.com/world-modelers/{self.key}')
             return "SUCCESS"
         else:
             return result
 
 
+    def load_admin2(self):
+        """
+        Load Admin2 shape from GADM. Only needed when the admin grid of
+        the Africa layers has not been built yet (runs' grids are windows of
+        it), so only the admin units overlapping Africa (padded by one 0.05
+        degree pixel) are loaded.
+        """
+        xmin, ymin, xmax, ymax = AFRICA_BBOX
+        bbox = [xmin - 0.05, ymin - 0.05, xmax + 0.05, ymax + 0.05]
+        return gadm.load_admin2(self.gadm, bbox=bbox)
+
+
     def ingest2db(self):
         init_db()
 
-        # Load Admin2 shape from GADM
-        logging.info("Loading GADM shapes...")
-        admin2 = gpd.read_file(f'{self.gadm}/gadm36_2.shp')
-        admin2['country'] = admin2['NAME_0']
-        admin2['state'] = admin2['NAME_1']
-        admin2['admin1'] = admin2['NAME_1']
-        admin2['admin2'] = admin2['NAME_2']
-        admin2 = admin2[['geometry','country','state','admin1','admin2']]
-
         # Add metadata object to DB
         # TODO: add run_label and run_description
         meta = Metadata(run_id=self.run_id, 
@@ -176,10 +189,9 @@ class CHIRPSController(object):
                         raw_output_link= f'https://s3.amazonaws.com/world-modelers/{self.key}',
                         point_resolution_meters=5000)
         logging.info("Storing metadata...")
-        db_session.add(meta)
-        db_session.commit()
 
         # Add parameters to DB
+        parameters = []
         logging.info("Storing parameters...")
         for param_name, param_val in self.model_config.items():   
             if param_name != 'run_id':             
@@ -199,31 +211,39 @@ class CHIRPSController(object):
                                   parameter_name=param_name,
                                   parameter_value=param_val,
                                   parameter_type=param_type)
-                db_session.add(param)
-                db_session.commit()
+                parameters.append(param)
 
         # Process tiff file into point data
         logging.info("Processing tiff...")
         InRaster = f"{self.result_path}/{self.result_name}.tiff"
         feature_name = self.features[self._type]['feature_name']
         feature_description = self.features[self._type]['feature_description']
-        gdf = raster2gpd(InRaster,feature_name)
-        
-        # Spatial merge on GADM to obtain admin areas
-        gdf = gpd.sjoin(gdf, admin2, how="left", op='intersects')
-        
-        # Set run fields: datetime, run_id, model
+
         # first convert dekad of year to day of year
         # note: dekad is a 10 day period so dekad 25 ends the 250th day of the year
         # since dekad 01 contains days 1 through 10 so dekad 01 should yield Jan 1 
-        gdf['datetime'] = datetime(self.year, 1, 1) + timedelta((int(self.dekad) * 10) - 11)
-        gdf['run_id'] = self.run_id
-        gdf['model'] = self.name
-        gdf['feature_description'] = feature_description
-        del(gdf['geometry'])
-        del(gdf['index_right'])
-
-        # perform bulk insert of entire geopandas DF
-        logging.info("Storing point data output...")
-        db_session.bulk_insert_mappings(Output, gdf.to_dict(orient="records"))
-        db_session.commit()
\ No newline at end of file
+        date = datetime(self.year, 1, 1) + timedelta((int(self.dekad) * 10) - 11)
+
+        # admin areas are looked up from a cached raster of GADM admin2 ids
+        # on the grid of the Africa layer the output was cut from, rather
+        # than a spatial join
+        admin_grid = load_admin_grid(InRaster, self.admin_grid_path, self.load_admin2,
+                                     parent=self.tile_grid)
+
+        # the raster is streamed in fixed size chunks which are merged, stored
+        # and released one at a time to bound memory use
+        chunks = iter_raster_chunks(InRaster, feature_name, chunk_size=self.chunk_size,
+                                    geometry=False, keep_index=True)
+        with register_run(meta, parameters) as loader:
+            for gdf in chunks:
+                gdf = admin_grid.attach(gdf)
+
+                # Set run fields: datetime, run_id, model
+                gdf['datetime'] = date
+                gdf['run_id'] = self.run_id
+                gdf['model'] = self.name
+                gdf['feature_description'] = feature_description
+
+                # copy the chunk into the output table
+                logging.info(f"Storing {len(gdf)} points of output...")
+                loader.copy(gdf)
@@ -0,0 +1,140 @@
+"""
+A local cache of CHIRPS dekad rasters.
+
+Rather than asking the UCSB WCS proxy for every run's bounding box, the
+whole Africa raster of a layer (e.g. `chirps:chirps_africa_1-dekad-3-2018_mm_data`)
+is fetched once, stored as a Cloud-Optimized GeoTIFF in `tiles` under the
+CHIRPS OUTPUT_PATH, and each run's bounding box is cut from it with a
+windowed read. The cache is bounded by `TILE_CACHE_MB` in the `[CHIRPS]`
+section of config.ini and evicts the least recently used layers first.
+
+Some layers change after they are published: the `chirpsgefslast` forecasts
+are replaced by every new forecast, and recent CHIRPS dekads are preliminary
+until the final product is released some weeks later. These are only kept
+for `MUTABLE_TILE_HOURS`, by caching them under the period of that length
+they were fetched in, so that a new period fetches the layer again and the
+superseded version is removed.
+"""
+import glob
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import rasterio
+import rasterio.errors
+import requests
+from rasterio.windows import Window
+
+from openapi_server.cog import to_cog
+from openapi_server.disk_cache import DiskLRU
+from openapi_server.raster_subset import pixel_window, SubsetError
+
+# the extent of the CHIRPS Africa layers: [xmin, ymin, xmax, ymax]
+AFRICA_BBOX = [-20, -40, 55, 40]
+
+# seconds to wait for the WCS proxy to start sending a layer
+FETCH_TIMEOUT = 300
+
+# days after the end of a dekad during which its CHIRPS layer may still be
+# revised (the final CHIRPS of a month is released in the third week of the
+# next month)
+PRELIMINARY_DAYS = 60
+
+
+def dekad_end(dekad, year):
+    """
+    The last day of a dekad of a year, dekad 1 being January 1-10.
+    """
+    return datetime(int(year), 1, 1) + timedelta(int(dekad) * 10 - 1)
+
+
+def mutable(layer, dekad, year, today=None):
+    """
+    Whether a layer may still change: a CHIRPS-GEFS forecast, or a CHIRPS
+    dekad which ended less than PRELIMINARY_DAYS ago.
+    """
+    if layer.startswith('chirpsgefslast:'):
+        return True
+    today = today or datetime.utcnow()
+    return today - dekad_end(dekad, year) < timedelta(days=PRELIMINARY_DAYS)
+
+
+def fetch(url, out_path):
+    """
+    Downloads a raster and writes it to `out_path` as a COG.
+    """
+    response = requests.get(url, stream=True, timeout=FETCH_TIMEOUT)
+    response.raise_for_status()
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    with tempfile.NamedTemporaryFile(dir=out_dir, prefix='.tmp-', suffix='.tif') as download:
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            download.write(chunk)
+        download.flush()
+        to_cog(download.name, out_path)
+
+
+def cut(tile_path, bbox, out_path):
+    """
+    Writes the pixels of a raster which intersect `bbox` to `out_path`,
+    reading only those pixels.
+    """
+    with rasterio.open(tile_path) as src:
+        window = pixel_window(src.transform.to_gdal(), src.width, src.height, bbox)
+        if window is None:
+            raise SubsetError(f"Bounding box {bbox} is outside of {tile_path}")
+        window = Window(*window)
+        profile = src.profile.copy()
+        profile.update(driver='GTiff', width=window.width, height=window.height,
+                       transform=src.window_transform(window))
+        with rasterio.open(out_path, 'w', **profile) as dst:
+            dst.write(src.read(window=window))
+
+
+class TileCache(DiskLRU):
+    """
+    Whole layers fetched from the WCS proxy, in `path`.
+    """
+
+    def tile(self, layer, url, ttl=None):
+        """
+        The path of `layer`, fetching it from `url` if it is not cached, or
+        if it was fetched in an earlier period of `ttl` seconds.
+        """
+        base = layer.replace(':', '_')
+        if ttl is None:
+            name = f"{base}.tif"
+        else:
+            name = f"{base}.{int(time.time() // ttl)}.tif"
+        path = self.get(name)
+        if path is None:
+            path = self.put(name, lambda out_path: fetch(url, out_path))
+            if ttl is not None:
+                self.remove_versions(base, keep=name)
+        return path
+
+    def cut(self, layer, url, bbox, out_path, ttl=None):
+        """
+        Cuts `bbox` from `layer` (see `tile`) to `out_path` and returns the
+        path of the layer. The layer may be evicted by another worker before
+        it is opened, in which case it is taken again.
+        """
+        for attempt in range(2):
+            path = self.tile(layer, url, ttl)
+            try:
+                cut(path, bbox, out_path)
+                return path
+            except rasterio.errors.RasterioIOError:
+                if attempt or os.path.exists(path):
+                    raise
+
+    def remove_versions(self, base, keep):
+        """
+        Removes the versions of a layer fetched in other periods.
+        """
+        for path in glob.glob(os.path.join(glob.escape(self.path), f"{glob.escape(base)}.*.tif")):
+            if os.path.basename(path) != keep:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
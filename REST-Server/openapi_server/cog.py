@@ -0,0 +1,88 @@
+"""
+Cloud-Optimized GeoTIFFs of result rasters.
+
+Models write their results as striped, uncompressed GeoTIFFs, so a client
+reading part of a result from S3 has to download all of it. Results are
+converted before they are uploaded instead: tiled, DEFLATE compressed, and
+with internal overviews stored ahead of the full resolution image (which
+GDAL does when copying a GeoTIFF with COPY_SRC_OVERVIEWS), so that a
+window or a zoomed out view is a few range requests.
+
+The conversion only uses the GTiff driver, not the COG driver, which needs
+GDAL 3.1, so it works with the GDAL rasterio 1.1.0 ships with.
+"""
+import logging
+import math
+import os
+import tempfile
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.shutil import copy as rio_copy
+
+BLOCKSIZE = 512
+COMPRESS = 'deflate'
+
+
+def creation_options(blocksize=BLOCKSIZE, compress=COMPRESS):
+    return {'tiled': True,
+            'blockxsize': blocksize,
+            'blockysize': blocksize,
+            'compress': compress,
+            'bigtiff': 'IF_SAFER'}
+
+
+def overview_factors(width, height, blocksize=BLOCKSIZE):
+    """
+    The decimation factors (2, 4, 8, ...) of the overviews of a raster,
+    down to the first overview which fits into a single block.
+    """
+    factors = []
+    factor = 2
+    while math.ceil(max(width, height) / (factor // 2)) > blocksize:
+        factors.append(factor)
+        factor *= 2
+    return factors
+
+
+def overview_resampling(dtype):
+    """
+    Averages continuous values, but keeps classes (integer rasters, e.g.
+    land cover) as they are.
+    """
+    if np.issubdtype(np.dtype(dtype), np.floating):
+        return Resampling.average
+    return Resampling.nearest
+
+
+def to_cog(src_path, dst_path, blocksize=BLOCKSIZE, compress=COMPRESS):
+    """
+    Writes a raster GDAL can read (a GeoTIFF, a VRT mosaic, ...) to
+    `dst_path` as a Cloud-Optimized GeoTIFF.
+    """
+    options = creation_options(blocksize, compress)
+    tmp_dir = os.path.dirname(os.path.abspath(dst_path))
+    with tempfile.TemporaryDirectory(dir=tmp_dir, prefix='.cog-') as tmp:
+        tiled = os.path.join(tmp, 'tiled.tif')
+        rio_copy(src_path, tiled, driver='GTiff', **options)
+        with rasterio.open(tiled, 'r+') as ds:
+            factors = overview_factors(ds.width, ds.height, blocksize)
+            if factors:
+                ds.build_overviews(factors, overview_resampling(ds.dtypes[0]))
+        rio_copy(tiled, dst_path, driver='GTiff', copy_src_overviews=True, **options)
+
+
+def upload_cog(s3, src_path, bucket, key, ExtraArgs=None):
+    """
+    Uploads a raster to S3 as a Cloud-Optimized GeoTIFF, with the boto3
+    client `s3`. The local raster is left as it is.
+    """
+    extra_args = {'ContentType': 'image/tiff'}
+    extra_args.update(ExtraArgs or {})
+    tmp_dir = os.path.dirname(os.path.abspath(src_path))
+    with tempfile.TemporaryDirectory(dir=tmp_dir, prefix='.cog-') as tmp:
+        cog_path = os.path.join(tmp, 'cog.tif')
+        to_cog(src_path, cog_path)
+        logging.info(f"Converted {src_path} to a COG of {os.path.getsize(cog_path)} bytes")
+        s3.upload_file(cog_path, bucket, key, ExtraArgs=extra_args)
@@ -3,10 +3,11 @@ import six
 
 from openapi_server.models.concept import Concept  # noqa: E501
 from openapi_server import util
+from openapi_server.metadata import VERSION, concept_entries
 
 import configparser
 import redis
-import json
+from functools import lru_cache
 
 config = configparser.ConfigParser()
 config.read('config.ini')
@@ -15,7 +16,20 @@ r = redis.Redis(host=config['REDIS']['HOST'],
                 port=config['REDIS']['PORT'],
                 db=config['REDIS']['DB'])
 
-def concept_mapping_get(concept=None, concept_type=None):  # noqa: E501
+# the number of (concept, type, limit) lookups cached by each process
+CONCEPT_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=CONCEPT_CACHE_SIZE)
+def cached_concept_entries(concept, concept_type, limit, version):
+    """
+    Entries of a concept as of a metadata version: a sync of the metadata
+    increments the version, so lookups cached before it are no longer hit
+    and age out of the cache.
+    """
+    return concept_entries(r, concept, concept_type, limit)
+
+
+def concept_mapping_get(concept=None, concept_type=None, limit=None):  # noqa: E501
     """Obtain an array of models related to a concept.
 
     Submit a concept name and optional type and receive an array of concepts related to that concept.        # noqa: E501
@@ -24,14 +38,14 @@ def concept_mapping_get(concept=None, concept_type=None):  # noqa: E501
     :type concept: str
     :param concept_type: The type of concept objects to return
     :type concept_type: str
+    :param limit: The maximum number of concept objects to return
+    :type limit: int
 
     :rtype: List[Concept]
     """
-    e = [json.loads(i.decode('utf-8')) for i in r.lrange(concept, 0, -1 )]
-    if concept_type:
-        e = [i for i in e if i['type']==concept_type]
-    e = sorted(e, key=lambda k: k['score'], reverse=True) 
-    return e
+    if not concept:
+        return []
+    return cached_concept_entries(concept, concept_type, limit, r.get(VERSION))
 
 
 def list_concepts_get():  # noqa: E501
@@ -1,23 +1,30 @@
+import sys
+sys.path.append("../db")
+
 import connexion
 import six
-import flask
 
 from openapi_server.models.model_config import ModelConfig  # noqa: E501
 from openapi_server.models.run_results import RunResults  # noqa: E501
 from openapi_server.models.run_status import RunStatus  # noqa: E501
-from openapi_server import util
-from openapi_server.kimetrica import KiController, run_kimetrica
-from openapi_server.fsc import FSCController, run_fsc
-from openapi_server.dssat import DSSATController, run_dssat
-from openapi_server.chirps import CHIRPSController, run_chirps
-from openapi_server.twist import TWISTController, run_twist
+from openapi_server.kimetrica import run_kimetrica
+from openapi_server.fsc import run_fsc
+from openapi_server.dssat import run_dssat
+from openapi_server.chirps import run_chirps
+from openapi_server.twist import run_twist
+from openapi_server import fsc, dssat, chirps
+from openapi_server import scheduler
+from openapi_server import result_index
+from openapi_server.file_response import send_file
+from openapi_server.disk_cache import DiskLRU
+from openapi_server import raster_subset
+from run_identity import normalize_config, parameter_defaults, canonical_config, make_run_id, legacy_run_id
+import run_index
 
 import json
-from hashlib import sha256
 import docker
 import configparser
 import redis
-from rq import Queue
 import boto3
 import botocore
 import logging
@@ -25,7 +32,6 @@ import os
 import glob
 import yaml
 import time
-from collections import OrderedDict
 from random import choice as randomchoice
 logging.basicConfig(level=logging.INFO)
 
@@ -39,49 +45,144 @@ r = redis.Redis(host=config['REDIS']['HOST'],
                 port=config['REDIS']['PORT'],
                 db=config['REDIS']['DB'])
 
-q = Queue('high', connection=r)
-
 client = docker.from_env()
 containers = client.containers
 
 data_path = config['APP']['DATA_PATH']
 site_url = config['APP']['URL']
 
+# default page size of /list_runs and /available_results when paginated
+PAGE_SIZE = 100
+
+# raster subsets taken by /result_subset, cached under DATA_PATH
+subset_dir = config['APP'].get('SUBSET_CACHE_DIR', fallback='subsets')
+subset_cache = DiskLRU(os.path.join(data_path, subset_dir),
+                       config['APP'].getint('SUBSET_CACHE_MB', fallback=2048) * 1024 * 1024)
+
 metadata_files = []
 for filename in glob.iglob('../metadata/models/**model-metadata.yaml', recursive=True):
      metadata_files.append(filename)
 
 available_models = []
 non_executable_models = []        
+# queue and resource estimates of each model's runs
+execution = {}
+# defaults filled into run configurations before they are hashed
+defaults = {}
 
 for m in metadata_files:
     with open(m, 'r') as stream:
         model = yaml.safe_load(stream)
         available_models.append(model['id'].lower())
+        execution[model['id'].lower()] = model.get('execution')
+        defaults[model['id'].lower()] = parameter_defaults(model)
 
         # check whether model is executable or not
         if model['executable'] == False:
             non_executable_models.append(model['id'].lower())
 
 
-def list_runs_model_name_get(ModelName):  # noqa: E501
+def run_set_name(ModelName):
+    """
+    The name of the Redis set holding the run ids of a model; a few models
+    are stored under their upper case name.
+    """
+    if ModelName.lower() in ['fsc','dssat','chirps','chirps-gefs','pihm']:
+        return ModelName.upper()
+    return ModelName
+
+
+def run_index_name(ModelName):
+    """
+    The name of the Redis sorted set indexing a model's runs by their
+    timestamp (epoch millis), which is kept up to date by whatever adds
+    runs (see db/run_index.py).
+    """
+    return run_index.index_name(run_set_name(ModelName))
+
+
+def scan_runs(set_name, cursor, limit):
+    """
+    At least `limit` run ids (or the rest of the set) from a model's set,
+    resuming an SSCAN at `cursor`. SSCAN may return a few more than asked
+    for, and these are kept rather than lost between pages. Returns the run
+    ids and the cursor to resume from, which is 0 once the set is exhausted.
+    """
+    run_ids = []
+    while True:
+        cursor, runs = r.sscan(set_name, cursor, count=limit - len(run_ids))
+        run_ids.extend([run.decode('utf-8') for run in runs])
+        if cursor == 0 or len(run_ids) >= limit:
+            return run_ids, cursor
+
+
+def latest_runs(ModelName, offset, limit):
+    """
+    A page of a model's run ids, newest first, read from the timestamp
+    index. Returns the run ids and the offset of the next page, which is 0
+    after the last page.
+    """
+    run_ids = [run.decode('utf-8') for run in
+               r.zrevrange(run_index_name(ModelName), offset, offset + limit - 1)]
+    if len(run_ids) < limit:
+        return run_ids, 0
+    return run_ids, offset + limit
+
+
+def page_runs(cursor, limit):
+    """
+    A page of run ids across all models. The cursor is `<model>:<SSCAN
+    cursor>`, or 0 to start from the first model.
+    """
+    models = sorted(set(available_models))
+    if cursor == '0':
+        i, model_cursor = 0, 0
+    else:
+        model, _, model_cursor = cursor.rpartition(':')
+        i, model_cursor = models.index(model), int(model_cursor)
+
+    run_ids = []
+    while i < len(models) and len(run_ids) < limit:
+        runs, model_cursor = scan_runs(run_set_name(models[i]), model_cursor, limit - len(run_ids))
+        run_ids.extend(runs)
+        if model_cursor == 0:
+            i += 1
+
+    if i == len(models):
+        return run_ids, 0
+    return run_ids, f"{models[i]}:{model_cursor}"
+
+
+def list_runs_model_name_get(ModelName, limit=None, cursor=None, latest=False):  # noqa: E501
     """Obtain a list of runs for a given model
 
     Submit a &#x60;ModelName&#x60; and receive an array of &#x60;RunID&#x60;s associated with the given model. # noqa: E501
 
     :param model_name: A model name
     :type model_name: str
+    :param limit: The number of runs per page.
+    :type limit: int
+    :param cursor: The X-Next-Cursor header of the previous page.
+    :type cursor: str
+    :param latest: Return the runs newest first.
+    :type latest: bool
 
     :rtype: List[str]
     """
-    if ModelName.lower() in ['fsc','dssat','chirps','chirps-gefs','pihm']:
-        ModelName = ModelName.upper()
+    if limit == None and cursor == None and not latest:
+        # a missing set is returned as an empty set
+        return [run.decode('utf-8') for run in r.smembers(run_set_name(ModelName))]
+
+    try:
+        cursor = int(cursor or 0)
+    except ValueError:
+        return 'Invalid cursor', 400, {'x-error': 'invalid cursor'}
 
-    if not r.exists(ModelName):
-        return []
+    if latest:
+        run_ids, next_cursor = latest_runs(ModelName, cursor, limit or PAGE_SIZE)
     else:
-        runs = [run.decode('utf-8') for run in list(r.smembers(ModelName))]
-        return runs
+        run_ids, next_cursor = scan_runs(run_set_name(ModelName), cursor, limit or PAGE_SIZE)
+    return run_ids, 200, {'X-Next-Cursor': str(next_cursor)}
 
 
 def run_model_post():  # noqa: E501
@@ -98,19 +199,23 @@ def run_model_post():  # noqa: E501
         model_config = ModelConfig.from_dict(connexion.request.get_json())  # noqa: E501
         model_config = model_config.to_dict()
         model_name = model_config["name"]
+        # the id the run had before configs were normalized and numbers were
+        # canonical; runs registered before then are still stored under it
+        legacy_id = legacy_run_id(model_config)
+        model_config['config'] = normalize_config(model_name, model_config['config'],
+                                                  defaults.get(model_name.lower(), {}))
         
-        model_config = util.sortOD(OrderedDict(model_config))
+        model_config = canonical_config(model_config)
 
         # generate id for the model run
-        run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()    
+        run_id = make_run_id(model_config)
 
         # if run already exists and is success or pending, don't run again.
-        if r.exists(run_id):
-            run = r.hgetall(run_id)
-            status = run[b'status'].decode('utf-8')
-            if status == "SUCCESS" or status == "PENDING":
-                logging.info("Already ran " + run_id)
-                return run_id
+        for id_ in (run_id, legacy_id):
+            status = r.hget(id_, 'status')
+            if status == b"SUCCESS" or status == b"PENDING":
+                logging.info("Already ran " + id_)
+                return id_
 
         if model_name.lower() not in available_models:
             return 'Model Not Found', 404, {'x-error': 'not found'}
@@ -119,50 +224,89 @@ def run_model_post():  # noqa: E501
         if model_name.lower() in non_executable_models:
             return f'{model_name} is not currently executable. Please refer to the available pre-computed results.', 400, {'x-error': 'not supported'}                
 
-        # generate a key for the model run based on the run_id
-        run_obj = {'config': json.dumps(model_config['config']),
-                   'status': 'PENDING',
-                   'name': model_config['name'],
-                   'timestamp': round(time.time()*1000,0)}
-        r.hmset(run_id, run_obj)
-
-        # push the id to the model's list of runs
-        r.sadd(model_name, run_id)
+        missing = missing_parameters(model_name, model_config['config'])
+        if missing:
+            return f"Missing configuration parameters: {', '.join(missing)}", 400, {'x-error': 'invalid config'}
+
+        # if an earlier run's results are still stored, restore it instead
+        # of running it again
+        manifest = None
+        if not r.exists(run_id):
+            try:
+                manifest = result_index.find_result(run_id)
+            except Exception as e:
+                logging.error(f"Could not look up results of {run_id}: {e}")
+
+        if manifest is not None:
+            logging.info("Restoring stored results of " + run_id)
+            run_obj = {'config': json.dumps(model_config['config']),
+                       'status': 'SUCCESS',
+                       'name': model_config['name'],
+                       'timestamp': manifest['timestamp'],
+                       'bucket': manifest['bucket'],
+                       'key': manifest['key']}
+        else:
+            # generate a key for the model run based on the run_id
+            run_obj = {'config': json.dumps(model_config['config']),
+                       'status': 'PENDING',
+                       'name': model_config['name'],
+                       'timestamp': round(time.time()*1000,0)}
+        pipe = r.pipeline()
+        pipe.hdel(run_id, 'log', 'output')
+        pipe.hmset(run_id, run_obj)
+        pipe.execute()
+
+        # push the id to the model's list of runs and its timestamp index
+        run_index.add_run(r, run_set_name(model_name), run_id, run_obj['timestamp'])
+
+        if manifest is not None:
+            return run_id
+
+        # the controllers are built by the RQ worker, not in this request;
+        # the job is queued by model class, with the run id so the worker can
+        # fail the run if that raises (see worker.py)
+        model_execution = execution[model_name.lower()]
 
         if model_name.lower() == 'malnutrition_model' \
         or model_name.lower() == 'population_model': 
             model_config['config']['run_id'] = run_id
-            q.enqueue(run_kimetrica, model_config, job_timeout='4h')            
-            model_container = None
-            m = KiController(model_config)
+            scheduler.enqueue(r, model_name.lower(), model_execution, run_id, run_kimetrica, model_config)            
 
         elif model_name.lower() == 'fsc':
             model_config['config']['run_id'] = run_id
-            q.enqueue(run_fsc, model_config['config'], config['FSC']['OUTPUT_PATH'])
-            model_container = None
-            m = FSCController(model_config['config'], config['FSC']['OUTPUT_PATH'])
+            scheduler.enqueue(r, model_name.lower(), model_execution, run_id, run_fsc, model_config['config'], config['FSC']['OUTPUT_PATH'])
 
         elif model_name.lower() == 'dssat':
             model_config['config']['run_id'] = run_id
-            q.enqueue(run_dssat, model_config['config'], config['DSSAT']['OUTPUT_PATH'], job_timeout='12h')
-            model_container = None
-            m = DSSATController(model_config['config'], config['DSSAT']['OUTPUT_PATH'])
+            scheduler.enqueue(r, model_name.lower(), model_execution, run_id, run_dssat, model_config['config'], config['DSSAT']['OUTPUT_PATH'])
 
         elif 'chirps' in model_name.lower():
             model_config['config']['run_id'] = run_id
-            q.enqueue(run_chirps, model_name, model_config['config'], config['CHIRPS']['OUTPUT_PATH'])
-            model_container = None
-            m = CHIRPSController(model_name, model_config['config'], config['CHIRPS']['OUTPUT_PATH'])
+            scheduler.enqueue(r, model_name.lower(), model_execution, run_id, run_chirps, model_name, model_config['config'], config['CHIRPS']['OUTPUT_PATH'])
 
         elif 'multi_twist' in model_name.lower():
             model_config['config']['run_id'] = run_id
-            q.enqueue(run_twist, model_config['config'])
-            model_container = None
-            m = TWISTController(model_config['config'])
+            scheduler.enqueue(r, model_name.lower(), model_execution, run_id, run_twist, model_config['config'])
 
     return run_id
 
 
+def missing_parameters(model_name, model_config):
+    """
+    The configuration keys required by a model's controller which are
+    missing from a run's configuration.
+    """
+    if model_name.lower() == 'fsc':
+        required = fsc.REQUIRED_PARAMETERS
+    elif model_name.lower() == 'dssat':
+        required = dssat.REQUIRED_PARAMETERS
+    elif 'chirps' in model_name.lower():
+        required = chirps.REQUIRED_PARAMETERS
+    else:
+        required = []
+    return [p for p in required if p not in model_config]
+
+
 def run_results_run_idget(RunID):  # noqa: E501
     """Obtain metadata about the results of a given model run
 
@@ -173,17 +317,18 @@ def run_results_run_idget(RunID):  # noqa: E501
 
     :rtype: RunResults
     """
-    if not r.exists(RunID):
-        return 'Run Not Found', 404, {'x-error': 'not found'}
-        
     run = r.hgetall(RunID)
-    status = run[b'status'].decode('utf-8')
+    if not run:
+        return 'Run Not Found', 404, {'x-error': 'not found'}
+    return format_run_results(RunID, run)
 
-    # Only update the run status if the status is still PENDING
-    if status == 'PENDING':
-        update_run_status(RunID)
-        run = r.hgetall(RunID)
-        status = run[b'status'].decode('utf-8')
+
+def format_run_results(RunID, run):
+    """
+    Builds the RunResults for a run from its Redis hash (as returned by
+    `hgetall`).
+    """
+    status = run[b'status'].decode('utf-8')
 
     config = json.loads(run[b'config'].decode('utf-8'))
     if 'run_id' not in config:
@@ -226,6 +371,18 @@ def run_results_run_idget(RunID):  # noqa: E501
     return results
 
 
+def get_run_results(run_ids):
+    """
+    RunResults for many runs, fetched with a single pipelined round trip
+    to Redis. Runs which no longer exist are skipped.
+    """
+    pipe = r.pipeline(transaction=False)
+    for id_ in run_ids:
+        pipe.hgetall(id_)
+    runs = pipe.execute()
+    return [format_run_results(id_, run) for id_, run in zip(run_ids, runs) if run]
+
+
 def run_status_run_idget(RunID):  # noqa: E501
     """Obtain status for a given model run
 
@@ -239,7 +396,7 @@ def run_status_run_idget(RunID):  # noqa: E501
     return update_run_status(RunID)
 
 
-def available_results_get(ModelName=None, size=None):
+def available_results_get(ModelName=None, size=None, limit=None, cursor=None, latest=False):
     """Obtain a list of run results
 
     Return a list of all available run results. # noqa: E501
@@ -252,15 +409,18 @@ def available_results_get(ModelName=None, size=None):
         if model.lower() not in available_models:
             return 'Model Not Found', 404, {'x-error': 'not found'}
 
+    if limit != None or cursor != None or latest:
+        return page_run_results(model, size, limit, cursor, latest)
+
     run_ids = []
 
     # no model or size
     if model == None and size == None:
+        pipe = r.pipeline(transaction=False)
         for m in available_models:
-            if m in ['fsc','dssat','chirps','chirps-gefs']:
-                m = m.upper()
-            runs = list_runs_model_name_get(m)
-            run_ids.extend(runs)
+            pipe.smembers(run_set_name(m))
+        for runs in pipe.execute():
+            run_ids.extend([run.decode('utf-8') for run in runs])
 
     # model provided but no size
     elif model != None and size == None:
@@ -269,25 +429,56 @@ def available_results_get(ModelName=None, size=None):
 
     # size provided but no model
     elif model == None and size != None:
-        n = 1
-        while n <= size:
-            m = randomchoice(available_models)
-            if m in ['fsc','dssat','chirps','chirps-gefs']:
-                m = m.upper()
-            rand_run = r.srandmember(m)
-            if rand_run != None:
-                run_ids.append(rand_run.decode('utf-8'))
-                n+=1
+        # draw a random model with runs for each run still needed and
+        # sample them all in one round trip; at most as many runs as there
+        # are in total are returned, and none if no model has any
+        pipe = r.pipeline(transaction=False)
+        for m in available_models:
+            pipe.scard(run_set_name(m))
+        counts = pipe.execute()
+        models = [m for m, count in zip(available_models, counts) if count > 0]
+        wanted = min(size, sum(counts))
+        while len(run_ids) < wanted:
+            pipe = r.pipeline(transaction=False)
+            for _ in range(wanted - len(run_ids)):
+                pipe.srandmember(run_set_name(randomchoice(models)))
+            runs = [run.decode('utf-8') for run in pipe.execute() if run != None]
+            if not runs:
+                # the run sets were emptied since they were counted
+                break
+            run_ids.extend(runs)
 
     # model provided and size provided
     elif model != None and size != None:
-        runs = [run.decode('utf-8') for run in list(r.srandmember(model, size))]
+        runs = [run.decode('utf-8') for run in list(r.srandmember(run_set_name(model), size))]
         run_ids.extend(runs)
 
-    results = []
-    for id_ in run_ids:
-        results.append(run_results_run_idget(id_))
-    return results
+    return get_run_results(run_ids)
+
+
+def page_run_results(model, size, limit, cursor, latest):
+    """
+    A page of run results, for a model or across all models, with the
+    cursor of the next page in the X-Next-Cursor header.
+    """
+    if size != None:
+        return 'size cannot be combined with limit, cursor or latest', 400, {'x-error': 'invalid parameters'}
+    if latest and model == None:
+        return 'latest requires a ModelName', 400, {'x-error': 'invalid parameters'}
+
+    if model != None:
+        response = list_runs_model_name_get(model, limit, cursor, latest)
+        if response[1] != 200:
+            return response
+        run_ids, _, headers = response
+    else:
+        try:
+            run_ids, next_cursor = page_runs(cursor or '0', limit or PAGE_SIZE)
+        except ValueError:
+            return 'Invalid cursor', 400, {'x-error': 'invalid cursor'}
+        headers = {'X-Next-Cursor': str(next_cursor)}
+
+    return get_run_results(run_ids), 200, headers
 
 
 def result_file_result_file_name_get(ResultFileName):  # noqa: E501
@@ -301,20 +492,63 @@ def result_file_result_file_name_get(ResultFileName):  # noqa: E501
     :rtype: None
     """
 
+    # streamed (or handed to nginx), with range and conditional requests
+    response = send_file(data_path, ResultFileName)
+
     # If the file does not exist:
-    if not os.path.exists(f"{data_path}/{ResultFileName}"):
+    if response is None:
         return 'Result File Not Found', 404, {'x-error': 'not found'}
+    return response
+
+
+def result_subset_run_id_get(RunID, bbox, band=1, format='tiff'):  # noqa: E501
+    """Obtain a subset of the raster result file of a given model run.
+
+    Submit a `RunID` and a bounding box and receive one band of the run's raster within it, as a GeoTIFF or a CSV of pixel values. # noqa: E501
 
-    # Otherwise, serve the file:
+    :param run_id: The ID for a given model run.
+    :type run_id: str
+    :param bbox: The bounding box [xmin, ymin, xmax, ymax], in the coordinate system of the raster.
+    :type bbox: List[float]
+    :param band: The band of the raster.
+    :type band: int
+    :param format: The format of the subset.
+    :type format: str
+
+    :rtype: None
+    """
+    for ext in ['tif', 'tiff']:
+        src_path = f"{data_path}/{RunID}.{ext}"
+        if os.path.isfile(src_path):
+            break
     else:
-        response = flask.send_from_directory(data_path, ResultFileName)  
-        response.direct_passthrough = False
-        return response    
+        return 'Result File Not Found', 404, {'x-error': 'not found'}
+
+    if bbox[0] >= bbox[2] or bbox[1] >= bbox[3]:
+        return 'Bounding box must be [xmin, ymin, xmax, ymax]', 400, {'x-error': 'invalid bbox'}
+
+    # the subset may be evicted by another worker before it is opened, in
+    # which case it is taken again
+    for _ in range(2):
+        try:
+            name = raster_subset.cached_subset(subset_cache, RunID, src_path, os.path.getmtime(src_path),
+                                               bbox, band, format)
+        except raster_subset.SubsetError as e:
+            return str(e), 400, {'x-error': 'invalid subset'}
+        response = send_file(data_path, f"{subset_dir}/{name}")
+        if response is not None:
+            return response
+    return 'Subset Not Found', 404, {'x-error': 'not found'}
 
 
 def update_run_status(RunID):
-    if not r.exists(RunID):
+    status, log = r.hmget(RunID, 'status', 'log')
+    if status == None:
         return 'Run Not Found', 404, {'x-error': 'not found'}
 
-    run = r.hgetall(RunID)
-    return run[b'status'].decode('utf-8')
+    # the last line the model's container logged, published by the worker
+    # as the run goes (header values have to be ASCII)
+    headers = {}
+    if log != None:
+        headers['X-Run-Log'] = log.decode('utf-8').encode('ascii', 'replace').decode('ascii')
+    return status.decode('utf-8'), 200, headers
@@ -11,6 +11,7 @@ from openapi_server.models.text_query import TextQuery  # noqa: E501
 from openapi_server.models.time_query import TimeQuery  # noqa: E501
 from openapi_server import util
 from openapi_server import metadata
+from openapi_server.metadata_cache import MetadataCache
 
 import requests
 import configparser
@@ -27,24 +28,36 @@ r = redis.Redis(host=config['REDIS']['HOST'],
                 port=config['REDIS']['PORT'],
                 db=config['REDIS']['DB'])
 
-def list_models_post():  # noqa: E501
-    """Obtain a list of current models
-
-    Request a list of currently available models. # noqa: E501
+# responses are cached as serialized JSON until the metadata is synced
+metadata_cache = MetadataCache(r)
 
+def model_meta(ModelName):
+    return json.loads(r.get(f'{ModelName}-meta').decode('utf-8'))
 
-    :rtype: List[str]
-    """
+def list_models():
     m_ids = [m.decode('utf-8') for m in r.smembers('model-list')]
     
     models = []
 
-    for _id in m_ids:
-        m = json.loads(r.get(f"{_id}-meta").decode('utf-8'))
-        models.append(util.format_model(m))
+    # fetch the metadata of every model in a single round trip
+    metas = r.mget([f"{_id}-meta" for _id in m_ids]) if m_ids else []
+    for meta in metas:
+        if meta != None:
+            m = json.loads(meta.decode('utf-8'))
+            models.append(util.format_model(m))
 
     return models
 
+def list_models_post():  # noqa: E501
+    """Obtain a list of current models
+
+    Request a list of currently available models. # noqa: E501
+
+
+    :rtype: List[str]
+    """
+    return metadata_cache.response(None, 'list_models', list_models)
+
 def model_config_model_name_get(ModelName):  # noqa: E501
     """Obtain an example model configuration.
 
@@ -55,9 +68,8 @@ def model_config_model_name_get(ModelName):  # noqa: E501
 
     :rtype: ModelConfig
     """
-    # get model
-    m = json.loads(r.get(f'{ModelName}-meta').decode('utf-8'))
-    return util.format_config(m)
+    return metadata_cache.response(ModelName, 'model_config',
+                                   lambda: util.format_config(model_meta(ModelName)))
 
 def model_info_model_name_get(ModelName):  # noqa: E501
     """Get basic metadata information for a specified model.
@@ -69,8 +81,8 @@ def model_info_model_name_get(ModelName):  # noqa: E501
 
     :rtype: Model
     """
-    m = json.loads(r.get(f'{ModelName}-meta').decode('utf-8'))
-    return util.format_model(m)
+    return metadata_cache.response(ModelName, 'model_info',
+                                   lambda: util.format_model(model_meta(ModelName)))
 
 
 def model_outputs_model_name_get(ModelName):  # noqa: E501
@@ -83,8 +95,8 @@ def model_outputs_model_name_get(ModelName):  # noqa: E501
 
     :rtype: List[Variable]
     """
-    m = json.loads(r.get(f'{ModelName}-meta').decode('utf-8'))
-    return util.format_outputs(m)
+    return metadata_cache.response(ModelName, 'model_outputs',
+                                   lambda: util.format_outputs(model_meta(ModelName)))
 
 
 def model_parameters_model_name_get(ModelName):  # noqa: E501
@@ -100,5 +112,5 @@ def model_parameters_model_name_get(ModelName):  # noqa: E501
 
     # Obtain all parameters associated with *any* configuration for 
     # the given model
-    m = json.loads(r.get(f'{ModelName}-meta').decode('utf-8'))
-    return util.format_parameters(m)
\ No newline at end of file
+    return metadata_cache.response(ModelName, 'model_parameters',
+                                   lambda: util.format_parameters(model_meta(ModelName)))
\ No newline at end of file
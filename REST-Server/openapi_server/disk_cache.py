@@ -0,0 +1,83 @@
+"""
+A directory of cached files bounded in size, evicting the least recently
+used files first.
+
+Use is tracked by the files' modification time, which is bumped on every
+hit, since access times are often not kept (`noatime`). Files are written
+under a temporary name and renamed into place, so concurrent workers never
+see a partial file; two workers missing on the same file both write it and
+the last rename wins. The directory is only created when the first file is
+cached, so that a cache can be set up at import time even where it will
+never be written to.
+"""
+import logging
+import os
+import tempfile
+
+
+class DiskLRU(object):
+    """
+    Files in `path` taking up at most `max_bytes` (0 or less: unbounded).
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def get(self, name):
+        """
+        The path of a cached file, marking it as used, or None.
+        """
+        path = os.path.join(self.path, name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, name, write):
+        """
+        Caches a file by calling `write` with the path to write it to, and
+        returns its path in the cache.
+        """
+        path = os.path.join(self.path, name)
+        suffix = os.path.splitext(name)[1]
+        os.makedirs(self.path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp-', suffix=suffix)
+        os.close(fd)
+        try:
+            write(tmp_path)
+            # readable by a web server serving the cache (mkstemp's are not)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=name)
+        return path
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used files until the cache fits into
+        `max_bytes`, except for `keep`.
+        """
+        if self.max_bytes <= 0:
+            return
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.startswith('.tmp-'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.path, name))
+                logging.info(f"Evicted {name} from {self.path}")
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,95 @@
+"""
+Runs model containers detached and follows their logs as they are written.
+
+A container run with `detach=False` only returns once it has exited, with
+its entire stdout buffered in memory, so a run showed no progress until it
+was over. Here the log is read line by line instead: the success message is
+looked for as lines arrive, only the last lines are kept (for the output of
+failed runs), and the run's latest log line is published to the run's
+hash in Redis for /run_status.
+"""
+import time
+from collections import deque
+
+# lines of the log kept for the output of a failed run
+TAIL_LINES = 200
+
+# longest log line published, and how often progress is published (seconds)
+MAX_LOG = 500
+PUBLISH_INTERVAL = 2
+
+# a line without a newline is split once it gets this long
+MAX_LINE = 64 * 1024
+
+
+def iter_lines(chunks):
+    """
+    The lines of a container's log from the chunks docker streams it in,
+    which need not end at line breaks.
+    """
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        if len(buffer) > MAX_LINE:
+            lines.append(buffer)
+            buffer = b''
+        for line in lines:
+            yield line.decode('utf-8', errors='replace').rstrip('\r')
+    if buffer:
+        yield buffer.decode('utf-8', errors='replace')
+
+
+def follow_log(r, run_id, chunks, success_msg):
+    """
+    Reads a run's log until it ends, publishing the last line logged to the
+    `log` field of the run's hash. Returns whether `success_msg` was logged
+    and the last lines of the log.
+    """
+    tail = deque(maxlen=TAIL_LINES)
+    succeeded = False
+    log = None
+    published = 0
+    for line in iter_lines(chunks):
+        tail.append(line)
+        if success_msg in line:
+            succeeded = True
+        if line.strip():
+            log = line[:MAX_LOG]
+        if log is not None and time.time() - published > PUBLISH_INTERVAL:
+            r.hset(run_id, 'log', log)
+            published = time.time()
+
+    if log is not None:
+        r.hset(run_id, 'log', log)
+    return succeeded, tail
+
+
+def run_container(containers, r, run_id, image, success_msg, **kwargs):
+    """
+    Runs `image` detached (with the keyword arguments of `containers.run`)
+    and follows its log until it exits. Returns whether it succeeded, i.e.
+    logged `success_msg` and exited with status 0, and the last lines of
+    the log.
+    """
+    container = containers.run(image, detach=True, **kwargs)
+    succeeded, tail = follow_log(r, run_id, container.logs(stream=True, follow=True), success_msg)
+    exit_status = container.wait()['StatusCode']
+    if not succeeded or exit_status != 0:
+        tail.append(f"Container exited with status {exit_status}")
+    return succeeded and exit_status == 0, '\n'.join(tail)
+
+
+def run_exec(client, r, run_id, container, cmd, success_msg):
+    """
+    Runs `cmd` in an already running container with `docker exec` and
+    follows its output until it exits. Returns whether it succeeded, i.e.
+    logged `success_msg` and exited with status 0, and the last lines of
+    the output.
+    """
+    exec_id = client.api.exec_create(container.id, cmd)['Id']
+    succeeded, tail = follow_log(r, run_id, client.api.exec_start(exec_id, stream=True), success_msg)
+    exit_code = client.api.exec_inspect(exec_id)['ExitCode']
+    if not succeeded or exit_code != 0:
+        tail.append(f"Command exited with status {exit_code}")
+    return succeeded and exit_code == 0, '\n'.join(tail)
@@ -5,8 +5,13 @@ sys.path.append("../db")
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from loader import register_run
+
+from openapi_server import gadm
+from openapi_server.result_index import record_success
+from openapi_server.docker_run import run_container
 
 import docker
 import re
@@ -25,6 +30,9 @@ import geopandas as gpd
 from shapely.geometry import Point
 from datetime import datetime, timedelta
 
+# configuration keys the controller requires
+REQUIRED_PARAMETERS = ['management_practice', 'samples']
+
 def run_dssat(config, output_path):
     """
     Simple function to generate an DSSATController instance and run the model
@@ -49,10 +57,14 @@ class DSSATController(object):
         self.result_path = output_path
         self.result_name = self.model_config['run_id'] 
         self.run_id = self.model_config['run_id']           
+        self.container_name = f"dssat-{self.run_id}"
+        # each run gets its own /userdata, holding its et_docker.json and out
+        # directory, so that runs can execute side by side
+        self.work_dir = f"{self.result_path}/runs/{self.run_id}"
         self.bucket = "world-modelers"
         self.key = f"results/dssat_model/{self.result_name}"
         self.entrypoint=f"/app/pythia.sh --clean-work-dir --all /userdata/et_docker.json"
-        self.volumes = {self.result_path: {'bind': '/userdata', 'mode': 'rw'}}
+        self.volumes = {self.work_dir: {'bind': '/userdata', 'mode': 'rw'}}
         self.volumes_from = "ethdata"
         self.mgmts = ["maize_irrig","maize_rf_0N","maize_rf_highN","maize_rf_lowN"]
         self.success_msg = 'Running simple analytics'
@@ -89,7 +101,10 @@ class DSSATController(object):
                                 'rainfall': 'float',
                                 'fertilizer': 'integer',
                                 'planting_start': 'string',
-                                'planting_end': 'string'
+                                'planting_end': 'string',
+                                'planting_window_shift': 'integer',
+                                'season': 'string',
+                                'crop': 'string'
                                 },
                              'encoding': {
                                 'maize_rf_highN': 1,
@@ -104,7 +119,8 @@ class DSSATController(object):
 
     def update_config(self):
         """
-        Update et_docker.json file with user-submitted config
+        Write the run's et_docker.json: the one in the output path updated
+        with the user-submitted config
         """
         with open(f"{self.result_path}/et_docker.json", "r") as f:
             config = json.loads(f.read())
@@ -200,7 +216,8 @@ class DSSATController(object):
         else:
             config["default_setup"]["erain"] = "M1.00"
 
-        with open(f"{self.result_path}/et_docker.json", "w") as f:
+        os.makedirs(self.work_dir, exist_ok=True)
+        with open(f"{self.work_dir}/et_docker.json", "w") as f:
             f.write(json.dumps(config))
             f.close()
 
@@ -213,15 +230,13 @@ class DSSATController(object):
         time.sleep(3)
         logging.info(f"Running model run with ID: {self.run_id}")
         try:
-            self.model = self.containers.run(self.dssat, 
-                                             volumes=self.volumes, 
-                                             volumes_from=self.volumes_from,
-                                             entrypoint=self.entrypoint,
-                                             detach=False,
-                                             name='dssat')
-            run_logs = self.model.decode('utf-8')
-
-            if self.success_msg in run_logs:
+            succeeded, run_logs = run_container(self.containers, self.r, self.run_id, self.dssat, self.success_msg,
+                                                volumes=self.volumes,
+                                                volumes_from=self.volumes_from,
+                                                entrypoint=self.entrypoint,
+                                                name=self.container_name)
+
+            if succeeded:
                 logging.info("Model run: SUCCESS")
                 try:
                     self.storeResults()
@@ -230,11 +245,9 @@ class DSSATController(object):
                         self.ingest2db()
                         # Success case requires storage to S3 AND ingest to DB
                         # if Success, update Redis accordingly
-                        self.r.hmset(self.run_id, 
-                            {'status': 'SUCCESS',
-                             'bucket': self.bucket,
-                             'key': self.key}
-                             )                        
+                        record_success(self.r, self.run_id, self.bucket, self.key)
+                        # the work directory of failed runs is kept to debug them
+                        shutil.rmtree(self.work_dir, ignore_errors=True)
                     except Exception as e:
                         msg = f'DB ingest failure: {e}.'
                         logging.error(msg)
@@ -251,12 +264,12 @@ class DSSATController(object):
             self.r.hmset(self.run_id, {'status': 'FAIL', 'output': str(e)})
 
         # Prune old containers
-        prior_container = self.containers.get('dssat')
+        prior_container = self.containers.get(self.container_name)
         prior_container.remove()
 
 
     def storeResults(self):
-        out = f"{self.result_path}/out"
+        out = f"{self.work_dir}/out"
         result = f"{self.result_path}/{self.result_name}"
         exists = os.path.isdir(out)
         logging.info(exists)
@@ -269,7 +282,7 @@ class DSSATController(object):
 
                 # Copy pp_* files to results directory
                 for m in self.mgmts:
-                    shutil.copy(f"{self.result_path}/out/eth_docker/test/{m}/pp_{m}.csv",
+                    shutil.copy(f"{out}/eth_docker/test/{m}/pp_{m}.csv",
                                 f"{result}/pp_{m}.csv")
                 shutil.make_archive(result, 'zip', result)
                 to_upload = f"{result}.zip"
@@ -278,14 +291,14 @@ class DSSATController(object):
             # If combined (one single output file)
             elif self.model_config["management_practice"] == "combined":
                 # Copy pp.csv file to results directory
-                shutil.copy(f"{self.result_path}/out/eth_docker/test/pp.csv",
+                shutil.copy(f"{out}/eth_docker/test/pp.csv",
                             f"{result}.csv")
                 to_upload = f"{result}.csv"
                 
             # Otherwise, provide just the management practice of interest
             else:
                 m = self.model_config["management_practice"]
-                shutil.copy(f"{self.result_path}/out/eth_docker/test/{m}/pp_{m}.csv",
+                shutil.copy(f"{out}/eth_docker/test/{m}/pp_{m}.csv",
                             f"{result}.csv")
                 to_upload = f"{result}.csv"    
                     
@@ -305,13 +318,7 @@ class DSSATController(object):
         init_db()
 
         # Load Admin2 shape from GADM
-        logging.info("Loading GADM shapes...")
-        admin2 = gpd.read_file(f"{self.config['GADM']['GADM_PATH']}/gadm36_2.shp")
-        admin2['country'] = admin2['NAME_0']
-        admin2['state'] = admin2['NAME_1']
-        admin2['admin1'] = admin2['NAME_1']
-        admin2['admin2'] = admin2['NAME_2']
-        admin2 = admin2[['geometry','country','state','admin1','admin2']]
+        admin2 = gadm.load_admin2(self.config['GADM']['GADM_PATH'])
 
         # Add metadata object to DB
         # TODO: add run_label and run_description
@@ -323,10 +330,9 @@ class DSSATController(object):
                         # 5 arc minutes (~10km)
                         point_resolution_meters=10000) 
         logging.info("Storing metadata...")
-        db_session.add(meta)
-        db_session.commit()
 
         # Add parameters to DB
+        parameters = []
         logging.info("Storing parameters...")
         for param_name, param_val in self.model_config.items():
             if param_name == 'run_id':
@@ -337,8 +343,7 @@ class DSSATController(object):
                                   parameter_name=param_name,
                                   parameter_value=param_val,
                                   parameter_type=self.descriptions['parameters'][param_name])
-                db_session.add(param)
-                db_session.commit()
+                parameters.append(param)
 
         # Process CSV and normalize it
         logging.info("Processing points...")
@@ -346,11 +351,11 @@ class DSSATController(object):
         # get result file path
         if self.model_config["management_practice"] == "combined":
             # combined CSV
-            path = f"{self.result_path}/out/eth_docker/test/pp.csv"
+            path = f"{self.work_dir}/out/eth_docker/test/pp.csv"
         else:
             # individual management practices
             m = self.model_config["management_practice"]
-            path = f"{self.result_path}/out/eth_docker/test/{m}/pp_{m}.csv"
+            path = f"{self.work_dir}/out/eth_docker/test/{m}/pp_{m}.csv"
 
         df = pd.read_csv(path, index_col=False)
         df['latitude'] = df['LATITUDE']
@@ -382,21 +387,21 @@ class DSSATController(object):
         # Need to iterate over features to generate one GDF per feature
         # then upload the GDF per feature to ensure that rows are added for each
         # feature
-        for feature_name, feature_description in self.descriptions['features'].items():
-            # specific handling for "combined" file
-            if feature_name == 'management_practice':
-                if self.model_config["management_practice"] != "combined":
-                    # if not a combined file, then just move onto the next 
-                    # in the for loop and do nothing for this feature_name
-                    continue
-            cols_to_select = base_cols + [feature_name]
-            gdf_ = gdf[cols_to_select] # generate new interim GDF
-            gdf_['feature_name'] = feature_name
-            gdf_['feature_description'] = feature_description
-            gdf_['feature_value'] = gdf_[feature_name]
-            gdf_ = gdf_[base_cols + feature_cols]
-
-            # perform bulk insert of entire geopandas DF
-            logging.info(f"Storing point data output for {feature_name}...")
-            db_session.bulk_insert_mappings(Output, gdf_.to_dict(orient="records"))
-            db_session.commit()            
\ No newline at end of file
+        with register_run(meta, parameters) as loader:
+            for feature_name, feature_description in self.descriptions['features'].items():
+                # specific handling for "combined" file
+                if feature_name == 'management_practice':
+                    if self.model_config["management_practice"] != "combined":
+                        # if not a combined file, then just move onto the next 
+                        # in the for loop and do nothing for this feature_name
+                        continue
+                cols_to_select = base_cols + [feature_name]
+                gdf_ = gdf[cols_to_select] # generate new interim GDF
+                gdf_['feature_name'] = feature_name
+                gdf_['feature_description'] = feature_description
+                gdf_['feature_value'] = gdf_[feature_name]
+                gdf_ = gdf_[base_cols + feature_cols]
+
+                # perform bulk insert of entire geopandas DF
+                logging.info(f"Storing point data output for {feature_name}...")
+                loader.copy(gdf_)
\ No newline at end of file
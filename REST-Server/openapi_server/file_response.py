@@ -0,0 +1,82 @@
+"""
+Serves result files without reading them into memory.
+
+Connexion reads the body of every response to validate it (the API is
+added with `validate_responses=True`), which fails on a file streamed in
+direct passthrough mode, so /result_file used to turn passthrough off and
+buffer entire files, some of them several GB, in the worker. A
+`FileResponse` streams the file instead (with `sendfile` where the WSGI
+server offers it) and shows an empty body to the validator, which has no
+schema to check result files against anyway.
+
+Responses support ranges, ETag and Last-Modified, and conditional GET. When
+`ACCEL_REDIRECT_LOCATION` is set in the `[APP]` section of config.ini, the
+response only carries an `X-Accel-Redirect` header, and nginx serves the
+file from that internal location itself (see model-service.conf).
+"""
+import configparser
+import mimetypes
+import os
+from urllib.parse import quote
+from zlib import adler32
+
+import flask
+from werkzeug.wsgi import wrap_file
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+
+class FileResponse(flask.Response):
+    """
+    A response streaming a file, whose body is not read back by response
+    validation.
+    """
+    def get_data(self, as_text=False):
+        if self.direct_passthrough:
+            return '' if as_text else b''
+        return super().get_data(as_text)
+
+
+def file_path(directory, filename):
+    """
+    The path of `filename` in `directory`, or None if it is not a file there.
+    """
+    directory = os.path.realpath(directory)
+    path = os.path.realpath(os.path.join(directory, filename))
+    if not path.startswith(directory + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def send_file(directory, filename):
+    """
+    A response serving `filename` from `directory`, or None if there is no
+    such file.
+    """
+    path = file_path(directory, filename)
+    if path is None:
+        return None
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    accel_location = config['APP'].get('ACCEL_REDIRECT_LOCATION', fallback='')
+    if accel_location:
+        relative_path = os.path.relpath(path, os.path.realpath(directory))
+        response = FileResponse(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = f"{accel_location.rstrip('/')}/{quote(relative_path)}"
+        return response
+
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        # removed since it was found, e.g. evicted from a cache
+        return None
+    stat = os.fstat(f.fileno())
+    response = FileResponse(wrap_file(flask.request.environ, f),
+                            mimetype=mimetype, direct_passthrough=True)
+    response.content_length = stat.st_size
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.last_modified = int(stat.st_mtime)
+    response.set_etag(f"{stat.st_mtime}-{stat.st_size}-{adler32(path.encode('utf-8')) & 0xffffffff}")
+    return response.make_conditional(flask.request, accept_ranges=True,
+                                     complete_length=stat.st_size)
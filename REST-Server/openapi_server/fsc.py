@@ -8,6 +8,12 @@ import time
 import logging
 import boto3
 from rq import Queue
+from openapi_server.result_index import record_success
+from openapi_server.docker_run import run_container, run_exec
+from openapi_server.warm_pool import lease_container, release_container
+
+# configuration keys the controller requires
+REQUIRED_PARAMETERS = ['year', 'country', 'production_decrease', 'fractional_reserve_access']
 
 def run_fsc(config, output_path):
     """
@@ -32,6 +38,7 @@ class FSCController(object):
         self.result_path = output_path
         self.result_name = self.model_config['run_id']
         self.run_id = self.model_config['run_id']
+        self.container_name = f"fsc-{self.run_id}"
         self.bucket = "world-modelers"
         self.key = f"results/fsc_model/{self.result_name}.zip"
         self.success_msg = 'Writing output of'
@@ -42,6 +49,8 @@ class FSCController(object):
                           {model_config['fractional_reserve_access']} \
                            {self.result_name}"
         self.volumes = {self.result_path: {'bind': '/outputs', 'mode': 'rw'}}
+        # number of long-lived FSC containers runs are executed in (0 for none)
+        self.warm_pool_size = self.config['FSC'].getint('WARM_POOL_SIZE', fallback=0)
 
         # The Redis connection has to be instantiated by this Class
         # since once instantiated, it cannot be pickled by RQ
@@ -60,26 +69,27 @@ class FSCController(object):
         # sleep to ensure that the originating API completes
         logging.info(f"Running model run with ID: {self.run_id}")
 
-        # run model (note that logs are returned since detach=False)
+        # run model, in a warm container if one is free, following its logs
+        # as they are written
+        warm = None
         try:
-            self.model = self.containers.run(self.fsc, 
-                                             volumes=self.volumes, 
-                                             entrypoint=self.entrypoint,
-                                             detach=False,
-                                             name='fsc')
-
-            run_logs = self.model.decode('utf-8')
+            warm = lease_container(self.client, self.r, 'fsc', self.fsc, self.warm_pool_size,
+                                   self.run_id, volumes=self.volumes)
+            if warm is not None:
+                succeeded, run_logs = run_exec(self.client, self.r, self.run_id, warm,
+                                               self.entrypoint, self.success_msg)
+            else:
+                succeeded, run_logs = run_container(self.containers, self.r, self.run_id, self.fsc, self.success_msg,
+                                                    volumes=self.volumes,
+                                                    entrypoint=self.entrypoint,
+                                                    name=self.container_name)
 
-            if self.success_msg in run_logs:
+            if succeeded:
                 logging.info("Model run: SUCCESS")          
                 try:
                     self.storeResults()
                     logging.info("Model output: STORED")
-                    self.r.hmset(self.run_id, 
-                        {'status': 'SUCCESS',
-                         'bucket': self.bucket,
-                         'key': self.key}
-                         )                    
+                    record_success(self.r, self.run_id, self.bucket, self.key, ingested=False)
                 except:
                     msg = 'Output storage failure.'
                     logging.error(msg)
@@ -92,9 +102,12 @@ class FSCController(object):
             logging.error(f"Model run FAIL: {e}")
             self.r.hmset(self.run_id, {'status': 'FAIL', 'output': str(e)})
         
-        # Prune old containers
-        prior_container = self.containers.get('fsc')
-        prior_container.remove()
+        if warm is not None:
+            release_container(self.r, warm.name, self.run_id)
+        else:
+            # Prune old containers
+            prior_container = self.containers.get(self.container_name)
+            prior_container.remove()
 
     def storeResults(self):
         result = f"{self.result_path}/{self.result_name}"
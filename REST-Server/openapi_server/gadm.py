@@ -0,0 +1,105 @@
+import os
+import logging
+
+import geopandas as gpd
+from shapely.geometry import box
+
+logging.basicConfig(level=logging.INFO)
+
+ADMIN_COLUMNS = ['country','state','admin1','admin2']
+
+SHAPEFILE = 'gadm36_2.shp'
+PARQUET = 'gadm36_2.parquet'
+
+# Admin2 boundaries already loaded by this process, keyed by GADM directory.
+# RQ forks a work horse per job, so a worker started through worker.py
+# (which calls preload) hands every job an already indexed copy.
+_admin2 = {}
+
+
+def read_shapefile(gadm_path):
+    """
+    Reads the GADM admin2 shapefile and keeps only the geometry and the
+    admin columns stored with model output.
+    """
+    logging.info("Loading GADM shapes...")
+    admin2 = gpd.read_file(os.path.join(gadm_path, SHAPEFILE))
+    admin2['country'] = admin2['NAME_0']
+    admin2['state'] = admin2['NAME_1']
+    admin2['admin1'] = admin2['NAME_1']
+    admin2['admin2'] = admin2['NAME_2']
+    return admin2[['geometry'] + ADMIN_COLUMNS]
+
+
+def convert(gadm_path):
+    """
+    Converts the GADM admin2 shapefile to GeoParquet next to it. The
+    parquet file holds only the columns we use and loads in a fraction
+    of the time it takes to parse the shapefile.
+    """
+    admin2 = read_shapefile(gadm_path)
+    parquet_path = os.path.join(gadm_path, PARQUET)
+
+    # write to a temporary file first so a concurrent reader never sees
+    # a partially written file
+    tmp = os.path.join(gadm_path, f".{PARQUET}.{os.getpid()}")
+    admin2.to_parquet(tmp, index=False)
+    os.replace(tmp, parquet_path)
+    logging.info(f"Converted GADM shapes to {parquet_path}")
+    return admin2
+
+
+def is_stale(gadm_path):
+    """
+    Whether the GeoParquet copy is missing or older than the shapefile.
+    """
+    parquet_path = os.path.join(gadm_path, PARQUET)
+    if not os.path.exists(parquet_path):
+        return True
+    shapefile_path = os.path.join(gadm_path, SHAPEFILE)
+    return (os.path.exists(shapefile_path) and
+            os.path.getmtime(shapefile_path) > os.path.getmtime(parquet_path))
+
+
+def preload(gadm_path):
+    """
+    Loads the admin2 boundaries for `gadm_path` into the process cache and
+    builds their spatial index (an STRtree), converting the shapefile to
+    GeoParquet first if needed.
+    """
+    if gadm_path in _admin2:
+        return _admin2[gadm_path]
+
+    if is_stale(gadm_path):
+        admin2 = convert(gadm_path)
+    else:
+        logging.info("Loading GADM shapes from GeoParquet...")
+        admin2 = gpd.read_parquet(os.path.join(gadm_path, PARQUET))
+
+    # the spatial index is built lazily by geopandas; touch it here so it
+    # is built once per process rather than by the first sjoin of each run
+    admin2.sindex
+    _admin2[gadm_path] = admin2
+    return admin2
+
+
+def clip(admin2, bbox):
+    """
+    The admin units whose extent intersects `bbox`, given as
+    [xmin, ymin, xmax, ymax] in the CRS of the boundaries.
+    """
+    idx = admin2.sindex.query(box(*bbox))
+    return admin2.iloc[sorted(idx)]
+
+
+def load_admin2(gadm_path, bbox=None):
+    """
+    Returns the GADM admin2 boundaries (geometry, country, state, admin1,
+    admin2), optionally limited to the units overlapping `bbox`. The
+    boundaries and their spatial index are shared by every caller in the
+    process, so treat the returned frame as read-only.
+    """
+    admin2 = preload(gadm_path)
+    if bbox is not None:
+        return clip(admin2, bbox)
+    return admin2
@@ -6,15 +6,21 @@ if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
 import docker
+import boto3
 import re
 import configparser
 import redis
 import time
 import logging
-import geopandas as gpd
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
-from openapi_server.util import raster2gpd
+from database import init_db
+from models import Metadata, Parameters
+from loader import register_run
+from openapi_server.raster import iter_raster_chunks
+from openapi_server.admin_grid import load_admin_grid
+from openapi_server import gadm
+from openapi_server.result_index import record_success
+from openapi_server.docker_run import run_container
+from openapi_server.cog import upload_cog
 import datetime
 import calendar
 
@@ -73,6 +79,7 @@ class KiController(object):
         self.s3_cred_path = config["MALNUTRITION"]["S3_CRED_PATH"]
         
         self.run_id = self.model_config['config']['run_id'] 
+        self.container_name = f"kimetrica-{self.run_id}"
         self.client = docker.from_env()
         self.containers = self.client.containers
         self.scheduler = 'drp_scheduler'
@@ -102,6 +109,8 @@ class KiController(object):
         self.network = self.create_network()
         self.db_container = self.run_db()
         self.gadm = config['GADM']['GADM_PATH']
+        self.admin_grid_path = config['GADM']['ADMIN_GRID_PATH']
+        self.chunk_size = int(config['INGEST']['CHUNK_SIZE'])
 
         # The Redis connection has to be instantiated by this Class
         # since once instantiated, it cannot be pickled by RQ
@@ -174,29 +183,26 @@ class KiController(object):
         logging.info(f"Running Kimetrica model run with ID: {self.run_id}")
         logging.info(f"Running Kimetrica model run with entrypoint: {self.entrypoint}")
         try:
-            self.model = self.containers.run(self.scheduler, 
-                                   environment=self.environment, 
-                                   volumes=self.volumes, 
-                                   network=self.network_name, 
-                                   links={self.db_container.short_id: None},
-                                   entrypoint=self.entrypoint,
-                                   detach=False,
-                                   name='kimetrica')
-            run_logs = self.model.decode('utf-8')
-
-            if self.success_msg in run_logs:
+            succeeded, run_logs = run_container(self.containers, self.r, self.run_id, self.scheduler, self.success_msg,
+                                                environment=self.environment,
+                                                volumes=self.volumes,
+                                                network=self.network_name,
+                                                links={self.db_container.short_id: None},
+                                                entrypoint=self.entrypoint,
+                                                name=self.container_name)
+
+            if succeeded:
+                logging.info("Model run: SUCCESS")
                 try:
                     self.ingest2db()
+                    # Success case requires ingest to DB; storeResults logs
+                    # its own failures
+                    self.storeResults()
+                    record_success(self.r, self.run_id, self.bucket, self.key)
                 except Exception as e:
                     msg = f'DB ingest failure: {e}.'
                     logging.error(msg)
-                    self.r.hmset(self.run_id, {'status': 'FAIL', 'output': msg})  
-                logging.info("Model run: SUCCESS")         
-                self.r.hmset(self.run_id, 
-                    {'status': 'SUCCESS',
-                     'bucket': self.bucket,
-                     'key': self.key}
-                         )
+                    self.r.hmset(self.run_id, {'status': 'FAIL', 'output': msg})
             else:
                 logging.error(f"Model run FAIL: {run_logs}")
                 self.r.hmset(self.run_id, {'status': 'FAIL', 'output': run_logs})
@@ -206,22 +212,37 @@ class KiController(object):
             self.r.hmset(self.run_id, {'status': 'FAIL', 'output': str(e)})
 
         # Prune old containers
-        prior_container = self.containers.get('kimetrica')
+        prior_container = self.containers.get(self.container_name)
         prior_container.remove()
 
 
+    def storeResults(self):
+        """
+        The container uploads the model's output as it was written; replace
+        it with a Cloud-Optimized GeoTIFF. The run keeps its result if this
+        fails, just not optimized.
+        """
+        result = f"{self.install_path}/output/{self.key}"
+        try:
+            session = boto3.Session(profile_name="wmuser")
+            s3 = session.client('s3')
+            upload_cog(s3, result, self.bucket, self.key, ExtraArgs={'ACL':'public-read'})
+            logging.info(f'Results stored at : https://s3.amazonaws.com/world-modelers/{self.key}')
+        except Exception as e:
+            logging.error(f"Could not store {result} as a COG: {e}")
+
+
+    def load_admin2(self):
+        """
+        Load Admin2 shape from GADM. Only needed when the admin grid for
+        an output raster has not been built yet.
+        """
+        return gadm.load_admin2(self.gadm)
+
+
     def ingest2db(self):
         init_db()
 
-        # Load Admin2 shape from GADM
-        logging.info("Loading GADM shapes...")
-        admin2 = gpd.read_file(f'{self.gadm}/gadm36_2.shp')
-        admin2['country'] = admin2['NAME_0']
-        admin2['state'] = admin2['NAME_1']
-        admin2['admin1'] = admin2['NAME_1']
-        admin2['admin2'] = admin2['NAME_2']
-        admin2 = admin2[['geometry','country','state','admin1','admin2']]
-
         # Add metadata object to DB
         # TODO: add run_label and run_description
         meta = Metadata(run_id=self.run_id, 
@@ -230,10 +251,9 @@ class KiController(object):
                         raw_output_link= f'https://s3.amazonaws.com/world-modelers/{self.key}',
                         point_resolution_meters=1000)
         logging.info("Storing metadata...")
-        db_session.add(meta)
-        db_session.commit()
 
         # Add parameters to DB
+        parameters = []
         logging.info("Storing parameters...")
         for param_name, param_val in self.model_config['config'].items():
             if param_name == 'run_id':
@@ -251,31 +271,35 @@ class KiController(object):
                                   parameter_name=param_name,
                                   parameter_value=param_val,
                                   parameter_type=param_type)
-                db_session.add(param)
-                db_session.commit()
+                parameters.append(param)
 
         # Process tiff file into point data
         logging.info("Processing tiff...")
         InRaster = f"{self.install_path}/output/{self.key}"
         feature_name = self.feature_name
         feature_description = self.feature_description
-        gdf = raster2gpd(InRaster,feature_name,band=self.band)
-        
-        # Spatial merge on GADM to obtain admin areas
-        gdf = gpd.sjoin(gdf, admin2, how="left", op='intersects')
-        
-        # Set run fields: datetime, run_id, model
-        gdf['datetime'] = self.start_time
-        gdf['run_id'] = self.run_id
-        gdf['model'] = self.name
-        gdf['feature_description'] = feature_description
-        del(gdf['geometry'])
-        del(gdf['index_right'])
-
-        # perform bulk insert of entire geopandas DF
-        logging.info("Storing point data output...")
-        db_session.bulk_insert_mappings(Output, gdf.to_dict(orient="records"))
-        db_session.commit()
+
+        # admin areas are looked up from a cached raster of GADM admin2 ids
+        # on the same grid as the output, rather than a spatial join
+        admin_grid = load_admin_grid(InRaster, self.admin_grid_path, self.load_admin2)
+
+        # the raster is streamed in fixed size chunks which are merged, stored
+        # and released one at a time to bound memory use
+        chunks = iter_raster_chunks(InRaster, feature_name, chunk_size=self.chunk_size, band=self.band,
+                                    geometry=False, keep_index=True)
+        with register_run(meta, parameters) as loader:
+            for gdf in chunks:
+                gdf = admin_grid.attach(gdf)
+
+                # Set run fields: datetime, run_id, model
+                gdf['datetime'] = self.start_time
+                gdf['run_id'] = self.run_id
+                gdf['model'] = self.name
+                gdf['feature_description'] = feature_description
+
+                # copy the chunk into the output table
+                logging.info(f"Storing {len(gdf)} points of output...")
+                loader.copy(gdf)
 
     def add_one_month(self, orig_date):
         # advance year and month by one month
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import copy
 import glob
 import redis
 import configparser
@@ -9,7 +10,10 @@ import json
 import yaml
 from pprint import pprint
 import os
+import tempfile
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 
 metadata_files = []
 for filename in glob.iglob('../metadata/models/**model-metadata.yaml', recursive=True):
@@ -29,143 +33,250 @@ port = config['UAZ-CONCEPTS']['PORT']
 endpoint = config['UAZ-CONCEPTS']['ENDPOINT']
 concept_mapper_endpoint = f"http://{host}:{port}/{endpoint}"
 
+# the concept mapper is queried by this many threads at once, and its
+# responses are cached on disk so unchanged metadata is not mapped again
+mapper_workers = config['UAZ-CONCEPTS'].getint('WORKERS', fallback=8)
+mapper_cache_path = config['UAZ-CONCEPTS'].get('CACHE_PATH', fallback='concept_cache')
+
 headers = {
     'Content-Type': 'application/json',
 }
 
-def main():
-    ##########################################
-    ########### Setting up concepts ##########
-    ##########################################
-    print("Setting up concepts...")
-    models = {}
+def mapper_cache_file(data):
+    """
+    The cache file of a concept mapper request, named by the hash of the
+    request (and of the mapper it was sent to).
+    """
+    key = json.dumps([concept_mapper_endpoint, data['name'], data['examples']])
+    return os.path.join(mapper_cache_path, sha256(key.encode('utf-8')).hexdigest() + '.json')
 
+def concept_matches(session, data):
+    """
+    The concept matches of a concept mapper request, from the cache if it
+    has been made before.
+    """
+    path = mapper_cache_file(data)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    response = session.post(concept_mapper_endpoint, headers=headers, json=data)
+    response.raise_for_status()
+    matches = response.json()['conceptMatches']
+
+    # written under a temporary name so that a partial file is never read
+    fd, tmp_path = tempfile.mkstemp(dir=mapper_cache_path, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(matches, f)
+    os.replace(tmp_path, path)
+    return matches
+
+def map_concepts(requests_data):
+    """
+    The concept matches of each of a list of concept mapper requests,
+    making the requests which are not cached concurrently.
+    """
+    os.makedirs(mapper_cache_path, exist_ok=True)
+    with requests.Session() as session:
+        session.mount('http://', HTTPAdapter(pool_maxsize=mapper_workers))
+        with ThreadPoolExecutor(max_workers=mapper_workers) as executor:
+            return list(executor.map(lambda data: concept_matches(session, data), requests_data))
+
+# the sha256 of each model's metadata file when it was last synced, and the
+# entries each model added to the concept lists, so that only models whose
+# metadata changed are synced
+MANIFEST = 'metadata-manifest'
+CONTRIBUTIONS = 'metadata-concepts'
+
+# incremented by every sync which changes anything, so that processes can
+# tell whether what they cached from Redis is still current
+VERSION = 'metadata-version'
+
+# every sync which changes anything publishes the ids of the models it
+# changed or removed here, for processes caching their metadata
+UPDATES_CHANNEL = 'metadata-updates'
+
+# the entries of a concept are indexed by type, in sorted sets of entry ids
+# scored by how well they match the concept, with the entries themselves
+# in a hash of the concept's entries by id
+CONCEPT_TYPES = ['model', 'parameter', 'output']
+
+def concept_index_key(concept, concept_type):
+    return f"concept-index:{concept}:{concept_type}"
+
+def concept_entries_key(concept):
+    return f"concept-entries:{concept}"
+
+def entry_id(entry):
+    return sha256(entry.encode('utf-8')).hexdigest()
+
+def concept_entries(r, concept, concept_type=None, limit=None):
+    """
+    The entries of a concept, of one type or of all types, best match first.
+    """
+    types = [concept_type] if concept_type else CONCEPT_TYPES
+    stop = limit - 1 if limit else -1
+    pipe = r.pipeline(transaction=False)
+    for tt in types:
+        pipe.zrevrange(concept_index_key(concept, tt), 0, stop, withscores=True)
+    ranked = sorted((ii for ids in pipe.execute() for ii in ids), key=lambda ii: ii[1], reverse=True)
+    if limit:
+        ranked = ranked[:limit]
+    if not ranked:
+        return []
+    entries = r.hmget(concept_entries_key(concept), [ii for ii, _ in ranked])
+    return [json.loads(ee) for ee in entries if ee is not None]
+
+def load_models():
+    """
+    The metadata of each model, and the sha256 of its metadata file.
+    """
+    models = {}
+    hashes = {}
     for m in metadata_files:
-        with open(m, 'r') as stream:
-            model = yaml.safe_load(stream)
-            models[model['id']] = model
-
-    concepts_m = {}
-    concepts_p = {}
-    concepts_o = {}
-
-    # for each model
-    for kk, vv in models.items():
-        
-        # use UAZ concept mapping service to get model level concepts
-        data = {"name": kk, "examples": [vv['description'], vv['label']]}
-        response = requests.post(concept_mapper_endpoint, headers=headers, json=data)
-        model_concepts = response.json()['conceptMatches']
-
-        # get its concepts
-        for concept in model_concepts:
-            cc = concept['concept']
-            m_ = {'name': kk, 'score': concept['score'], 'type': 'model'}
-            # if concept not in concepts dict, add it
-            if cc not in concepts_m:
-                concepts_m[cc] = set()
-                concepts_m[cc].add(json.dumps(m_))
-
-            # if concept in concepts, add model to set
-            else:
-                concepts_m[cc].add(json.dumps(m_))    
-
-        # get its parameters
-        for pp in vv.get('parameters',[]):
-
-            # use UAZ mapping service to map concepts
-            data = {"name": pp["name"], "examples": [pp["name"], pp["description"]]}
-            response = requests.post(concept_mapper_endpoint, headers=headers, json=data)
-            cons = response.json()['conceptMatches']
-
-            # if concept not in concepts dict, add it
-            for concept in cons:
-                cc = concept['concept']
-                pp['model'] = kk
-                pp['type'] = 'parameter'
-                pp['score'] = concept['score']
-                if cc not in concepts_p:
-                    concepts_p[cc] = set()
-                    concepts_p[cc].add(json.dumps(pp))
-
-                # if concept in concepts, add model to set
-                else:
-                    concepts_p[cc].add(json.dumps(pp))
-                    
-        # get its variables
-        for oo in vv.get('outputs',[]):
-
-            # use UAZ mapping service to map concepts
-            data = {"name": oo["name"], "examples": [oo["name"], oo["description"]]}
-            response = requests.post(concept_mapper_endpoint, headers=headers, json=data)
-            cons = response.json()['conceptMatches']
-
-            # if concept not in concepts dict, add it    
-            for concept in cons:
-                cc = concept['concept']
-                oo['model'] = kk
-                oo['type'] = 'output'                
-                oo['score'] = concept['score']
-                if cc not in concepts_o:
-                    concepts_o[cc] = set()
-                    concepts_o[cc].add(json.dumps(oo))
-                # if concept in concepts, add model to set
-                else:
-                    concepts_o[cc].add(json.dumps(oo))    
-
-    concept_names = set(list(concepts_m.keys()) + list(concepts_o.keys()) + list(concepts_p.keys()))
-
-    # delete the "concepts" set 
-    # ensures clean start based on model-metadata files
-    r.delete('concepts')
-
-    # add concepts to "concepts" set in Redis
-    for c in concept_names:
-        r.sadd('concepts', c)
-
-    combined = {'model': concepts_m,
-                'parameter': concepts_p,
-                'output': concepts_o
-                }
-
-    # if key for concept exists, delete it 
-    # this ensures a fresh start from whatever is in the model metadata file
-    for cc in concept_names:
-        if r.exists(cc):
-            r.delete(cc)
-            
-    for tt, cons in combined.items():
-        
-        for cc, vv in cons.items():
-
-            # for each item associated with each concept
-            for ee in vv:
-                # add the model to a Redis set named for the concept name
-                r.lpush(cc, ee)
-                                
-    ##########################################
-    ########### Setting up metadata ##########
-    ##########################################
-    print("Setting up metadata...")
-    models = []
-    for m in metadata_files:
-            with open(m, 'r') as stream:
-                model = yaml.safe_load(stream)
-                models.append(model)
+        with open(m, 'rb') as stream:
+            content = stream.read()
+        model = yaml.safe_load(content)
+        models[model['id']] = model
+        hashes[model['id']] = sha256(content).hexdigest()
+    return models, hashes
+
+def model_mapper_requests(kk, vv):
+    """
+    The concept mapper requests for a model, its parameters and its outputs.
+    """
+    mapper_requests = [{"name": kk, "examples": [vv['description'], vv['label']]}]
+    for pp in vv.get('parameters',[]):
+        mapper_requests.append({"name": pp["name"], "examples": [pp["name"], pp["description"]]})
+    for oo in vv.get('outputs',[]):
+        mapper_requests.append({"name": oo["name"], "examples": [oo["name"], oo["description"]]})
+    return mapper_requests
+
+def model_concepts(kk, vv, matches):
+    """
+    The entries a model adds to each concept's list, given an iterator over
+    the concept matches of its mapper requests.
+    """
+    vv = copy.deepcopy(vv)
+    concepts = {}
+
+    # get its concepts
+    for concept in next(matches):
+        m_ = {'name': kk, 'score': concept['score'], 'type': 'model'}
+        concepts.setdefault(concept['concept'], set()).add(json.dumps(m_))
+
+    # get its parameters
+    for pp in vv.get('parameters',[]):
+        for concept in next(matches):
+            pp['model'] = kk
+            pp['type'] = 'parameter'
+            pp['score'] = concept['score']
+            concepts.setdefault(concept['concept'], set()).add(json.dumps(pp))
+
+    # get its variables
+    for oo in vv.get('outputs',[]):
+        for concept in next(matches):
+            oo['model'] = kk
+            oo['type'] = 'output'
+            oo['score'] = concept['score']
+            concepts.setdefault(concept['concept'], set()).add(json.dumps(oo))
+
+    return {cc: sorted(ee) for cc, ee in concepts.items()}
+
+def decode_hash(h):
+    return {k.decode('utf-8'): v.decode('utf-8') for k, v in h.items()}
+
+def main():
+    """
+    Syncs the concepts and metadata in Redis with the model metadata files.
+
+    Only models whose metadata file was added, changed or removed since the
+    last sync are mapped to concepts and written, and all writes are made
+    in a single MULTI/EXEC transaction, so API processes see either the old
+    or the new metadata and never a partly written one. The transaction
+    WATCHes the manifest, so when several processes start at once only one
+    of them applies the changes.
+    """
+    models, hashes = load_models()
+
+    def sync(pipe):
+        manifest = decode_hash(pipe.hgetall(MANIFEST))
+        # without a manifest, or without a version (which every sync since
+        # concepts were indexed writes), the existing keys were not written
+        # by a sync and are replaced entirely
+        rebuild = not manifest or not pipe.exists(VERSION)
+        changed = [kk for kk in models if rebuild or manifest.get(kk) != hashes[kk]]
+        removed = [kk for kk in manifest if kk not in models]
+        if not changed and not removed:
+            print("Metadata unchanged")
+            return
+
+        old = {kk: json.loads(vv) for kk, vv in decode_hash(pipe.hgetall(CONTRIBUTIONS)).items()}
+        old_concepts = {c.decode('utf-8') for c in pipe.smembers('concepts')}
+        old_models = {m.decode('utf-8') for m in pipe.smembers('model-list')}
+
+        ##########################################
+        ########### Setting up concepts ##########
+        ##########################################
+        print(f"Setting up concepts for {len(changed)} changed and {len(removed)} removed models...")
+        mapper_requests = [req for kk in changed for req in model_mapper_requests(kk, models[kk])]
+        matches = iter(map_concepts(mapper_requests))
+        new = {kk: model_concepts(kk, models[kk], matches) for kk in changed}
+
+        contributions = {kk: old.get(kk, {}) for kk in models}
+        contributions.update(new)
+        concept_names = {cc for cons in contributions.values() for cc in cons}
+
+        pipe.multi()
+        if rebuild:
+            # concepts used to be stored as lists under their own names
+            for cc in old_concepts | concept_names:
+                pipe.delete(cc, concept_entries_key(cc),
+                            *[concept_index_key(cc, tt) for tt in CONCEPT_TYPES])
+            pipe.delete('concepts', 'model-list')
+            for kk in old_models - set(models):
+                pipe.delete(f"{kk}-meta")
+        else:
+            for kk in changed + removed:
+                for cc, entries in old.get(kk, {}).items():
+                    for ee in entries:
+                        pipe.zrem(concept_index_key(cc, json.loads(ee)['type']), entry_id(ee))
+                        pipe.hdel(concept_entries_key(cc), entry_id(ee))
+        for kk in changed:
+            for cc, entries in new[kk].items():
+                for ee in entries:
+                    entry = json.loads(ee)
+                    pipe.zadd(concept_index_key(cc, entry['type']), {entry_id(ee): entry['score']})
+                    pipe.hset(concept_entries_key(cc), entry_id(ee), ee)
+
+        stale = old_concepts - concept_names
+        if stale and not rebuild:
+            pipe.srem('concepts', *stale)
+        if concept_names:
+            pipe.sadd('concepts', *concept_names)
 
-    if r.exists('model-list'):
-        print("Deleting model-list set...")
-        r.delete('model-list')
-    else:
-        pass
+        ##########################################
+        ########### Setting up metadata ##########
+        ##########################################
+        print("Setting up metadata...")
+        for kk in removed:
+            pipe.srem('model-list', kk)
+            pipe.delete(f"{kk}-meta")
+            pipe.hdel(MANIFEST, kk)
+            pipe.hdel(CONTRIBUTIONS, kk)
+        for kk in changed:
+            pipe.set(f"{kk}-meta", json.dumps(models[kk]))
+            pipe.sadd('model-list', kk)
+            pipe.hset(MANIFEST, kk, hashes[kk])
+            pipe.hset(CONTRIBUTIONS, kk, json.dumps(new[kk]))
+        pipe.incr(VERSION)
+        pipe.publish(UPDATES_CHANNEL, json.dumps(changed + removed))
 
-    for m in models:
-        r.set(f"{m['id']}-meta", json.dumps(m))
-        r.sadd('model-list',m['id'])            
+    r.transaction(sync, MANIFEST)
 
 if __name__ == "__main__":
     main()
 
     print("We can obtain the models associated with 'economy', for example:")
-    elements = [json.loads(i.decode('utf-8')) for i in r.lrange( "rainfall", 0, -1 )]
+    elements = concept_entries(r, "rainfall")
     pprint(elements)
\ No newline at end of file
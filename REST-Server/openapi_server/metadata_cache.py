@@ -0,0 +1,109 @@
+"""
+An in-process cache of the responses of the exploration endpoints.
+
+Model metadata only changes when its YAML file does, so the formatted
+responses of /model_info, /model_parameters, /model_outputs, /model_config
+and /list_models are kept as serialized JSON in each process and served
+without a Redis round trip. A metadata sync publishes the models it changed
+or removed on the `metadata-updates` channel, and a thread in each process
+subscribed to it drops their responses.
+
+Nothing is cached while the subscription is down, and everything cached is
+dropped when it is (re)established, since updates published in between are
+not delivered.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import flask
+import redis
+
+from openapi_server.metadata import UPDATES_CHANNEL
+
+# seconds between attempts to resubscribe after losing the subscription
+RESUBSCRIBE_DELAY = 5
+
+
+class MetadataCache(object):
+    """
+    Serialized responses by (model name, endpoint), for the Redis connection `r`.
+    """
+
+    def __init__(self, r):
+        self.r = r
+        self.responses = {}
+        self.lock = threading.Lock()
+        # incremented by every invalidation, so that a response built from
+        # metadata read before an invalidation is not cached after it
+        self.generation = 0
+        self.listening = False
+        self.pid = None
+
+    def response(self, model_name, endpoint, build):
+        """
+        A JSON response of `build()`, the response of `endpoint` for
+        `model_name` (None for responses about every model).
+        """
+        self.subscribe()
+        key = (model_name, endpoint)
+        body = self.responses.get(key)
+        if body is None:
+            generation = self.generation
+            body = json.dumps(build()).encode('utf-8')
+            with self.lock:
+                if self.listening and generation == self.generation:
+                    self.responses[key] = body
+        return flask.Response(body, mimetype='application/json')
+
+    def invalidate(self, model_names=None):
+        """
+        Drops the responses for `model_names` and those about every model,
+        or all responses.
+        """
+        with self.lock:
+            self.generation += 1
+            if model_names is None:
+                self.responses = {}
+            else:
+                self.responses = {(m, e): body for (m, e), body in self.responses.items()
+                                  if m is not None and m not in model_names}
+
+    def subscribe(self):
+        """
+        Starts the subscription thread of this process (RQ and WSGI servers
+        fork processes, which do not inherit threads).
+        """
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.listening = False
+            self.responses = {}
+        threading.Thread(target=self.listen, daemon=True).start()
+
+    def listen(self):
+        while True:
+            try:
+                pubsub = self.r.pubsub()
+                pubsub.subscribe(UPDATES_CHANNEL)
+                for message in pubsub.listen():
+                    if message['type'] == 'subscribe':
+                        self.invalidate()
+                        self.listening = True
+                    elif message['type'] == 'message':
+                        self.invalidate(json.loads(message['data']))
+            except redis.exceptions.ConnectionError as e:
+                logging.warning(f"Lost the {UPDATES_CHANNEL} subscription: {e}")
+            except Exception:
+                # e.g. a malformed message; updates may have been missed
+                logging.exception(f"Error in the {UPDATES_CHANNEL} subscription")
+            finally:
+                # nothing is cached until the subscription is back
+                self.listening = False
+                self.invalidate()
+            time.sleep(RESUBSCRIBE_DELAY)
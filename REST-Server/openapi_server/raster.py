@@ -0,0 +1,239 @@
+import logging
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from osgeo import gdal
+from osgeo import gdal_array
+from osgeo import gdalconst
+
+logging.basicConfig(level=logging.INFO)
+
+# Upper bound on the number of pixels read from a band in a single window.
+# Windows are always full raster width and a whole number of GDAL blocks
+# tall so that results come back in the same row-major order as a
+# row-by-row scan.
+WINDOW_PIXELS = 2 ** 20
+
+# Default number of pixels per chunk yielded by iter_raster_chunks. The
+# ingest pipelines read theirs from the [INGEST] section of config.ini.
+CHUNK_SIZE = 100000
+
+
+def get_nodata(rBand, nodataval=-9999, ignore_band_nodata=False):
+    '''
+    Description:
+        Returns the NoData value for a band, falling back to `nodataval`
+        (as a float32) when the band does not define one or when
+        `ignore_band_nodata` is set.
+    '''
+    nData = None if ignore_band_nodata else rBand.GetNoDataValue()
+    if nData == None:
+        logging.info(f"No nodataval found, setting to {nodataval}")
+        nData = np.float32(nodataval) # set it to something if not set
+    else:
+        logging.info(f"Nodataval is: {nData}")
+    return nData
+
+
+def valid_mask(data, nData, mask_nan=True):
+    '''
+    Description:
+        Boolean mask of the pixels in `data` which are not NoData (and,
+        optionally, not NaN).
+        The comparison is carried out in the promoted dtype of the data and
+        the NoData value, which is what a per-pixel scalar comparison does.
+    '''
+    nData = np.asarray(nData)
+    dtype = np.result_type(data.dtype, nData.dtype)
+    mask = data.astype(dtype, copy=False) != nData.astype(dtype)
+    if mask_nan and np.issubdtype(data.dtype, np.floating):
+        mask &= ~np.isnan(data)
+    return mask
+
+
+def pixel_centres(GeoTrans, rows, cols):
+    '''
+    Description:
+        Converts arrays of pixel row/column indices into the x/y coordinates
+        of the pixel centres using the raster's geotransform.
+    '''
+    # this gives the upper left of the cell, offset by half a cell to get centre
+    X = GeoTrans[0] + ( cols * GeoTrans[1] )
+    Y = GeoTrans[3] + ( rows * GeoTrans[5] ) # Y is negative so it's a minus
+    X += GeoTrans[1] / 2
+    Y += GeoTrans[5] / 2
+    return X, Y
+
+
+def gdal_array_dtype(rBand):
+    '''
+    Description:
+        The NumPy dtype that `ReadAsArray` returns for a band.
+    '''
+    return np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(rBand.DataType))
+
+
+def iter_windows(ds, rBand, window_pixels=WINDOW_PIXELS):
+    '''
+    Description:
+        Yields (row offset, number of rows) windows covering the band. Each
+        window spans the full raster width and is a whole number of GDAL
+        blocks tall.
+    '''
+    _, block_rows = rBand.GetBlockSize()
+    block_rows = max(block_rows, 1)
+    rows_per_window = max(window_pixels // max(ds.RasterXSize, 1), 1)
+    rows_per_window = max((rows_per_window // block_rows) * block_rows, block_rows)
+    for row_off in range(0, ds.RasterYSize, rows_per_window):
+        yield row_off, min(rows_per_window, ds.RasterYSize - row_off)
+
+
+def iter_raster_blocks(InRaster, band=1, nodataval=-9999, mask_nan=True,
+                       ignore_band_nodata=False, window_pixels=WINDOW_PIXELS):
+    '''
+    Description:
+        Reads a raster band window by window and yields a dict of columnar
+        NumPy arrays (`row`, `col`, `longitude`, `latitude`, `feature_value`)
+        for the valid pixels in each window.
+    Params:
+        - InRaster: the path of the input raster file, or an open GDAL dataset
+        - band: the band to read
+        - nodataval: the NoData value to use if the band does not define one
+        - mask_nan: whether NaN pixels should be treated as NoData
+        - ignore_band_nodata: always use `nodataval`, even if the band
+          defines its own NoData value
+    '''
+    if isinstance(InRaster, gdal.Dataset):
+        ds = InRaster
+    else:
+        ds = gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
+    GeoTrans = ds.GetGeoTransform()
+    rBand    = ds.GetRasterBand(band)
+    nData    = get_nodata(rBand, nodataval, ignore_band_nodata)
+
+    # Check that NoDataValue is of the same type as the raster data
+    dtype = gdal_array_dtype(rBand)
+    if type(nData) != dtype.type:
+        logging.warning(f"NoData type mismatch: NoDataValue is type {type(nData)} and raster data is type {dtype.type}")
+
+    for row_off, n_rows in iter_windows(ds, rBand, window_pixels):
+        data = rBand.ReadAsArray(0, row_off, ds.RasterXSize, n_rows)
+        rows, cols = np.nonzero(valid_mask(data, nData, mask_nan))
+        values = data[rows, cols]
+        rows = rows + row_off
+        X, Y = pixel_centres(GeoTrans, rows, cols)
+        yield {'row': rows,
+               'col': cols,
+               'longitude': X,
+               'latitude': Y,
+               'feature_value': values}
+
+
+def raster2columns(InRaster, band=1, nodataval=-9999, mask_nan=True,
+                   ignore_band_nodata=False, window_pixels=WINDOW_PIXELS):
+    '''
+    Description:
+        Takes the path of a raster (.tiff) file and returns a dict of
+        columnar NumPy arrays for every valid pixel of a band, in row-major
+        order. See `iter_raster_blocks` for the available columns.
+    '''
+    blocks = list(iter_raster_blocks(InRaster, band=band, nodataval=nodataval,
+                                     mask_nan=mask_nan,
+                                     ignore_band_nodata=ignore_band_nodata,
+                                     window_pixels=window_pixels))
+    if not blocks:
+        return {'row': np.empty(0, dtype=np.int64),
+                'col': np.empty(0, dtype=np.int64),
+                'longitude': np.empty(0),
+                'latitude': np.empty(0),
+                'feature_value': np.empty(0)}
+    return concat_columns(blocks)
+
+
+def concat_columns(blocks):
+    '''
+    Description:
+        Concatenates a list of column dicts (as yielded by
+        `iter_raster_blocks`) into a single column dict.
+    '''
+    if len(blocks) == 1:
+        return blocks[0]
+    return {c: np.concatenate([b[c] for b in blocks]) for c in blocks[0]}
+
+
+def iter_raster_chunks(InRaster, feature_name, chunk_size=CHUNK_SIZE, band=1,
+                       nodataval=-9999, geometry=True, keep_index=False, mask_nan=True,
+                       ignore_band_nodata=False, window_pixels=WINDOW_PIXELS):
+    '''
+    Description:
+        Streams the valid pixels of a raster band as data frames of at most
+        `chunk_size` rows, in row-major order. Only the current window and
+        chunk are held in memory, so callers that process (spatial join,
+        DB insert) and release each chunk before asking for the next have a
+        peak memory footprint bounded by the chunk size, not the raster size.
+    Params:
+        - InRaster: the path of the input raster file, or an open GDAL dataset
+        - feature_name: the name of the feature represented by the pixel values
+        - chunk_size: the maximum number of pixels per chunk
+        - geometry: whether each chunk should carry shapely Points
+        - keep_index: whether each chunk should carry the pixel `row` and
+          `col` indices (e.g. for an admin_grid lookup)
+    '''
+    pending = []
+    n_pending = 0
+    for block in iter_raster_blocks(InRaster, band=band, nodataval=nodataval,
+                                    mask_nan=mask_nan,
+                                    ignore_band_nodata=ignore_band_nodata,
+                                    window_pixels=window_pixels):
+        n_block = len(block['row'])
+        if n_block == 0:
+            continue
+        pending.append(block)
+        n_pending += n_block
+        while n_pending >= chunk_size:
+            columns = concat_columns(pending)
+            yield columns2gpd({c: v[:chunk_size] for c, v in columns.items()},
+                              feature_name, geometry=geometry, keep_index=keep_index)
+            pending = [{c: v[chunk_size:] for c, v in columns.items()}]
+            n_pending -= chunk_size
+    if n_pending > 0:
+        yield columns2gpd(concat_columns(pending), feature_name, geometry=geometry,
+                          keep_index=keep_index)
+
+
+def columns2gpd(columns, feature_name, geometry=True, keep_index=False):
+    '''
+    Description:
+        Builds the point data frame used for ingestion from columnar pixel
+        data. Shapely points are only built when `geometry` is True and the
+        pixel `row`/`col` indices are only kept when `keep_index` is True.
+    '''
+    df = pd.DataFrame({'longitude': columns['longitude'],
+                       'latitude': columns['latitude'],
+                       'feature_value': columns['feature_value'],
+                       'feature_name': feature_name})
+    if keep_index:
+        df['row'] = columns['row']
+        df['col'] = columns['col']
+    if not geometry:
+        return df
+    points = gpd.points_from_xy(df['longitude'], df['latitude'])
+    gdf = gpd.GeoDataFrame(df, geometry=points)
+    return gdf[['geometry'] + [c for c in df.columns if c != 'geometry']]
+
+
+def raster2gpd(InRaster,feature_name,band=1,nodataval=-9999,geometry=True,mask_nan=True,
+               ignore_band_nodata=False):
+    '''
+    Description:
+        Takes the path of a raster (.tiff) file and produces a Geopandas Data Frame.
+    Params:
+        - InRaster: the path of the input raster file
+        - feature_name: the name of the feature represented by the pixel values
+        - geometry: whether to build a shapely Point per pixel; when False a
+          plain pandas DataFrame with longitude/latitude columns is returned
+    '''
+    columns = raster2columns(InRaster, band=band, nodataval=nodataval, mask_nan=mask_nan,
+                             ignore_band_nodata=ignore_band_nodata)
+    return columns2gpd(columns, feature_name, geometry=geometry)
@@ -0,0 +1,95 @@
+"""
+Subsets of result rasters: one band within a bounding box, read with a GDAL
+windowed read so that only the blocks intersecting the box are read, and
+written as a GeoTIFF or a CSV of pixel centres and values.
+
+Subsets are cached on disk by run, bounding box, band and format (and the
+modification time of the raster, so that a replaced raster is not served
+from the cache), in a directory under DATA_PATH which is evicted least
+recently used first.
+"""
+import json
+import math
+from hashlib import sha256
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+from osgeo import gdalconst
+
+from openapi_server.raster import get_nodata, valid_mask, pixel_centres
+
+FORMATS = {'tiff': '.tiff', 'csv': '.csv'}
+
+# subsets are written tiled and compressed
+CREATION_OPTIONS = ['TILED=YES', 'COMPRESS=DEFLATE']
+
+
+class SubsetError(ValueError):
+    """
+    A subset which cannot be taken from a raster, e.g. a bounding box
+    outside of it.
+    """
+
+
+def pixel_window(geotransform, width, height, bbox):
+    """
+    The (column offset, row offset, columns, rows) of the pixels of a north
+    up raster which intersect `bbox` ([xmin, ymin, xmax, ymax] in the
+    raster's coordinate system), or None if it does not intersect it.
+    """
+    x0, dx, _, y0, _, dy = geotransform
+    xmin, ymin, xmax, ymax = bbox
+    cols = sorted([(xmin - x0) / dx, (xmax - x0) / dx])
+    rows = sorted([(ymax - y0) / dy, (ymin - y0) / dy])
+    col_off = max(int(math.floor(cols[0])), 0)
+    row_off = max(int(math.floor(rows[0])), 0)
+    col_end = min(int(math.ceil(cols[1])), width)
+    row_end = min(int(math.ceil(rows[1])), height)
+    if col_end <= col_off or row_end <= row_off:
+        return None
+    return col_off, row_off, col_end - col_off, row_end - row_off
+
+
+def subset_name(run_id, bbox, band, fmt, mtime):
+    """
+    The file name of a subset in the cache.
+    """
+    key = json.dumps([run_id, [round(b, 6) for b in bbox], band, fmt, mtime])
+    return sha256(key.encode('utf-8')).hexdigest() + FORMATS[fmt]
+
+
+def write_subset(src_path, bbox, band, fmt, out_path):
+    """
+    Writes one band of a raster within `bbox` to `out_path`.
+    """
+    ds = gdal.Open(src_path, gdalconst.GA_ReadOnly)
+    if band < 1 or band > ds.RasterCount:
+        raise SubsetError(f"Band must be between 1 and {ds.RasterCount}")
+    window = pixel_window(ds.GetGeoTransform(), ds.RasterXSize, ds.RasterYSize, bbox)
+    if window is None:
+        raise SubsetError("Bounding box does not intersect the raster")
+
+    if fmt == 'tiff':
+        gdal.Translate(out_path, ds, format='GTiff', srcWin=list(window),
+                       bandList=[band], creationOptions=CREATION_OPTIONS)
+        return
+
+    col_off, row_off, cols, rows = window
+    rBand = ds.GetRasterBand(band)
+    data = rBand.ReadAsArray(col_off, row_off, cols, rows)
+    r, c = np.nonzero(valid_mask(data, get_nodata(rBand)))
+    X, Y = pixel_centres(ds.GetGeoTransform(), r + row_off, c + col_off)
+    pd.DataFrame({'latitude': Y, 'longitude': X, 'value': data[r, c]}) \
+        .to_csv(out_path, index=False)
+
+
+def cached_subset(cache, run_id, src_path, mtime, bbox, band, fmt):
+    """
+    The file name of a subset in `cache` (a DiskLRU), taking the subset
+    first if it is not cached.
+    """
+    name = subset_name(run_id, bbox, band, fmt, mtime)
+    if cache.get(name) is None:
+        cache.put(name, lambda out_path: write_subset(src_path, bbox, band, fmt, out_path))
+    return name
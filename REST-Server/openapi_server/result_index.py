@@ -0,0 +1,115 @@
+"""
+A durable index of the runs which succeeded, so that a run whose results
+already exist is not executed again once its hash has left Redis (e.g.
+after Redis was flushed or restored from an old snapshot).
+
+When a run succeeds its controller writes a manifest, `manifests/<run_id>.json`
+in the results bucket, recording the run's model, configuration and where
+its result was stored, and whether it was ingested into the output database.
+/run_model looks a run up here when Redis does not know it, and restores
+the run from its manifest instead of executing it if its result is still in
+the bucket and, for ingested runs, the run is still in the `metadata` table.
+"""
+import sys
+sys.path.append("../db")
+
+import configparser
+import json
+import logging
+import os
+
+import boto3
+import botocore
+
+from database import db_session
+from models import Metadata
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+MANIFEST_PREFIX = 'manifests'
+
+
+def manifest_key(run_id):
+    return f"{MANIFEST_PREFIX}/{run_id}.json"
+
+
+# the S3 client of this process and the process it was created in; RQ and
+# WSGI servers fork processes, which should not share a client
+_s3 = (None, None)
+
+
+def s3_client():
+    """
+    The S3 client of this process, created on first use rather than for
+    every lookup, since loading the profile takes longer than the lookup.
+    """
+    global _s3
+    pid, client = _s3
+    if pid != os.getpid():
+        session = boto3.Session(profile_name="wmuser")
+        client = session.client('s3')
+        _s3 = (os.getpid(), client)
+    return client
+
+
+def missing(error):
+    """
+    Whether an S3 ClientError means that the object does not exist.
+    """
+    return error.response['Error']['Code'] in ['404', 'NoSuchKey']
+
+
+def record_success(r, run_id, bucket, key, ingested=True):
+    """
+    Marks a run as SUCCESS, with the location of its result, and writes its
+    manifest. A manifest which cannot be written only costs rerunning the
+    run once Redis no longer has it, so the run still succeeds.
+    """
+    r.hmset(run_id, {'status': 'SUCCESS', 'bucket': bucket, 'key': key})
+    run = r.hgetall(run_id)
+    manifest = {'run_id': run_id,
+                'name': run[b'name'].decode('utf-8'),
+                'config': json.loads(run[b'config']),
+                'timestamp': float(run[b'timestamp']),
+                'bucket': bucket,
+                'key': key,
+                'ingested': ingested}
+    try:
+        s3_client().put_object(Bucket=config['S3']['BUCKET'],
+                               Key=manifest_key(run_id),
+                               Body=json.dumps(manifest).encode('utf-8'),
+                               ContentType='application/json')
+    except Exception as e:
+        logging.error(f"Could not write the manifest of run {run_id}: {e}")
+
+
+def find_result(run_id):
+    """
+    The manifest of a run whose results exist, or None. Most runs looked up
+    are new and have no manifest, which takes a single GET to find out.
+    """
+    s3 = s3_client()
+    try:
+        obj = s3.get_object(Bucket=config['S3']['BUCKET'], Key=manifest_key(run_id))
+    except botocore.exceptions.ClientError as e:
+        if missing(e):
+            return None
+        raise
+    manifest = json.loads(obj['Body'].read())
+
+    try:
+        s3.head_object(Bucket=manifest['bucket'], Key=manifest['key'])
+    except botocore.exceptions.ClientError as e:
+        if missing(e):
+            return None
+        raise
+
+    if manifest['ingested']:
+        try:
+            ingested = db_session.query(Metadata).get(run_id) is not None
+        finally:
+            db_session.remove()
+        if not ingested:
+            return None
+    return manifest
@@ -0,0 +1,94 @@
+"""
+Limits the number of runs of a model which execute at once.
+
+The runs holding one of a model's slots are kept in a Redis sorted set,
+`<model>-running`, scored by when their lease on the slot expires. Slots
+are taken by the RQ worker before it starts a run's job, along with the
+job's share of its pool's budget (see scheduler.py), and released when the
+job finishes; the lease only matters when the worker itself is killed, in
+which case its slot is reclaimed once the lease expires.
+"""
+import configparser
+import time
+
+import redis
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# the slots (`<name>-running`) and config.ini section (for the limit) of the
+# models whose runs are limited; both Kimetrica models share their slots
+SLOTS = {'dssat': ('dssat', 'DSSAT'),
+         'fsc': ('fsc', 'FSC'),
+         'multi_twist': ('multi_twist', 'TWIST'),
+         'malnutrition_model': ('kimetrica', 'MALNUTRITION'),
+         'population_model': ('kimetrica', 'MALNUTRITION')}
+
+# lease on a slot for jobs without a timeout of their own, and the slack
+# given on top of a job's timeout
+DEFAULT_LEASE = 12 * 3600
+LEASE_SLACK = 60
+
+
+def max_concurrent_runs(section):
+    """
+    The MAX_CONCURRENT_RUNS of a model's section in config.ini; 0 or less
+    means no limit.
+    """
+    return config[section].getint('MAX_CONCURRENT_RUNS', fallback=1)
+
+
+def acquire(r, key, run_id, limit, lease):
+    """
+    Takes one of the `limit` slots in `key` for `run_id` if one is free.
+    Returns whether it did.
+    """
+    with r.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(key)
+                now = time.time()
+                if pipe.zscore(key, run_id) is None and pipe.zcount(key, now, '+inf') >= limit:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.zremrangebyscore(key, '-inf', now)
+                pipe.zadd(key, {run_id: now + lease})
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                # another run took or released a slot in the meantime
+                continue
+
+
+def slot(job):
+    """
+    The slots key and limit of an RQ job's model, or None if its runs are
+    not limited.
+    """
+    name, section = SLOTS.get(job.meta.get('model'), (None, None))
+    if name is None:
+        return None
+    limit = max_concurrent_runs(section)
+    if limit <= 0:
+        return None
+    return f"{name}-running", limit
+
+
+def take_slot(r, job):
+    """
+    Takes one of the slots of a job's model if one is free (or its runs are
+    not limited). Returns whether it did.
+    """
+    limited = slot(job)
+    if limited is None:
+        return True
+    key, limit = limited
+    lease = (job.timeout if job.timeout and job.timeout > 0 else DEFAULT_LEASE) + LEASE_SLACK
+    return acquire(r, key, job.meta.get('run_id', job.id), limit, lease)
+
+
+def release_slot(r, job):
+    name, _ = SLOTS.get(job.meta.get('model'), (None, None))
+    if name is not None:
+        r.zrem(f"{name}-running", job.meta.get('run_id', job.id))
@@ -0,0 +1,240 @@
+"""
+Queues model runs by class and admits them against worker pool budgets.
+
+Runs are enqueued on one of three RQ queues, `fetch` (quick data fetches),
+`medium` and `long` (long simulations), so that a long DSSAT run does not
+hold up a CHIRPS fetch queued behind it. Which queue a model uses and the
+CPUs and memory one of its runs is estimated to take come from the
+`execution` section of its metadata.
+
+Workers belong to a pool, which has a CPU and memory budget shared by all
+of its workers (a `[POOL-<name>]` section of config.ini). A worker only
+starts a job once the job's estimated footprint fits into what is left of
+its pool's budget and one of its model's run slots is free (see
+run_slots.py), and puts it back on its queue otherwise. The jobs
+holding part of a budget are kept in the `<pool>-pool-jobs` sorted set,
+scored by when their lease expires, and their footprints in the
+`<pool>-pool-footprints` hash.
+
+The time each run waited for a worker and took to run are kept per model,
+for sizing the pools (see queue_stats.py).
+"""
+import logging
+import time
+
+import redis
+from rq import Queue, Worker
+
+from openapi_server.run_slots import take_slot, release_slot
+
+QUEUES = ['fetch', 'medium', 'long']
+
+# used for models whose metadata has no execution section
+DEFAULT_EXECUTION = {'queue': 'medium', 'cpus': 1, 'memory_mb': 1024}
+
+# lease on a budget for jobs without a timeout of their own, and the slack
+# given on top of a job's timeout
+DEFAULT_LEASE = 12 * 3600
+LEASE_SLACK = 60
+
+# seconds a worker waits after putting back a job which was not admitted,
+# before dequeueing again
+ADMIT_POLL = 5
+
+# number of wait and run times kept per model
+SAMPLES = 1000
+
+
+def enqueue(r, model, execution, run_id, f, *args):
+    """
+    Enqueues `f(*args)` for a run of `model` on the queue given by the
+    model's `execution` metadata.
+    """
+    execution = dict(DEFAULT_EXECUTION, **(execution or {}))
+    meta = {'run_id': run_id,
+            'model': model,
+            'cpus': execution['cpus'],
+            'memory_mb': execution['memory_mb'],
+            'enqueued_at': time.time()}
+    kwargs = {'meta': meta}
+    if 'timeout' in execution:
+        kwargs['job_timeout'] = execution['timeout']
+    return Queue(execution['queue'], connection=r).enqueue(f, *args, **kwargs)
+
+
+def pool_budget(config, pool):
+    """
+    The queues, CPUs and memory (MB) of a `[POOL-<name>]` section of
+    config.ini.
+    """
+    section = config[f"POOL-{pool}"]
+    queues = [q.strip() for q in section.get('QUEUES', ','.join(QUEUES)).split(',')]
+    return queues, section.getfloat('CPUS'), section.getint('MEMORY_MB')
+
+
+def pool_usage(r, pool, now):
+    """
+    The jobs holding part of a pool's budget and the CPUs and memory (MB)
+    they hold. `r` may also be a pipeline watching the pool's keys.
+    """
+    active = [j.decode('utf-8') for j in r.zrangebyscore(f"{pool}-pool-jobs", now, '+inf')]
+    used_cpus, used_memory = 0, 0
+    if active:
+        for footprint in r.hmget(f"{pool}-pool-footprints", active):
+            if footprint is not None:
+                c, m = footprint.decode('utf-8').split(',')
+                used_cpus, used_memory = used_cpus + float(c), used_memory + int(m)
+    return active, used_cpus, used_memory
+
+
+def reserve(r, pool, budget, job_id, cpus, memory_mb, lease):
+    """
+    Reserves `cpus` and `memory_mb` of a pool's budget for a job if they fit
+    into what is left of it. A job is always admitted into an idle pool, so
+    that jobs larger than the whole budget still run. Returns whether the
+    job was admitted.
+    """
+    jobs, footprints = f"{pool}-pool-jobs", f"{pool}-pool-footprints"
+    with r.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(jobs, footprints)
+                now = time.time()
+                active, used_cpus, used_memory = pool_usage(pipe, pool, now)
+                expired = pipe.zrangebyscore(jobs, '-inf', now)
+                if active and (used_cpus + cpus > budget[0] or used_memory + memory_mb > budget[1]):
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                if expired:
+                    pipe.zrem(jobs, *expired)
+                    pipe.hdel(footprints, *expired)
+                pipe.zadd(jobs, {job_id: now + lease})
+                pipe.hset(footprints, job_id, f"{cpus},{memory_mb}")
+                pipe.execute()
+                return True
+            except redis.WatchError:
+                continue
+
+
+def release(r, pool, job_id):
+    pipe = r.pipeline()
+    pipe.zrem(f"{pool}-pool-jobs", job_id)
+    pipe.hdel(f"{pool}-pool-footprints", job_id)
+    pipe.execute()
+
+
+def admit(r, pool, budget, job):
+    """
+    Takes one of the slots of a job's model (see run_slots.py) and reserves
+    its share of its pool's budget (without a pool, only the slot), if both
+    are free. Returns whether it did; nothing is held if it did not.
+    """
+    if not take_slot(r, job):
+        return False
+    if pool is None:
+        return True
+    cpus = job.meta.get('cpus', DEFAULT_EXECUTION['cpus'])
+    memory_mb = job.meta.get('memory_mb', DEFAULT_EXECUTION['memory_mb'])
+    lease = (job.timeout if job.timeout and job.timeout > 0 else DEFAULT_LEASE) + LEASE_SLACK
+    if not reserve(r, pool, budget, job.id, cpus, memory_mb, lease):
+        release_slot(r, job)
+        return False
+    return True
+
+
+def discharge(r, pool, job):
+    """
+    Releases what `admit` took for a job.
+    """
+    if pool is not None:
+        release(r, pool, job.id)
+    release_slot(r, job)
+
+
+def record(r, model, wait, run):
+    """
+    Keeps the time a run of `model` waited to start and took to run.
+    """
+    pipe = r.pipeline(transaction=False)
+    pipe.sadd('scheduler-models', model)
+    pipe.lpush(f"{model}-wait-times", wait)
+    pipe.ltrim(f"{model}-wait-times", 0, SAMPLES - 1)
+    pipe.lpush(f"{model}-run-times", run)
+    pipe.ltrim(f"{model}-run-times", 0, SAMPLES - 1)
+    pipe.execute()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def stats(r):
+    """
+    The number of recent runs and the median and 95th percentile of their
+    wait and run times (seconds) for each model.
+    """
+    models = sorted(m.decode('utf-8') for m in r.smembers('scheduler-models'))
+    pipe = r.pipeline(transaction=False)
+    for model in models:
+        pipe.lrange(f"{model}-wait-times", 0, -1)
+        pipe.lrange(f"{model}-run-times", 0, -1)
+    samples = pipe.execute()
+    summary = {}
+    for i, model in enumerate(models):
+        wait = [float(s) for s in samples[2 * i]]
+        run = [float(s) for s in samples[2 * i + 1]]
+        if not wait:
+            continue
+        summary[model] = {'runs': len(wait),
+                          'wait_p50': percentile(wait, 50), 'wait_p95': percentile(wait, 95),
+                          'run_p50': percentile(run, 50), 'run_p95': percentile(run, 95)}
+    return summary
+
+
+class BudgetWorker(Worker):
+    """
+    An RQ worker which only starts a job once one of its model's run slots
+    is free and it fits into its pool's budget, and records how long each
+    job waited and ran. Without a pool only the slots are checked.
+
+    A job which does not fit is put back at the end of its queue rather
+    than held by the worker: a dequeued job is in no RQ registry until its
+    work horse starts it, so it would be lost with the worker, and the
+    worker would stop sending heartbeats while it waited.
+    """
+
+    def __init__(self, *args, pool=None, budget=None, poll=ADMIT_POLL, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+        self.budget = budget
+        self.poll = poll
+
+    def execute_job(self, job, queue):
+        if not admit(self.connection, self.pool, self.budget, job):
+            return self.defer(job, queue)
+        try:
+            return self.timed(job, queue)
+        finally:
+            discharge(self.connection, self.pool, job)
+
+    def defer(self, job, queue):
+        """
+        Puts a job which was not admitted back on its queue, and waits a
+        little (sending a heartbeat) before dequeueing again.
+        """
+        logging.info(f"Job {job.id} cannot start yet (pool {self.pool}), requeueing it")
+        queue.enqueue_job(job)
+        self.heartbeat()
+        time.sleep(self.poll)
+
+    def timed(self, job, queue):
+        started = time.time()
+        try:
+            return super().execute_job(job, queue)
+        finally:
+            if 'model' in job.meta:
+                record(self.connection, job.meta['model'],
+                       started - job.meta.get('enqueued_at', started),
+                       time.time() - started)
@@ -0,0 +1,158 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from openapi_server import admin_grid
+from openapi_server.admin_grid import AdminGrid, grid_offset, grid_key, load_admin_grid
+from openapi_server.gadm import ADMIN_COLUMNS
+
+WGS84 = 'GEOGCS["WGS 84"]'
+
+# a 0.05 degree grid of 6 x 8 pixels with its top left corner at (30, 15)
+PARENT = ((30.0, 0.05, 0.0, 15.0, 0.0, -0.05), WGS84, (6, 8))
+
+# admin units 1 to 3: two regions of Ethiopia and one of Kenya, and no
+# admin unit (0) in the bottom right corner
+IDS = np.array([[1, 1, 1, 2, 2, 2, 2, 2],
+                [1, 1, 1, 2, 2, 2, 2, 2],
+                [1, 1, 1, 2, 2, 2, 2, 2],
+                [3, 3, 3, 3, 3, 2, 2, 2],
+                [3, 3, 3, 3, 3, 0, 0, 0],
+                [3, 3, 3, 3, 3, 0, 0, 0]], dtype=np.int32)
+ADMIN = pd.DataFrame([[None, None, None, None],
+                      ['Ethiopia', 'Amhara', 'Amhara', 'North Gondar'],
+                      ['Ethiopia', 'Tigray', 'Tigray', 'Central'],
+                      ['Kenya', 'Turkana', 'Turkana', 'Loima']], columns=ADMIN_COLUMNS)
+
+
+def admin_names(grid, rows, cols):
+    # pixels outside every admin unit are None, or NaN once through pandas
+    return [None if pd.isna(n) else n
+            for n in grid.lookup(np.array(rows), np.array(cols))['admin2']]
+
+
+def window(row, col, shape, parent=PARENT):
+    """
+    The grid of a window of `parent` at a (row, column) offset.
+    """
+    g, crs, _ = parent
+    return ((g[0] + col * g[1], g[1], g[2], g[3] + row * g[5], g[4], g[5]), crs, shape)
+
+
+class TestGridOffset(unittest.TestCase):
+    """Whether a raster's grid is a window of a larger raster's"""
+
+    def test_window(self):
+        self.assertEqual(grid_offset(window(2, 3, (3, 4)), PARENT), (2, 3))
+        self.assertEqual(grid_offset(PARENT, PARENT), (0, 0))
+        self.assertEqual(grid_offset(window(0, 0, (6, 8)), PARENT), (0, 0))
+
+    def test_rounding(self):
+        # geotransforms computed from bounding boxes are off by a little
+        g, crs, shape = window(2, 3, (3, 4))
+        self.assertEqual(grid_offset(((g[0] + 1e-10,) + g[1:3] + (g[3] - 1e-10,) + g[4:], crs, shape),
+                                     PARENT), (2, 3))
+
+    def test_not_aligned(self):
+        g, crs, shape = window(2, 3, (3, 4))
+        self.assertIsNone(grid_offset(((g[0] + 0.025,) + g[1:], crs, shape), PARENT))
+        self.assertIsNone(grid_offset((g[:3] + (g[3] + 0.01,) + g[4:], crs, shape), PARENT))
+
+    def test_outside(self):
+        self.assertIsNone(grid_offset(window(-1, 0, (3, 4)), PARENT))
+        self.assertIsNone(grid_offset(window(0, -2, (3, 4)), PARENT))
+        self.assertIsNone(grid_offset(window(4, 3, (3, 4)), PARENT))
+        self.assertIsNone(grid_offset(window(2, 5, (3, 4)), PARENT))
+
+    def test_other_grids(self):
+        g, crs, shape = window(2, 3, (3, 4))
+        self.assertIsNone(grid_offset((g, 'PROJCS["UTM 37N"]', shape), PARENT))
+        self.assertIsNone(grid_offset(((g[0], 0.1) + g[2:5] + (-0.1,), crs, shape), PARENT))
+        self.assertIsNone(grid_offset((g[:2] + (0.01,) + g[3:], crs, shape), PARENT))
+
+
+class TestAdminGrid(unittest.TestCase):
+    """Admin names of pixels read from a grid of admin ids"""
+
+    def setUp(self):
+        self.grid = AdminGrid(IDS, {c: ADMIN[c].values.astype(object) for c in ADMIN_COLUMNS})
+
+    def test_lookup(self):
+        lookup = self.grid.lookup(np.array([0, 0, 5, 3]), np.array([0, 7, 0, 5]))
+        self.assertEqual(lookup['country'].tolist(), ['Ethiopia', 'Ethiopia', 'Kenya', 'Ethiopia'])
+        self.assertEqual(lookup['admin1'].tolist(), ['Amhara', 'Tigray', 'Turkana', 'Tigray'])
+        self.assertEqual(admin_names(self.grid, [5], [7]), [None])
+
+    def test_window(self):
+        w = self.grid.window(2, 3, (3, 4))
+        self.assertEqual(w.ids.shape, (3, 4))
+        rows, cols = np.meshgrid(np.arange(3), np.arange(4), indexing='ij')
+        self.assertEqual(admin_names(w, rows.ravel(), cols.ravel()),
+                         admin_names(self.grid, rows.ravel() + 2, cols.ravel() + 3))
+        self.assertEqual(admin_names(w, [0, 1, 2], [0, 1, 3]), ['Central', 'Loima', None])
+
+    def test_attach(self):
+        df = pd.DataFrame({'row': [0, 4], 'col': [4, 1], 'feature_value': [1.5, 2.5]})
+        df = self.grid.attach(df)
+        self.assertEqual(list(df.columns), ['feature_value'] + ADMIN_COLUMNS)
+        self.assertEqual(df['state'].tolist(), ['Tigray', 'Turkana'])
+
+
+class TestLoadAdminGrid(unittest.TestCase):
+    """Admin grids of rasters cut from a larger raster"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.rasterized = []
+        patchers = [mock.patch.dict(admin_grid._grids, clear=True),
+                    mock.patch.object(admin_grid, 'rasterize_admin', self.rasterize_admin)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def rasterize_admin(self, admin2, GeoTrans, crs_wkt, shape):
+        self.rasterized.append((GeoTrans, shape))
+        row, col = grid_offset((GeoTrans, crs_wkt, shape), PARENT)
+        return IDS[row:row + shape[0], col:col + shape[1]].copy(), ADMIN
+
+    def load(self, grid, parent=None):
+        with mock.patch.object(admin_grid, 'raster_grid', return_value=grid):
+            return load_admin_grid('run.tif', self.tmp, lambda: None, parent=parent)
+
+    def test_window_of_parent(self):
+        grid = self.load(window(3, 4, (2, 3)), parent=PARENT)
+        # only the parent's grid is rasterized, and windows share it
+        self.assertEqual(self.rasterized, [(PARENT[0], PARENT[2])])
+        self.assertEqual(admin_names(grid, [0, 0, 1], [0, 1, 2]), ['Loima', 'Central', None])
+        self.load(window(0, 0, (4, 4)), parent=PARENT)
+        self.assertEqual(len(self.rasterized), 1)
+
+    def test_not_a_window(self):
+        g, crs, shape = window(3, 4, (2, 3))
+        grid = self.load(window(3, 4, (2, 3)), parent=window(0, 5, (6, 3)))
+        self.assertEqual(self.rasterized, [(g, shape)])
+        self.assertEqual(admin_names(grid, [0, 0], [0, 1]), ['Loima', 'Central'])
+
+    def test_cached(self):
+        self.load(PARENT)
+        admin_grid._grids.clear()
+        grid = self.load(window(2, 3, (3, 4)), parent=PARENT)
+        self.assertEqual(len(self.rasterized), 1)
+        # names are read back from the cache as they were stored
+        self.assertEqual(admin_names(grid, [0, 1, 2], [0, 1, 3]), ['Central', 'Loima', None])
+        self.assertIn(grid_key(*PARENT), admin_grid._grids)
+
+
+if __name__ == '__main__':
+    unittest.main()
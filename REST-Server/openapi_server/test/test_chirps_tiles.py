@@ -0,0 +1,155 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
+
+import numpy as np
+import rasterio
+import rasterio.errors
+from rasterio.transform import from_origin
+
+from openapi_server.chirps_tiles import TileCache, AFRICA_BBOX, cut, mutable
+
+LAYER = 'chirps:chirps_africa_1-dekad-3-2018_mm_data'
+
+
+class WCSStandIn(http.server.BaseHTTPRequestHandler):
+    """Serves the same layer for every request, counting requests"""
+
+    layer_path = None
+    requests = 0
+
+    def do_GET(self):
+        WCSStandIn.requests += 1
+        with open(self.layer_path, 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/tiff')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestChirpsTiles(unittest.TestCase):
+    """The CHIRPS tile cache, fetching from a local stand-in for the WCS proxy"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        xmin, ymin, xmax, ymax = AFRICA_BBOX
+        width, height = int((xmax - xmin) / 0.05), int((ymax - ymin) / 0.05)
+        self.data = np.arange(width * height, dtype='float32').reshape(height, width)
+        WCSStandIn.layer_path = os.path.join(self.tmp, 'layer.tiff')
+        WCSStandIn.requests = 0
+        with rasterio.open(WCSStandIn.layer_path, 'w', driver='GTiff', width=width, height=height,
+                           count=1, dtype='float32', crs='EPSG:4326', nodata=-9999,
+                           transform=from_origin(xmin, ymax, 0.05, 0.05)) as ds:
+            ds.write(self.data, 1)
+
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), WCSStandIn)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/wcsProxy.php?layerNameToUse={LAYER}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp)
+
+    def test_layer_is_fetched_once(self):
+        tiles = TileCache(os.path.join(self.tmp, 'tiles'), 0)
+        first = tiles.tile(LAYER, self.url)
+        second = tiles.tile(LAYER, self.url)
+        self.assertEqual(first, second)
+        self.assertEqual(WCSStandIn.requests, 1)
+        with rasterio.open(first) as ds:
+            self.assertEqual(ds.block_shapes, [(512, 512)])
+            np.testing.assert_array_equal(ds.read(1), self.data)
+
+    def test_cut(self):
+        tiles = TileCache(os.path.join(self.tmp, 'tiles'), 0)
+        out_path = os.path.join(self.tmp, 'run.tiff')
+        # a bbox off the 0.05 degree grid is snapped outwards
+        cut(tiles.tile(LAYER, self.url), [33.01, 3.01, 48.02, 14.94], out_path)
+        with rasterio.open(out_path) as ds:
+            self.assertEqual((ds.width, ds.height), (301, 239))
+            self.assertAlmostEqual(ds.transform.c, 33.0)
+            self.assertAlmostEqual(ds.transform.f, 14.95)
+            row, col = int(round((40 - 14.95) / 0.05)), int(round((33.0 + 20) / 0.05))
+            np.testing.assert_array_equal(ds.read(1), self.data[row:row + 239, col:col + 301])
+
+    def test_eviction(self):
+        tiles = TileCache(os.path.join(self.tmp, 'tiles'), 1)
+        tiles.tile(LAYER, self.url)
+        tiles.tile(LAYER.replace('dekad-3', 'dekad-2'), self.url)
+        self.assertEqual(os.listdir(tiles.path), ['chirps_chirps_africa_1-dekad-2-2018_mm_data.tif'])
+        tiles.tile(LAYER, self.url)
+        self.assertEqual(WCSStandIn.requests, 3)
+
+    def test_evicted_before_cut(self):
+        tiles = TileCache(os.path.join(self.tmp, 'tiles'), 0)
+        tile = tiles.tile
+
+        def evicted(*args):
+            # another worker evicts the layer before it is opened
+            path = tile(*args)
+            if WCSStandIn.requests == 1:
+                os.remove(path)
+            return path
+
+        out_path = os.path.join(self.tmp, 'run.tiff')
+        with mock.patch.object(tiles, 'tile', side_effect=evicted):
+            path = tiles.cut(LAYER, self.url, [33, 3, 48, 15], out_path)
+        self.assertEqual(WCSStandIn.requests, 2)
+        self.assertTrue(os.path.exists(path))
+        with rasterio.open(out_path) as ds:
+            self.assertEqual((ds.width, ds.height), (300, 240))
+
+    def test_evicted_again(self):
+        tiles = TileCache(os.path.join(self.tmp, 'tiles'), 0)
+        tile = tiles.tile
+
+        def evicted(*args):
+            path = tile(*args)
+            os.remove(path)
+            return path
+
+        with mock.patch.object(tiles, 'tile', side_effect=evicted):
+            with self.assertRaises(rasterio.errors.RasterioIOError):
+                tiles.cut(LAYER, self.url, [33, 3, 48, 15], os.path.join(self.tmp, 'run.tiff'))
+        self.assertEqual(WCSStandIn.requests, 2)
+
+    def test_ttl(self):
+        tiles = TileCache(os.path.join(self.tmp, 'tiles'), 0)
+        with mock.patch('openapi_server.chirps_tiles.time.time', return_value=3600 * 100 + 10):
+            first = tiles.tile(LAYER, self.url, ttl=3600)
+            self.assertEqual(tiles.tile(LAYER, self.url, ttl=3600), first)
+        self.assertEqual(WCSStandIn.requests, 1)
+        with mock.patch('openapi_server.chirps_tiles.time.time', return_value=3600 * 101 + 10):
+            second = tiles.tile(LAYER, self.url, ttl=3600)
+        self.assertNotEqual(second, first)
+        self.assertEqual(WCSStandIn.requests, 2)
+        # the superseded version is removed
+        self.assertEqual(os.listdir(tiles.path), [os.path.basename(second)])
+
+    def test_mutable(self):
+        today = datetime(2020, 6, 15)
+        self.assertTrue(mutable('chirpsgefslast:chirpsgefslast_africa_1-dekad-1-2018_mm_data', 1, 2018, today))
+        self.assertFalse(mutable(LAYER, 3, 2018, today))
+        # dekad 15 ends on May 30
+        self.assertTrue(mutable('chirps:chirps_africa_1-dekad-15-2020_mm_data', 15, 2020, today))
+        self.assertTrue(mutable('chirps:chirps_africa_1-dekad-12-2020_mm_data', '12', '2020', today))
+        self.assertFalse(mutable('chirps:chirps_africa_1-dekad-9-2020_mm_data', 9, 2020, today))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import boto3
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+from openapi_server import cog
+
+BUCKET = 'world-modelers'
+KEY = 'results/chirps/test.tiff'
+
+
+class TestCog(unittest.TestCase):
+    """Conversion of results to Cloud-Optimized GeoTIFFs, uploaded to a mock S3"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, 'striped.tiff')
+        self.data = np.arange(1200 * 1000, dtype='float32').reshape(1000, 1200)
+        # a striped, uncompressed GeoTIFF, as the models write them
+        with rasterio.open(self.src, 'w', driver='GTiff', width=1200, height=1000, count=1,
+                           dtype='float32', crs='EPSG:4326', nodata=-9999,
+                           transform=from_origin(30, 15, 0.05, 0.05)) as ds:
+            ds.write(self.data, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_overview_factors(self):
+        self.assertEqual(cog.overview_factors(512, 512), [])
+        self.assertEqual(cog.overview_factors(1200, 1000), [2, 4])
+        self.assertEqual(cog.overview_factors(7200, 2000), [2, 4, 8, 16])
+
+    @mock_aws
+    def test_upload_cog(self):
+        s3 = boto3.client('s3', region_name='us-east-1')
+        s3.create_bucket(Bucket=BUCKET)
+        cog.upload_cog(s3, self.src, BUCKET, KEY, ExtraArgs={'ACL': 'public-read'})
+
+        obj = s3.head_object(Bucket=BUCKET, Key=KEY)
+        self.assertEqual(obj['ContentType'], 'image/tiff')
+        # the source is left alone and no temporary files are left behind
+        self.assertEqual(os.listdir(self.tmp), ['striped.tiff'])
+
+        downloaded = os.path.join(self.tmp, 'cog.tiff')
+        s3.download_file(BUCKET, KEY, downloaded)
+        with rasterio.open(downloaded) as ds, rasterio.open(self.src) as src:
+            self.assertEqual(ds.profile['tiled'], True)
+            self.assertEqual(ds.block_shapes, [(512, 512)])
+            self.assertEqual(ds.compression.name.lower(), 'deflate')
+            self.assertEqual(ds.overviews(1), [2, 4])
+            self.assertEqual(ds.crs, src.crs)
+            self.assertEqual(ds.transform, src.transform)
+            self.assertEqual(ds.nodata, src.nodata)
+            np.testing.assert_array_equal(ds.read(1), self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from openapi_server.disk_cache import DiskLRU
+
+
+def write_bytes(n):
+    def write(out_path):
+        with open(out_path, 'wb') as f:
+            f.write(b'x' * n)
+    return write
+
+
+class TestDiskLRU(unittest.TestCase):
+    """The size bounded file cache used for subsets, tiles and admin grids"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def age(self, cache, name, seconds):
+        path = os.path.join(cache.path, name)
+        t = time.time() - seconds
+        os.utime(path, (t, t))
+
+    def test_directory_created_lazily(self):
+        cache = DiskLRU(self.path, 100)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertIsNone(cache.get('a.bin'))
+        self.assertFalse(os.path.exists(self.path))
+        path = cache.put('a.bin', write_bytes(10))
+        self.assertEqual(path, os.path.join(self.path, 'a.bin'))
+        self.assertEqual(cache.get('a.bin'), path)
+
+    def test_least_recently_used_evicted(self):
+        cache = DiskLRU(self.path, 25)
+        cache.put('a.bin', write_bytes(10))
+        cache.put('b.bin', write_bytes(10))
+        self.age(cache, 'a.bin', 20)
+        self.age(cache, 'b.bin', 10)
+        # a hit makes a the most recently used
+        cache.get('a.bin')
+        cache.put('c.bin', write_bytes(10))
+        self.assertEqual(sorted(os.listdir(self.path)), ['a.bin', 'c.bin'])
+        self.assertIsNone(cache.get('b.bin'))
+
+    def test_new_file_kept(self):
+        # a file larger than the whole cache is still kept until the next put
+        cache = DiskLRU(self.path, 15)
+        cache.put('a.bin', write_bytes(10))
+        self.age(cache, 'a.bin', 10)
+        cache.put('b.bin', write_bytes(20))
+        self.assertEqual(os.listdir(self.path), ['b.bin'])
+
+    def test_unbounded(self):
+        cache = DiskLRU(self.path, 0)
+        for name in ['a.bin', 'b.bin', 'c.bin']:
+            cache.put(name, write_bytes(10))
+        self.assertEqual(len(os.listdir(self.path)), 3)
+
+    def test_failed_write_leaves_nothing(self):
+        cache = DiskLRU(self.path, 100)
+
+        def fail(out_path):
+            write_bytes(10)(out_path)
+            raise RuntimeError('write failed')
+
+        with self.assertRaises(RuntimeError):
+            cache.put('a.bin', fail)
+        self.assertEqual(os.listdir(self.path), [])
+        self.assertIsNone(cache.get('a.bin'))
+
+
+if __name__ == '__main__':
+    unittest.main()
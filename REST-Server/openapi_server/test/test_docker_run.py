@@ -0,0 +1,136 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from openapi_server import docker_run
+from openapi_server.docker_run import iter_lines, follow_log, run_container, run_exec
+
+
+class TestIterLines(unittest.TestCase):
+    """Lines of a log streamed in arbitrary chunks"""
+
+    def test_split_across_chunks(self):
+        chunks = [b'start', b'ing run\nstep 1\nst', b'ep 2\n', b'\n', b'done\n']
+        self.assertEqual(list(iter_lines(chunks)), ['starting run', 'step 1', 'step 2', '', 'done'])
+
+    def test_partial_last_line(self):
+        self.assertEqual(list(iter_lines([b'step 1\nstep', b' 2'])), ['step 1', 'step 2'])
+
+    def test_carriage_returns(self):
+        self.assertEqual(list(iter_lines([b'step 1\r\nstep 2\r\n'])), ['step 1', 'step 2'])
+
+    def test_multibyte_character_split(self):
+        text = 'température 25°C\n'.encode('utf-8')
+        chunks = [text[:3], text[3:4], text[4:]]
+        self.assertEqual(list(iter_lines(chunks)), ['température 25°C'])
+
+    def test_long_line(self):
+        with mock.patch.object(docker_run, 'MAX_LINE', 10):
+            lines = list(iter_lines([b'x' * 8, b'x' * 8, b'\nend']))
+        self.assertEqual(lines, ['x' * 16, '', 'end'])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_lines([])), [])
+        self.assertEqual(list(iter_lines([b''])), [])
+
+
+class TestFollowLog(unittest.TestCase):
+    """Following a run's log and publishing its progress"""
+
+    def setUp(self):
+        self.r = fakeredis.FakeStrictRedis()
+
+    def test_success(self):
+        chunks = [b'loading\nrunning\n', b'Model run: SUCCESS\n']
+        succeeded, tail = follow_log(self.r, 'run', chunks, 'SUCCESS')
+        self.assertTrue(succeeded)
+        self.assertEqual(list(tail), ['loading', 'running', 'Model run: SUCCESS'])
+        self.assertEqual(self.r.hget('run', 'log'), b'Model run: SUCCESS')
+
+    def test_success_message_split_across_chunks(self):
+        succeeded, _ = follow_log(self.r, 'run', [b'Model run: SUC', b'CESS'], 'SUCCESS')
+        self.assertTrue(succeeded)
+
+    def test_failure(self):
+        succeeded, _ = follow_log(self.r, 'run', [b'loading\nTraceback\n'], 'SUCCESS')
+        self.assertFalse(succeeded)
+        self.assertEqual(self.r.hget('run', 'log'), b'Traceback')
+
+    def test_published_as_lines_arrive(self):
+        published = []
+
+        def chunks():
+            yield b'step 1\n'
+            published.append(self.r.hget('run', 'log'))
+            yield b'step 2\n'
+            published.append(self.r.hget('run', 'log'))
+
+        with mock.patch.object(docker_run, 'PUBLISH_INTERVAL', -1):
+            follow_log(self.r, 'run', chunks(), 'SUCCESS')
+        self.assertEqual(published, [b'step 1', b'step 2'])
+
+    def test_blank_lines_not_published(self):
+        follow_log(self.r, 'run', [b'step 1\n\n   \n'], 'SUCCESS')
+        self.assertEqual(self.r.hget('run', 'log'), b'step 1')
+
+    def test_nothing_logged(self):
+        succeeded, tail = follow_log(self.r, 'run', [], 'SUCCESS')
+        self.assertFalse(succeeded)
+        self.assertEqual(list(tail), [])
+        self.assertFalse(self.r.hexists('run', 'log'))
+
+    def test_long_lines_truncated(self):
+        follow_log(self.r, 'run', [b'x' * (docker_run.MAX_LOG + 10)], 'SUCCESS')
+        self.assertEqual(len(self.r.hget('run', 'log')), docker_run.MAX_LOG)
+
+    def test_tail(self):
+        chunks = [f"line {i}\n".encode('utf-8') for i in range(docker_run.TAIL_LINES + 5)]
+        _, tail = follow_log(self.r, 'run', chunks, 'SUCCESS')
+        self.assertEqual(len(tail), docker_run.TAIL_LINES)
+        self.assertEqual(tail[0], 'line 5')
+
+
+class TestRunContainer(unittest.TestCase):
+    """Success of a container run needs the message and a zero exit status"""
+
+    def setUp(self):
+        self.r = fakeredis.FakeStrictRedis()
+
+    def run_container(self, log, status):
+        container = mock.Mock()
+        container.logs.return_value = iter(log)
+        container.wait.return_value = {'StatusCode': status}
+        containers = mock.Mock()
+        containers.run.return_value = container
+        return run_container(containers, self.r, 'run', 'image', 'SUCCESS')
+
+    def test_succeeded(self):
+        self.assertEqual(self.run_container([b'SUCCESS\n'], 0), (True, 'SUCCESS'))
+
+    def test_exit_status(self):
+        succeeded, output = self.run_container([b'SUCCESS\n'], 1)
+        self.assertFalse(succeeded)
+        self.assertEqual(output, 'SUCCESS\nContainer exited with status 1')
+
+    def test_no_success_message(self):
+        succeeded, output = self.run_container([b'Traceback\n'], 0)
+        self.assertFalse(succeeded)
+        self.assertEqual(output, 'Traceback\nContainer exited with status 0')
+
+    def test_exec(self):
+        client = mock.Mock()
+        client.api.exec_create.return_value = {'Id': 'exec'}
+        client.api.exec_start.return_value = iter([b'SUCCESS\n'])
+        client.api.exec_inspect.return_value = {'ExitCode': 2}
+        succeeded, output = run_exec(client, self.r, 'run', mock.Mock(), ['run'], 'SUCCESS')
+        self.assertFalse(succeeded)
+        self.assertEqual(output, 'SUCCESS\nCommand exited with status 2')
+
+
+if __name__ == '__main__':
+    unittest.main()
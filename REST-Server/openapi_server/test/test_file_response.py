@@ -0,0 +1,143 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import configparser
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import flask
+
+from openapi_server import file_response
+from openapi_server.file_response import send_file
+
+CONTENT = bytes(range(256)) * 4
+
+
+def app_config(accel_location=''):
+    config = configparser.ConfigParser()
+    config['APP'] = {'ACCEL_REDIRECT_LOCATION': accel_location}
+    return config
+
+
+class TestSendFile(unittest.TestCase):
+    """Result files served with ranges and conditional requests"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tmp, 'results')
+        os.makedirs(os.path.join(self.directory, 'runs'))
+        for name in ['result.tif', os.path.join('runs', 'run 1.csv')]:
+            with open(os.path.join(self.directory, name), 'wb') as f:
+                f.write(CONTENT)
+        with open(os.path.join(self.tmp, 'secret.txt'), 'w') as f:
+            f.write('secret')
+
+        app = flask.Flask(__name__)
+
+        @app.route('/result_file/<path:name>')
+        def result_file(name):
+            response = send_file(self.directory, name)
+            if response is None:
+                return 'Result File Not Found', 404
+            return response
+
+        self.client = app.test_client()
+        self.set_config()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def set_config(self, accel_location=''):
+        patcher = mock.patch.object(file_response, 'config', app_config(accel_location))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, name='result.tif', **headers):
+        return self.client.get(f"/result_file/{name}", headers=headers)
+
+    def test_whole_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, CONTENT)
+        self.assertEqual(response.content_length, len(CONTENT))
+        self.assertEqual(response.mimetype, 'image/tiff')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        self.assertIsNotNone(response.headers.get('ETag'))
+        self.assertIsNotNone(response.last_modified)
+
+    def test_subdirectory(self):
+        response = self.get('runs/run 1.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/csv')
+        self.assertEqual(response.data, CONTENT)
+
+    def test_range(self):
+        response = self.get(Range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, CONTENT[10:20])
+        self.assertEqual(response.headers['Content-Range'], f"bytes 10-19/{len(CONTENT)}")
+        self.assertEqual(response.content_length, 10)
+
+    def test_open_range(self):
+        response = self.get(Range='bytes=1000-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, CONTENT[1000:])
+
+    def test_suffix_range(self):
+        response = self.get(Range='bytes=-16')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, CONTENT[-16:])
+        self.assertEqual(response.headers['Content-Range'],
+                         f"bytes {len(CONTENT) - 16}-{len(CONTENT) - 1}/{len(CONTENT)}")
+
+    def test_unsatisfiable_range(self):
+        response = self.get(Range=f"bytes={len(CONTENT)}-{len(CONTENT) + 10}")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], f"bytes */{len(CONTENT)}")
+
+    def test_not_modified(self):
+        etag = self.get().headers['ETag']
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        # a changed file has another ETag
+        with open(os.path.join(self.directory, 'result.tif'), 'ab') as f:
+            f.write(b'more')
+        response = self.get(**{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, CONTENT + b'more')
+
+    def test_stale_range(self):
+        # a range of a version of the file which has since changed is not
+        # honoured; the whole current file is sent instead
+        response = self.get(Range='bytes=0-9', **{'If-Range': '"stale"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, CONTENT)
+
+    def test_not_found(self):
+        for name in ['missing.tif', 'runs', '../secret.txt', 'runs/../../secret.txt']:
+            self.assertEqual(self.get(name).status_code, 404, name)
+
+    def test_body_hidden_from_validation(self):
+        with flask.Flask(__name__).test_request_context('/result_file/result.tif'):
+            response = send_file(self.directory, 'result.tif')
+            self.assertEqual(response.get_data(), b'')
+            response.close()
+
+    def test_accel_redirect(self):
+        self.set_config('/internal-results/')
+        response = self.get('runs/run 1.csv')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Accel-Redirect'], '/internal-results/runs/run%201.csv')
+        self.assertEqual(response.mimetype, 'text/csv')
+        # nginx sends the file itself
+        self.assertEqual(response.data, b'')
+        self.assertEqual(self.get('../secret.txt').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from openapi_server.controllers import execution_controller as ec
+import run_index
+
+MODELS = ['dssat', 'fsc', 'multi_twist']
+
+
+class ListRunsTestCase(unittest.TestCase):
+    """Runs of a few models in a fake Redis"""
+
+    def setUp(self):
+        self.r = fakeredis.FakeStrictRedis()
+        for patcher in [mock.patch.object(ec, 'r', self.r),
+                        mock.patch.object(ec, 'available_models', MODELS)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # DSSAT and FSC runs are kept under their upper case names
+        self.runs = {'dssat': self.add_runs('DSSAT', 'dssat', 25),
+                     'fsc': self.add_runs('FSC', 'fsc', 3),
+                     'multi_twist': []}
+
+    def add_runs(self, set_name, prefix, n):
+        run_ids = [f"{prefix}-{i:02d}" for i in range(n)]
+        for i, run_id in enumerate(run_ids):
+            self.r.hmset(run_id, {'name': prefix, 'config': '{}', 'status': 'SUCCESS', 'timestamp': 1000 * i,
+                                  'bucket': 'results', 'key': f"{run_id}.csv"})
+            run_index.add_run(self.r, set_name, run_id, 1000 * i)
+        return run_ids
+
+
+class TestScanRuns(ListRunsTestCase):
+    """Paging through a model's set with SSCAN"""
+
+    def test_pages(self):
+        run_ids, cursor = [], 0
+        for _ in range(100):
+            page, cursor = ec.scan_runs('DSSAT', cursor, 4)
+            # the last page may be short, the others are never
+            if cursor != 0:
+                self.assertGreaterEqual(len(page), 4)
+            run_ids.extend(page)
+            if cursor == 0:
+                break
+        self.assertEqual(cursor, 0)
+        self.assertEqual(sorted(run_ids), self.runs['dssat'])
+
+    def test_whole_set(self):
+        run_ids, cursor = ec.scan_runs('FSC', 0, 100)
+        self.assertEqual(cursor, 0)
+        self.assertEqual(sorted(run_ids), self.runs['fsc'])
+
+    def test_missing_set(self):
+        self.assertEqual(ec.scan_runs('multi_twist', 0, 10), ([], 0))
+
+
+class TestLatestRuns(ListRunsTestCase):
+    """Paging through a model's runs newest first"""
+
+    def test_newest_first(self):
+        run_ids, offset = ec.latest_runs('dssat', 0, 5)
+        self.assertEqual(run_ids, self.runs['dssat'][::-1][:5])
+        self.assertEqual(offset, 5)
+        run_ids, offset = ec.latest_runs('DSSAT', offset, 5)
+        self.assertEqual(run_ids, self.runs['dssat'][::-1][5:10])
+
+    def test_last_page(self):
+        run_ids, offset = ec.latest_runs('dssat', 20, 10)
+        self.assertEqual(run_ids, self.runs['dssat'][::-1][20:])
+        self.assertEqual(offset, 0)
+        self.assertEqual(ec.latest_runs('multi_twist', 0, 10), ([], 0))
+
+
+class TestPageRuns(ListRunsTestCase):
+    """Paging through the runs of every model"""
+
+    def test_pages(self):
+        run_ids, cursor, pages = [], '0', 0
+        while True:
+            page, cursor = ec.page_runs(cursor, 7)
+            pages += 1
+            run_ids.extend(page)
+            if cursor == 0:
+                break
+            model, _, model_cursor = cursor.rpartition(':')
+            self.assertIn(model, MODELS)
+            self.assertGreaterEqual(len(page), 7)
+        self.assertLessEqual(pages, 5)
+        self.assertEqual(sorted(run_ids), self.runs['dssat'] + self.runs['fsc'])
+
+    def test_across_models(self):
+        # a page takes the rest of a model's runs and carries on with the next
+        run_ids, cursor = ec.page_runs('0', 27)
+        self.assertEqual(len(run_ids), 27)
+        self.assertTrue(cursor.startswith('fsc:'))
+        run_ids, cursor = ec.page_runs(cursor, 27)
+        self.assertEqual(len(run_ids), 1)
+        self.assertEqual(cursor, 0)
+
+    def test_invalid_cursor(self):
+        for cursor in ['abc', 'unknown:0', 'dssat:abc']:
+            with self.assertRaises(ValueError):
+                ec.page_runs(cursor, 10)
+
+
+class TestListRuns(ListRunsTestCase):
+    """/list_runs with and without pagination"""
+
+    def test_unpaginated(self):
+        self.assertEqual(sorted(ec.list_runs_model_name_get('DSSAT')), self.runs['dssat'])
+        self.assertEqual(ec.list_runs_model_name_get('multi_twist'), [])
+
+    def test_limit(self):
+        run_ids, status, headers = ec.list_runs_model_name_get('dssat', limit=10)
+        self.assertEqual(status, 200)
+        self.assertGreaterEqual(len(run_ids), 10)
+        rest, _, headers = ec.list_runs_model_name_get('dssat', limit=100, cursor=headers['X-Next-Cursor'])
+        self.assertEqual(headers['X-Next-Cursor'], '0')
+        self.assertEqual(sorted(run_ids + rest), self.runs['dssat'])
+
+    def test_latest(self):
+        run_ids, _, headers = ec.list_runs_model_name_get('dssat', limit=3, latest=True)
+        self.assertEqual(run_ids, ['dssat-24', 'dssat-23', 'dssat-22'])
+        self.assertEqual(headers['X-Next-Cursor'], '3')
+        run_ids, _, headers = ec.list_runs_model_name_get('dssat', cursor='3', latest=True)
+        self.assertEqual(run_ids, self.runs['dssat'][::-1][3:])
+        self.assertEqual(headers['X-Next-Cursor'], '0')
+
+    def test_invalid_cursor(self):
+        self.assertEqual(ec.list_runs_model_name_get('dssat', cursor='abc')[1], 400)
+        self.assertEqual(ec.available_results_get(cursor='abc')[1], 400)
+
+    def test_available_results(self):
+        results, status, headers = ec.available_results_get(limit=100)
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['X-Next-Cursor'], '0')
+        self.assertEqual(len(results), len(self.runs['dssat']) + len(self.runs['fsc']))
+
+
+class TestRegisterRun(ListRunsTestCase):
+    """A submitted run is added to its model's set and timestamp index"""
+
+    def test_registered(self):
+        request = mock.Mock(is_json=True)
+        request.get_json.return_value = {'name': 'dssat', 'config': {'rainfall': 0.5}}
+        with mock.patch.object(ec.connexion, 'request', request), \
+                mock.patch.object(ec, 'non_executable_models', []), \
+                mock.patch.object(ec, 'missing_parameters', return_value=[]), \
+                mock.patch.object(ec.result_index, 'find_result', return_value=None), \
+                mock.patch.object(ec.scheduler, 'enqueue') as enqueue:
+            run_id = ec.run_model_post()
+        enqueue.assert_called_once()
+        self.assertTrue(self.r.sismember('DSSAT', run_id))
+        self.assertEqual(self.r.zrevrange('DSSAT-by-time', 0, 0), [run_id.encode('utf-8')])
+        self.assertEqual(ec.latest_runs('dssat', 0, 1), ([run_id], 1))
+        self.assertFalse(self.r.exists('dssat'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,226 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from hashlib import sha256
+from unittest import mock
+
+import fakeredis
+import yaml
+
+from openapi_server import metadata
+
+
+def fake_matches(requests_data):
+    """
+    Stands in for the concept mapper: each request matches two concepts,
+    with scores derived from the request, so that editing a description
+    changes its matches.
+    """
+    matches = []
+    for data in requests_data:
+        digest = int(sha256(json.dumps(data).encode('utf-8')).hexdigest(), 16)
+        matches.append([{'concept': f"concept-{digest % 3}", 'score': (digest % 1000) / 1000},
+                        {'concept': f"concept-{len(data['name']) % 2 + 3}", 'score': (digest % 97) / 100}])
+    return matches
+
+
+def model(model_id, description):
+    return {'id': model_id,
+            'label': model_id.upper(),
+            'description': description,
+            'parameters': [{'name': f"{model_id}_rainfall", 'description': 'Rainfall multiplier'},
+                           {'name': f"{model_id}_year", 'description': 'Start year'}],
+            'outputs': [{'name': f"{model_id}_yield", 'description': 'Crop yield'}]}
+
+
+class MetadataTestCase(unittest.TestCase):
+    """Syncs metadata files in a temporary directory into a fake Redis"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.r = fakeredis.FakeStrictRedis()
+        self.write_model(model('alpha', 'A crop model'))
+        self.write_model(model('beta', 'A hydrology model'))
+        self.write_model(model('gamma', 'A market model'))
+        self.mapped = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_model(self, m):
+        with open(os.path.join(self.tmp, f"{m['id']}-model-metadata.yaml"), 'w') as f:
+            yaml.safe_dump(m, f)
+
+    def map_concepts(self, requests_data):
+        self.mapped.extend(data['name'] for data in requests_data)
+        return fake_matches(requests_data)
+
+    def sync(self, r=None):
+        files = sorted(os.path.join(self.tmp, f) for f in os.listdir(self.tmp))
+        with mock.patch.object(metadata, 'r', r or self.r), \
+                mock.patch.object(metadata, 'metadata_files', files), \
+                mock.patch.object(metadata, 'map_concepts', self.map_concepts):
+            metadata.main()
+
+    def state(self, r):
+        """
+        Everything the API reads: the models, their metadata and the
+        entries of every concept by type, and the index of the entries.
+        """
+        concepts = sorted(c.decode('utf-8') for c in r.smembers('concepts'))
+        models = sorted(m.decode('utf-8') for m in r.smembers('model-list'))
+        index = {k: r.zrange(k, 0, -1, withscores=True) for k in r.scan_iter('concept-index:*')}
+        index.update({k: r.hgetall(k) for k in r.scan_iter('concept-entries:*')})
+        return {'models': {m: json.loads(r.get(f"{m}-meta")) for m in models},
+                'concepts': {c: {t: metadata.concept_entries(r, c, t) for t in metadata.CONCEPT_TYPES}
+                             for c in concepts},
+                'index': index}
+
+    def rebuilt_state(self):
+        """
+        The state a sync into an empty Redis gives.
+        """
+        r = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+        self.sync(r)
+        return self.state(r)
+
+
+class TestMetadataSync(MetadataTestCase):
+    """Incremental syncs of the metadata files"""
+
+    def test_first_sync(self):
+        self.sync()
+        state = self.state(self.r)
+        self.assertEqual(sorted(state['models']), ['alpha', 'beta', 'gamma'])
+        self.assertEqual(state['models']['beta']['description'], 'A hydrology model')
+        # each model maps itself, two parameters and an output
+        self.assertEqual(len(self.mapped), 12)
+        self.assertEqual(int(self.r.get(metadata.VERSION)), 1)
+
+    def test_restart_without_changes(self):
+        self.sync()
+        state, version = self.state(self.r), self.r.get(metadata.VERSION)
+        self.mapped = []
+        pubsub = self.r.pubsub()
+        pubsub.subscribe(metadata.UPDATES_CHANNEL)
+        pubsub.get_message()
+        self.sync()
+        self.assertEqual(self.mapped, [])
+        self.assertEqual(self.r.get(metadata.VERSION), version)
+        self.assertIsNone(pubsub.get_message())
+        self.assertEqual(self.state(self.r), state)
+
+    def test_edit(self):
+        self.sync()
+        self.mapped = []
+        pubsub = self.r.pubsub()
+        pubsub.subscribe(metadata.UPDATES_CHANNEL)
+        pubsub.get_message()
+        self.write_model(model('beta', 'A groundwater model'))
+        self.sync()
+        # only the edited model is mapped again
+        self.assertEqual(self.mapped, ['beta', 'beta_rainfall', 'beta_year', 'beta_yield'])
+        self.assertEqual(json.loads(pubsub.get_message()['data']), ['beta'])
+        state = self.state(self.r)
+        self.assertEqual(state['models']['beta']['description'], 'A groundwater model')
+        self.assertEqual(state, self.rebuilt_state())
+
+    def test_removal(self):
+        self.sync()
+        self.mapped = []
+        os.remove(os.path.join(self.tmp, 'gamma-model-metadata.yaml'))
+        self.sync()
+        self.assertEqual(self.mapped, [])
+        self.assertIsNone(self.r.get('gamma-meta'))
+        self.assertIsNone(self.r.hget(metadata.MANIFEST, 'gamma'))
+        state = self.state(self.r)
+        self.assertEqual(sorted(state['models']), ['alpha', 'beta'])
+        entries = [e for types in state['concepts'].values() for es in types.values() for e in es]
+        self.assertFalse([e for e in entries if e.get('model', e['name']) == 'gamma'])
+        self.assertEqual(state, self.rebuilt_state())
+
+    def test_rebuild_from_list_layout(self):
+        # concepts as they were stored before syncs were incremental: a list
+        # of JSON entries under the concept's name, and no manifest
+        self.r.sadd('concepts', 'concept-0', 'retired-concept')
+        self.r.lpush('concept-0', json.dumps({'name': 'alpha', 'score': 0.5, 'type': 'model'}))
+        self.r.lpush('retired-concept', json.dumps({'name': 'delta', 'score': 0.9, 'type': 'model'}))
+        self.r.sadd('model-list', 'alpha', 'delta')
+        self.r.set('delta-meta', json.dumps(model('delta', 'A retired model')))
+        self.sync()
+        self.assertEqual(len(self.mapped), 12)
+        self.assertFalse(self.r.exists('concept-0'))
+        self.assertFalse(self.r.exists('retired-concept'))
+        self.assertFalse(self.r.sismember('concepts', 'retired-concept'))
+        self.assertIsNone(self.r.get('delta-meta'))
+        self.assertEqual(self.state(self.r), self.rebuilt_state())
+
+    def test_rebuild_without_version(self):
+        # synced before concepts were indexed: a manifest but no version
+        self.sync()
+        self.r.delete(metadata.VERSION)
+        self.mapped = []
+        self.sync()
+        self.assertEqual(len(self.mapped), 12)
+        self.assertEqual(self.state(self.r), self.rebuilt_state())
+
+
+class TestConceptEntries(MetadataTestCase):
+    """Entries of a concept read from the index"""
+
+    def setUp(self):
+        super().setUp()
+        self.sync()
+        contributions = {kk: json.loads(vv) for kk, vv in
+                         metadata.decode_hash(self.r.hgetall(metadata.CONTRIBUTIONS)).items()}
+        self.entries = {}
+        for concepts in contributions.values():
+            for cc, entries in concepts.items():
+                self.entries.setdefault(cc, []).extend(json.loads(ee) for ee in entries)
+
+    def expected(self, concept, concept_type=None):
+        return sorted((e for e in self.entries[concept] if concept_type in (None, e['type'])),
+                      key=lambda e: e['score'], reverse=True)
+
+    def test_best_match_first(self):
+        for concept in self.entries:
+            for concept_type in [None] + metadata.CONCEPT_TYPES:
+                entries = metadata.concept_entries(self.r, concept, concept_type)
+                expected = self.expected(concept, concept_type)
+                self.assertEqual([e['score'] for e in entries], [e['score'] for e in expected])
+                self.assertCountEqual(entries, expected)
+
+    def test_limit(self):
+        for concept in self.entries:
+            for concept_type in [None] + metadata.CONCEPT_TYPES:
+                expected = self.expected(concept, concept_type)
+                for limit in [1, 2, 5]:
+                    entries = metadata.concept_entries(self.r, concept, concept_type, limit)
+                    self.assertEqual(len(entries), min(limit, len(expected)))
+                    self.assertEqual([e['score'] for e in entries],
+                                     [e['score'] for e in expected][:limit])
+
+    def test_types(self):
+        for concept in self.entries:
+            for concept_type in metadata.CONCEPT_TYPES:
+                entries = metadata.concept_entries(self.r, concept, concept_type)
+                self.assertLessEqual({e['type'] for e in entries}, {concept_type})
+        # every parameter has a concept, which lists it with its model
+        parameters = [e for concept in self.entries
+                      for e in metadata.concept_entries(self.r, concept, 'parameter')]
+        self.assertEqual({(e['model'], e['name']) for e in parameters},
+                         {(m, f"{m}_{p}") for m in ['alpha', 'beta', 'gamma'] for p in ['rainfall', 'year']})
+
+    def test_unknown_concept(self):
+        self.assertEqual(metadata.concept_entries(self.r, 'no-such-concept'), [])
+        self.assertEqual(metadata.concept_entries(self.r, 'no-such-concept', 'model', 3), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
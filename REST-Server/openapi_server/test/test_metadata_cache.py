@@ -0,0 +1,86 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import json
+import time
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from openapi_server import metadata_cache
+from openapi_server.metadata import UPDATES_CHANNEL
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+class TestMetadataCache(unittest.TestCase):
+    """Responses cached per process and dropped by published updates"""
+
+    def setUp(self):
+        patcher = mock.patch.object(metadata_cache, 'RESUBSCRIBE_DELAY', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.r = fakeredis.FakeStrictRedis()
+        self.cache = metadata_cache.MetadataCache(self.r)
+        self.builds = []
+
+    def build(self, model_name):
+        def build():
+            self.builds.append(model_name)
+            return {'model': model_name, 'build': len(self.builds)}
+        return build
+
+    def response(self, model_name, endpoint='model_info'):
+        return json.loads(self.cache.response(model_name, endpoint, self.build(model_name)).get_data())
+
+    def listening(self):
+        self.cache.subscribe()
+        wait_for(lambda: self.cache.listening)
+
+    def test_cached(self):
+        self.listening()
+        self.assertEqual(self.response('dssat'), self.response('dssat'))
+        self.assertEqual(self.builds, ['dssat'])
+
+    def test_not_cached_until_subscribed(self):
+        with mock.patch.object(metadata_cache.MetadataCache, 'listen'):
+            self.response('dssat')
+            self.response('dssat')
+        self.assertEqual(self.builds, ['dssat', 'dssat'])
+
+    def test_update_invalidates(self):
+        self.listening()
+        self.response('dssat')
+        self.response('fsc')
+        self.response(None, 'list_models')
+        self.r.publish(UPDATES_CHANNEL, json.dumps(['dssat']))
+        wait_for(lambda: ('dssat', 'model_info') not in self.cache.responses)
+        self.response('dssat')
+        self.response('fsc')
+        self.response(None, 'list_models')
+        # the updated model and the responses about every model are rebuilt
+        self.assertEqual(self.builds, ['dssat', 'fsc', None, 'dssat', None])
+
+    def test_listener_survives_bad_message(self):
+        self.listening()
+        self.response('dssat')
+        generation = self.cache.generation
+        self.r.publish(UPDATES_CHANNEL, 'not json')
+        # everything is dropped, and the subscription is made again
+        wait_for(lambda: self.cache.generation > generation and self.cache.listening)
+        self.assertEqual(self.cache.responses, {})
+        self.response('dssat')
+        self.r.publish(UPDATES_CHANNEL, json.dumps(['dssat']))
+        wait_for(lambda: ('dssat', 'model_info') not in self.cache.responses)
+
+
+if __name__ == '__main__':
+    unittest.main()
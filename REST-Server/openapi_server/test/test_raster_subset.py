@@ -0,0 +1,51 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import unittest
+
+from openapi_server.raster_subset import pixel_window, subset_name
+
+# a 0.05 degree raster of 100 x 80 pixels with its top left corner at (30, 15)
+GEOTRANSFORM = (30.0, 0.05, 0.0, 15.0, 0.0, -0.05)
+WIDTH, HEIGHT = 100, 80
+
+
+class TestPixelWindow(unittest.TestCase):
+    """The pixels of a raster read for a bounding box"""
+
+    def test_aligned(self):
+        self.assertEqual(pixel_window(GEOTRANSFORM, WIDTH, HEIGHT, [30.5, 13.0, 31.0, 14.0]),
+                         (10, 20, 10, 20))
+
+    def test_snapped_outwards(self):
+        # partly covered pixels on every side are included
+        self.assertEqual(pixel_window(GEOTRANSFORM, WIDTH, HEIGHT, [30.51, 13.01, 30.99, 13.99]),
+                         (10, 20, 10, 20))
+
+    def test_clipped_to_raster(self):
+        self.assertEqual(pixel_window(GEOTRANSFORM, WIDTH, HEIGHT, [29.0, 10.0, 31.0, 20.0]),
+                         (0, 0, 20, 80))
+        self.assertEqual(pixel_window(GEOTRANSFORM, WIDTH, HEIGHT, [0.0, -90.0, 90.0, 90.0]),
+                         (0, 0, WIDTH, HEIGHT))
+
+    def test_outside(self):
+        self.assertIsNone(pixel_window(GEOTRANSFORM, WIDTH, HEIGHT, [40.0, 0.0, 41.0, 1.0]))
+        # touching the edge of the raster does not intersect it
+        self.assertIsNone(pixel_window(GEOTRANSFORM, WIDTH, HEIGHT, [25.0, 10.0, 30.0, 12.0]))
+
+    def test_south_up(self):
+        geotransform = (30.0, 0.05, 0.0, 11.0, 0.0, 0.05)
+        self.assertEqual(pixel_window(geotransform, WIDTH, HEIGHT, [30.5, 12.0, 31.0, 13.0]),
+                         (10, 20, 10, 20))
+
+    def test_subset_name(self):
+        name = subset_name('run', [30.5, 13.0, 31.0, 14.0], 1, 'tiff', 100.0)
+        self.assertTrue(name.endswith('.tiff'))
+        # the raster being replaced changes the name
+        self.assertNotEqual(name, subset_name('run', [30.5, 13.0, 31.0, 14.0], 1, 'tiff', 200.0))
+        self.assertEqual(name, subset_name('run', [30.5000000001, 13.0, 31.0, 14.0], 1, 'tiff', 100.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import json
+import unittest
+from unittest import mock
+
+import boto3
+import botocore
+import fakeredis
+
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+from openapi_server import result_index
+from openapi_server.result_index import find_result, manifest_key, record_success
+
+RESULTS = 'results-bucket'
+KEY = 'results/dssat/run.csv'
+CONFIG = {'rainfall': 1, 'start_year': 2007}
+
+
+@mock_aws
+class TestResultIndex(unittest.TestCase):
+    """Manifests of succeeded runs, written to and read from a mock S3"""
+
+    def setUp(self):
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.bucket = result_index.config['S3']['BUCKET']
+        self.s3.create_bucket(Bucket=self.bucket)
+        self.s3.create_bucket(Bucket=RESULTS)
+        self.s3.put_object(Bucket=RESULTS, Key=KEY, Body=b'result')
+
+        self.r = fakeredis.FakeStrictRedis()
+        self.r.hmset('run', {'name': 'DSSAT', 'config': json.dumps(CONFIG),
+                             'status': 'PENDING', 'timestamp': 1500000000.5})
+
+        # runs in the metadata table
+        self.metadata = set()
+        self.db_session = mock.Mock()
+        self.db_session.query.return_value.get.side_effect = \
+            lambda run_id: object() if run_id in self.metadata else None
+
+        patchers = [mock.patch.object(result_index, 's3_client', return_value=self.s3),
+                    mock.patch.object(result_index, 'db_session', self.db_session)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_record_success(self):
+        record_success(self.r, 'run', RESULTS, KEY, ingested=False)
+        self.assertEqual(self.r.hget('run', 'status'), b'SUCCESS')
+        self.assertEqual(self.r.hget('run', 'key'), KEY.encode('utf-8'))
+
+        obj = self.s3.get_object(Bucket=self.bucket, Key=manifest_key('run'))
+        self.assertEqual(json.loads(obj['Body'].read()),
+                         {'run_id': 'run', 'name': 'DSSAT', 'config': CONFIG,
+                          'timestamp': 1500000000.5, 'bucket': RESULTS, 'key': KEY,
+                          'ingested': False})
+        self.assertEqual(find_result('run')['key'], KEY)
+        # runs which were not ingested are not looked up in the database
+        self.db_session.query.assert_not_called()
+
+    def test_manifest_not_written(self):
+        # the run still succeeds without a manifest
+        self.s3.delete_bucket(Bucket=self.bucket)
+        record_success(self.r, 'run', RESULTS, KEY)
+        self.assertEqual(self.r.hget('run', 'status'), b'SUCCESS')
+
+    def test_no_manifest(self):
+        with mock.patch.object(self.s3, 'head_object', wraps=self.s3.head_object) as head:
+            self.assertIsNone(find_result('run'))
+        # a new run costs a single GET
+        head.assert_not_called()
+        self.db_session.query.assert_not_called()
+
+    def test_result_deleted(self):
+        record_success(self.r, 'run', RESULTS, KEY, ingested=False)
+        self.s3.delete_object(Bucket=RESULTS, Key=KEY)
+        self.assertIsNone(find_result('run'))
+
+    def test_ingested(self):
+        record_success(self.r, 'run', RESULTS, KEY)
+        # the run's output is no longer in the database
+        self.assertIsNone(find_result('run'))
+        self.metadata.add('run')
+        manifest = find_result('run')
+        self.assertEqual(manifest['name'], 'DSSAT')
+        self.assertEqual(manifest['config'], CONFIG)
+        self.assertTrue(manifest['ingested'])
+        self.assertEqual(self.db_session.remove.call_count, 2)
+
+    def test_other_errors(self):
+        # the bucket itself is missing, which is not a missing manifest
+        self.s3.delete_bucket(Bucket=self.bucket)
+        with self.assertRaises(botocore.exceptions.ClientError):
+            find_result('run')
+
+
+class TestS3Client(unittest.TestCase):
+    """The S3 client shared by the lookups of a process"""
+
+    def test_per_process(self):
+        with mock.patch.object(result_index, '_s3', (None, None)), \
+                mock.patch.object(result_index.boto3, 'Session') as Session, \
+                mock.patch.object(result_index.os, 'getpid', return_value=1):
+            client = result_index.s3_client()
+            self.assertIs(result_index.s3_client(), client)
+            self.assertEqual(Session.call_count, 1)
+            # a forked process creates its own
+            result_index.os.getpid.return_value = 2
+            result_index.s3_client()
+            self.assertEqual(Session.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
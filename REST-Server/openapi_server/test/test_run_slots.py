@@ -0,0 +1,93 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import time
+import unittest
+from unittest import mock
+
+import fakeredis
+
+from openapi_server import run_slots
+from openapi_server.run_slots import acquire, take_slot, release_slot
+
+
+class FakeJob(object):
+    """The parts of an RQ job the slots and budgets look at"""
+
+    def __init__(self, job_id, model='dssat', run_id=None, timeout=None, **meta):
+        self.id = job_id
+        self.timeout = timeout
+        self.meta = dict(meta, model=model, run_id=run_id or f"run-{job_id}")
+
+
+class TestAcquire(unittest.TestCase):
+    """Taking one of a limited number of slots"""
+
+    def setUp(self):
+        self.r = fakeredis.FakeStrictRedis()
+
+    def running(self):
+        return sorted(m.decode('utf-8') for m in self.r.zrange('dssat-running', 0, -1))
+
+    def test_limit(self):
+        self.assertTrue(acquire(self.r, 'dssat-running', 'a', 2, 60))
+        self.assertTrue(acquire(self.r, 'dssat-running', 'b', 2, 60))
+        self.assertFalse(acquire(self.r, 'dssat-running', 'c', 2, 60))
+        self.assertEqual(self.running(), ['a', 'b'])
+
+    def test_taken_again(self):
+        # a run which holds a slot renews its lease rather than needing another
+        self.assertTrue(acquire(self.r, 'dssat-running', 'a', 1, 60))
+        self.assertTrue(acquire(self.r, 'dssat-running', 'a', 1, 120))
+        self.assertEqual(self.running(), ['a'])
+        self.assertGreater(self.r.zscore('dssat-running', 'a'), time.time() + 60)
+
+    def test_expired_slots_reclaimed(self):
+        # the lease of a run whose worker was killed has run out
+        self.r.zadd('dssat-running', {'killed': time.time() - 1})
+        self.assertTrue(acquire(self.r, 'dssat-running', 'a', 1, 60))
+        self.assertEqual(self.running(), ['a'])
+
+
+class TestSlots(unittest.TestCase):
+    """The slots of a job's model"""
+
+    def setUp(self):
+        self.r = fakeredis.FakeStrictRedis()
+        patcher = mock.patch.object(run_slots, 'max_concurrent_runs', lambda section: 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_take_and_release(self):
+        first, second = FakeJob('1'), FakeJob('2')
+        self.assertTrue(take_slot(self.r, first))
+        self.assertFalse(take_slot(self.r, second))
+        release_slot(self.r, first)
+        self.assertTrue(take_slot(self.r, second))
+        self.assertEqual(self.r.zrange('dssat-running', 0, -1), [b'run-2'])
+
+    def test_shared_slots(self):
+        self.assertTrue(take_slot(self.r, FakeJob('1', model='malnutrition_model')))
+        self.assertFalse(take_slot(self.r, FakeJob('2', model='population_model')))
+
+    def test_unlimited(self):
+        for job_id in '123':
+            self.assertTrue(take_slot(self.r, FakeJob(job_id, model='chirps')))
+        with mock.patch.object(run_slots, 'max_concurrent_runs', lambda section: 0):
+            self.assertTrue(take_slot(self.r, FakeJob('1')))
+            self.assertTrue(take_slot(self.r, FakeJob('2')))
+        self.assertEqual(self.r.keys('*'), [])
+
+    def test_lease(self):
+        take_slot(self.r, FakeJob('1', timeout=600))
+        take_slot(self.r, FakeJob('2', model='fsc'))
+        now = time.time()
+        self.assertAlmostEqual(self.r.zscore('dssat-running', 'run-1'),
+                               now + 600 + run_slots.LEASE_SLACK, delta=5)
+        self.assertAlmostEqual(self.r.zscore('fsc-running', 'run-2'),
+                               now + run_slots.DEFAULT_LEASE + run_slots.LEASE_SLACK, delta=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
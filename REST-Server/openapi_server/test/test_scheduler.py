@@ -0,0 +1,177 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import time
+import unittest
+from unittest import mock
+
+import fakeredis
+from rq import Queue, Worker
+
+from openapi_server import run_slots, scheduler
+from openapi_server.scheduler import reserve, release, admit, discharge, pool_usage, BudgetWorker
+
+# 4 CPUs and 4 GB
+BUDGET = (4, 4096)
+
+
+class FakeJob(object):
+    """The parts of an RQ job the slots and budgets look at"""
+
+    def __init__(self, job_id, model='dssat', run_id=None, timeout=None, **meta):
+        self.id = job_id
+        self.timeout = timeout
+        self.meta = dict(meta, model=model, run_id=run_id or f"run-{job_id}")
+
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.r = fakeredis.FakeStrictRedis()
+        patcher = mock.patch.object(run_slots, 'max_concurrent_runs', lambda section: 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def usage(self):
+        return pool_usage(self.r, 'p', time.time())
+
+    def held(self):
+        """
+        The jobs holding part of the budget and the runs holding DSSAT slots.
+        """
+        jobs = sorted(j.decode('utf-8') for j in self.r.zrange('p-pool-jobs', 0, -1))
+        footprints = sorted(j.decode('utf-8') for j in self.r.hkeys('p-pool-footprints'))
+        self.assertEqual(jobs, footprints)
+        return jobs, sorted(r.decode('utf-8') for r in self.r.zrange('dssat-running', 0, -1))
+
+
+class TestReserve(SchedulerTestCase):
+    """Reserving part of a pool's budget"""
+
+    def test_under_budget(self):
+        self.assertTrue(reserve(self.r, 'p', BUDGET, 'a', 2, 1024, 60))
+        self.assertTrue(reserve(self.r, 'p', BUDGET, 'b', 2, 3072, 60))
+        self.assertEqual(sorted(self.usage()[0]), ['a', 'b'])
+        self.assertEqual(self.usage()[1:], (4, 4096))
+
+    def test_over_budget(self):
+        self.assertTrue(reserve(self.r, 'p', BUDGET, 'a', 3, 1024, 60))
+        # too many CPUs, then too much memory
+        self.assertFalse(reserve(self.r, 'p', BUDGET, 'b', 2, 1024, 60))
+        self.assertFalse(reserve(self.r, 'p', BUDGET, 'c', 1, 4000, 60))
+        self.assertEqual(self.usage(), (['a'], 3, 1024))
+
+    def test_idle_pool(self):
+        # a job larger than the whole budget still runs, on its own
+        self.assertTrue(reserve(self.r, 'p', BUDGET, 'a', 8, 1024, 60))
+        self.assertFalse(reserve(self.r, 'p', BUDGET, 'b', 1, 1024, 60))
+
+    def test_release(self):
+        reserve(self.r, 'p', BUDGET, 'a', 4, 1024, 60)
+        release(self.r, 'p', 'a')
+        self.assertEqual(self.usage(), ([], 0, 0))
+        self.assertTrue(reserve(self.r, 'p', BUDGET, 'b', 4, 1024, 60))
+
+    def test_expired_lease(self):
+        # the lease of a job whose worker was killed has run out
+        reserve(self.r, 'p', BUDGET, 'killed', 4, 1024, -1)
+        self.assertEqual(self.usage(), ([], 0, 0))
+        self.assertTrue(reserve(self.r, 'p', BUDGET, 'a', 4, 1024, 60))
+        self.assertEqual(self.held()[0], ['a'])
+
+
+class TestAdmit(SchedulerTestCase):
+    """Taking a run slot and part of the budget for a job"""
+
+    def test_admitted(self):
+        job = FakeJob('1', cpus=2, memory_mb=1024)
+        self.assertTrue(admit(self.r, 'p', BUDGET, job))
+        self.assertEqual(self.held(), (['1'], ['run-1']))
+        discharge(self.r, 'p', job)
+        self.assertEqual(self.held(), ([], []))
+
+    def test_over_budget(self):
+        # the slot taken for a job which does not fit is released again
+        admit(self.r, 'p', BUDGET, FakeJob('1', cpus=3))
+        self.assertFalse(admit(self.r, 'p', BUDGET, FakeJob('2', cpus=2)))
+        self.assertEqual(self.held(), (['1'], ['run-1']))
+
+    def test_no_free_slot(self):
+        admit(self.r, 'p', BUDGET, FakeJob('1', cpus=1))
+        admit(self.r, 'p', BUDGET, FakeJob('2', cpus=1))
+        self.assertFalse(admit(self.r, 'p', BUDGET, FakeJob('3', cpus=1)))
+        self.assertEqual(self.held(), (['1', '2'], ['run-1', 'run-2']))
+
+    def test_no_pool(self):
+        self.assertTrue(admit(self.r, None, None, FakeJob('1')))
+        self.assertEqual(self.held(), ([], ['run-1']))
+        discharge(self.r, None, FakeJob('1'))
+        self.assertEqual(self.held(), ([], []))
+
+    def test_default_footprint(self):
+        admit(self.r, 'p', BUDGET, FakeJob('1', model='chirps'))
+        self.assertEqual(self.usage(), (['1'], scheduler.DEFAULT_EXECUTION['cpus'],
+                                        scheduler.DEFAULT_EXECUTION['memory_mb']))
+
+
+class TestBudgetWorker(SchedulerTestCase):
+    """Jobs started by a worker of a pool"""
+
+    def setUp(self):
+        super().setUp()
+        self.queue = Queue('medium', connection=self.r)
+        self.worker = BudgetWorker([self.queue], connection=self.r, pool='p', budget=BUDGET, poll=0)
+
+    def dequeue(self):
+        job, _ = Queue.dequeue_any([self.queue], None, connection=self.r)
+        return job
+
+    def test_executed(self):
+        job = FakeJob('1', cpus=2, enqueued_at=time.time())
+
+        def execute_job(worker, job, queue):
+            self.assertEqual(self.held(), (['1'], ['run-1']))
+            return 'executed'
+
+        with mock.patch.object(Worker, 'execute_job', execute_job):
+            self.assertEqual(self.worker.execute_job(job, self.queue), 'executed')
+        self.assertEqual(self.held(), ([], []))
+        self.assertEqual(list(scheduler.stats(self.r)), ['dssat'])
+
+    def test_released_on_failure(self):
+        with mock.patch.object(Worker, 'execute_job', side_effect=RuntimeError('work horse failed')):
+            with self.assertRaises(RuntimeError):
+                self.worker.execute_job(FakeJob('1', cpus=2), self.queue)
+        self.assertEqual(self.held(), ([], []))
+
+    def test_deferred(self):
+        admit(self.r, 'p', BUDGET, FakeJob('1', cpus=4))
+        job = FakeJob('2', cpus=1)
+        queue = mock.Mock()
+        with mock.patch.object(Worker, 'execute_job') as execute_job:
+            self.worker.execute_job(job, queue)
+        execute_job.assert_not_called()
+        # put back on its queue, holding nothing
+        queue.enqueue_job.assert_called_once_with(job)
+        self.assertEqual(self.held(), (['1'], ['run-1']))
+
+    def test_deferred_job_runs_later(self):
+        first = self.queue.enqueue(time.time, meta={'model': 'dssat', 'run_id': 'run-1', 'cpus': 4})
+        second = self.queue.enqueue(time.time, meta={'model': 'dssat', 'run_id': 'run-2', 'cpus': 1})
+        # the first job is running and holds the whole budget
+        self.assertEqual(self.dequeue().id, first.id)
+        self.assertTrue(admit(self.r, 'p', BUDGET, first))
+        self.assertEqual(self.dequeue().id, second.id)
+        self.worker.execute_job(second, self.queue)
+        self.assertEqual(self.queue.job_ids, [second.id])
+        discharge(self.r, 'p', first)
+        job = self.dequeue()
+        with mock.patch.object(Worker, 'execute_job', return_value='executed'):
+            self.assertEqual(self.worker.execute_job(job, self.queue), 'executed')
+        self.assertEqual(self.queue.job_ids, [])
+        self.assertEqual(self.held(), ([], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
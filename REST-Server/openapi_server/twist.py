@@ -5,8 +5,12 @@ sys.path.append("../db")
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from loader import register_run
+
+from openapi_server.result_index import record_success
+from openapi_server.docker_run import run_container
 
 import docker
 import re
@@ -125,6 +129,7 @@ class TWISTController(object):
         self.containers = self.client.containers
         self.result_name = self.model_config['run_id'] 
         self.run_id = self.model_config['run_id']           
+        self.container_name = f"{self.name}-{self.run_id}"
         self.bucket = "world-modelers"
         self.key = f"results/multi_twist_model/{self.result_name}.csv"
 
@@ -177,14 +182,12 @@ class TWISTController(object):
         time.sleep(1)
         logging.info(f"Running Multi-TWIST model run with ID: {self.run_id}")
         try:
-            self.model = self.containers.run(self.name, 
-                                             volumes=self.volumes, 
-                                             entrypoint=self.entrypoint,
-                                             detach=False,
-                                             name=self.name)
-            run_logs = self.model.decode('utf-8')
-
-            if self.success_msg in run_logs:
+            succeeded, run_logs = run_container(self.containers, self.r, self.run_id, self.name, self.success_msg,
+                                                volumes=self.volumes,
+                                                entrypoint=self.entrypoint,
+                                                name=self.container_name)
+
+            if succeeded:
                 logging.info("Model run: SUCCESS")
                 try:
                     self.storeResults()
@@ -193,11 +196,7 @@ class TWISTController(object):
                         self.ingest2db()
                         # Success case requires storage to S3 AND ingest to DB
                         # if Success, update Redis accordingly
-                        self.r.hmset(self.run_id, 
-                            {'status': 'SUCCESS',
-                             'bucket': self.bucket,
-                             'key': self.key}
-                             )                        
+                        record_success(self.r, self.run_id, self.bucket, self.key)
                     except Exception as e:
                         msg = f'DB ingest failure: {e}.'
                         logging.error(msg)
@@ -214,7 +213,7 @@ class TWISTController(object):
             self.r.hmset(self.run_id, {'status': 'FAIL', 'output': str(e)})
 
         # Prune old containers
-        prior_container = self.containers.get(self.name)
+        prior_container = self.containers.get(self.container_name)
         prior_container.remove()
 
 
@@ -251,10 +250,9 @@ class TWISTController(object):
                         raw_output_link= f'https://s3.amazonaws.com/world-modelers/{self.key}'
                         ) 
         logging.info("Storing metadata...")
-        db_session.add(meta)
-        db_session.commit()
 
         # Add parameters to DB
+        parameters = []
         logging.info("Storing parameters...")
         for param_name, param_val in self.model_config.items():
             if param_name == 'run_id':
@@ -265,8 +263,7 @@ class TWISTController(object):
                                   parameter_name=param_name,
                                   parameter_value=param_val,
                                   parameter_type=self.descriptions['parameters'][param_name])
-                db_session.add(param)
-                db_session.commit()
+                parameters.append(param)
 
         # Process CSV and normalize it
         logging.info("Processing timeseries...")
@@ -285,18 +282,18 @@ class TWISTController(object):
         base_cols = ['run_id','model','datetime']
         feature_cols = ['feature_name','feature_description','feature_value']
 
-        for feature_name, feature_description in self.descriptions['features'].items():
-            # some multi_twist outputs will not be present depending on the scenario type
-            # so first check
-            if feature_name in df:
-                logging.info(f"Storing point data output for {feature_name}...")
-                cols_to_select = base_cols + [feature_name]
-                df_ = df[cols_to_select] # generate new interim DF
-                df_['feature_name'] = feature_name
-                df_['feature_description'] = feature_description.split('.')[0]
-                df_['feature_value'] = df_[feature_name]
-                df_ = df_[base_cols + feature_cols]
-
-                # perform bulk insert of entire geopandas DF
-                db_session.bulk_insert_mappings(Output, df_.to_dict(orient="records"))
-                db_session.commit()
\ No newline at end of file
+        with register_run(meta, parameters) as loader:
+            for feature_name, feature_description in self.descriptions['features'].items():
+                # some multi_twist outputs will not be present depending on the scenario type
+                # so first check
+                if feature_name in df:
+                    logging.info(f"Storing point data output for {feature_name}...")
+                    cols_to_select = base_cols + [feature_name]
+                    df_ = df[cols_to_select] # generate new interim DF
+                    df_['feature_name'] = feature_name
+                    df_['feature_description'] = feature_description.split('.')[0]
+                    df_['feature_value'] = df_[feature_name]
+                    df_ = df_[base_cols + feature_cols]
+
+                    # perform bulk insert of entire geopandas DF
+                    loader.copy(df_)
\ No newline at end of file
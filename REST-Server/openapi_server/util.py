@@ -9,13 +9,12 @@ from uuid import UUID
 
 from collections import OrderedDict
 
-from shapely.geometry import Point
-import geopandas as gpd
-import numpy as np
-from osgeo import gdal
-from osgeo import gdalconst
 import logging
 
+# raster2gpd is implemented in openapi_server.raster; it stays importable
+# from util for existing callers
+from openapi_server.raster import raster2gpd  # noqa: F401
+
 logging.basicConfig(level=logging.INFO)   
 
 def _deserialize(data, klass):
@@ -238,65 +237,3 @@ def format_config(m):
     if len(c) > 0:
         out_c['config'] = c[0]
     return out_c
-
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res    
-
-def raster2gpd(InRaster,feature_name,band=1,nodataval=-9999):
-    '''
-    Description: 
-        Takes the path of a raster (.tiff) file and produces a Geopandas Data Frame.
-    Params:
-        - InRaster: the path of the input raster file
-        - feature_name: the name of the feature represented by the pixel values 
-    '''
-
-    # open the raster and get some properties
-    ds       = gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
-    GeoTrans = ds.GetGeoTransform()
-    ColRange = range(ds.RasterXSize)
-    RowRange = range(ds.RasterYSize)
-    rBand    = ds.GetRasterBand(band) # first band
-    nData    = rBand.GetNoDataValue()
-    if nData == None:
-        logging.info(f"No nodataval found, setting to {nodataval}")
-        nData = np.float32(nodataval) # set it to something if not set
-    else:
-        logging.info(f"Nodataval is: {nData}")
-
-    # specify the center offset (takes the point in middle of pixel)
-    HalfX    = GeoTrans[1] / 2
-    HalfY    = GeoTrans[5] / 2
-
-    # Check that NoDataValue is of the same type as the raster data
-    RowData = rBand.ReadAsArray(0,0,ds.RasterXSize,1)[0]
-    if type(nData) != type(RowData[0]):
-        logging.warning(f"NoData type mismatch: NoDataValue is type {type(nData)} and raster data is type {type(RowData[0])}")
-        
-
-    points = []
-    for ThisRow in RowRange:
-        RowData = rBand.ReadAsArray(0,ThisRow,ds.RasterXSize,1)[0]
-        for ThisCol in ColRange:
-            # need to exclude NaN values since there is no nodataval
-            if (RowData[ThisCol] != nData) and not (np.isnan(RowData[ThisCol])):
-                
-                # TODO: implement filters on valid pixels
-                # for example, the below would ensure pixel values are between -100 and 100
-                #if (RowData[ThisCol] <= 100) and (RowData[ThisCol] >= -100):
-
-                X = GeoTrans[0] + ( ThisCol * GeoTrans[1] )
-                Y = GeoTrans[3] + ( ThisRow * GeoTrans[5] ) # Y is negative so it's a minus
-                # this gives the upper left of the cell, offset by half a cell to get centre
-                X += HalfX
-                Y += HalfY
-
-                points.append([Point(X, Y),X,Y,RowData[ThisCol],feature_name])
-
-    return gpd.GeoDataFrame(points, columns=['geometry','longitude','latitude','feature_value','feature_name'])
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+Long-lived model containers which runs are executed in with `docker exec`,
+so that short runs do not each pay for creating, starting and removing a
+container of their own.
+
+A model's pool is made up of `size` containers named `<name>-warm-<i>`,
+started with an idle command and the volumes of a run. A run leases one
+of them in Redis (`<container>-lease`, holding the run id) for as long as
+it executes, and falls back to a container of its own when all of them are
+busy. Containers which are missing or have stopped are (re)started by the
+run which leases them.
+"""
+import logging
+
+import docker
+from rq import get_current_job
+
+# keeps a warm container up without doing anything
+IDLE_COMMAND = ['tail', '-f', '/dev/null']
+
+# lease on a container for runs which are not an RQ job with a timeout of
+# their own
+DEFAULT_LEASE = 12 * 3600
+
+
+def lease_container(client, r, name, image, size, run_id, **kwargs):
+    """
+    Leases an idle container of the pool for `run_id`, starting it (with the
+    keyword arguments of `containers.run`) if it is not running. Returns
+    None when every container of the pool is busy, or the pool is empty.
+    """
+    job = get_current_job()
+    lease = job.timeout if job is not None and job.timeout and job.timeout > 0 else DEFAULT_LEASE
+    for i in range(size):
+        container_name = f"{name}-warm-{i}"
+        if r.set(f"{container_name}-lease", run_id, nx=True, ex=lease):
+            try:
+                return warm_container(client, container_name, image, **kwargs)
+            except Exception:
+                release_container(r, container_name, run_id)
+                raise
+    return None
+
+
+def warm_container(client, container_name, image, **kwargs):
+    try:
+        container = client.containers.get(container_name)
+        if container.status == 'running':
+            return container
+        container.remove(force=True)
+    except docker.errors.NotFound:
+        pass
+    logging.info(f"Starting warm container {container_name}")
+    return client.containers.run(image, entrypoint=IDLE_COMMAND, detach=True,
+                                 name=container_name, **kwargs)
+
+
+def release_container(r, container_name, run_id):
+    """
+    Ends the lease of `run_id` on a container, unless it has expired and
+    been taken by another run since.
+    """
+    key = f"{container_name}-lease"
+    if r.get(key) == run_id.encode('utf-8'):
+        r.delete(key)
@@ -0,0 +1,41 @@
+"""
+Prints the number of jobs waiting on each model queue, the share of each
+worker pool's budget in use and, per model, how long recent runs waited
+for a worker and took to run. Use it to size the worker pools. Usage (from
+the REST-Server directory):
+
+    python queue_stats.py
+"""
+import configparser
+import time
+
+import redis
+from rq import Queue
+
+from openapi_server.scheduler import QUEUES, pool_budget, pool_usage, stats
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+r = redis.Redis(host=config['REDIS']['HOST'],
+                port=config['REDIS']['PORT'],
+                db=config['REDIS']['DB'])
+
+print("Queued jobs")
+for name in QUEUES:
+    print(f"  {name:10s} {Queue(name, connection=r).count:6d}")
+
+print("Worker pools")
+for section in config.sections():
+    if not section.startswith('POOL-'):
+        continue
+    pool = section[len('POOL-'):]
+    queues, cpus, memory_mb = pool_budget(config, pool)
+    active, used_cpus, used_memory = pool_usage(r, pool, time.time())
+    print(f"  {pool:10s} {len(active):3d} jobs  {used_cpus:g}/{cpus:g} CPUs  "
+          f"{used_memory}/{memory_mb} MB  ({', '.join(queues)})")
+
+print("Runs (seconds)")
+for model, s in stats(r).items():
+    print(f"  {model:20s} {s['runs']:5d} runs  wait p50 {s['wait_p50']:9.1f} p95 {s['wait_p95']:9.1f}  "
+          f"run p50 {s['run_p50']:9.1f} p95 {s['run_p95']:9.1f}")
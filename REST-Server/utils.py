@@ -18,15 +18,25 @@ cur = con.cursor()
 
 print("Database opened successfully")
 
+normalized = config['DATABASE'].getboolean('NORMALIZED_OUTPUT', fallback=False)
+
+def delete_output(cur,column,value):
+    # with the normalized layout output is a view over output_value
+    if normalized:
+        cur.execute(f"DELETE FROM OUTPUT_VALUE WHERE RUN_KEY IN (SELECT ID FROM OUTPUT_RUN WHERE {column} = '{value}');")
+        cur.execute(f"DELETE FROM OUTPUT_RUN WHERE {column} = '{value}';")
+    else:
+        cur.execute(f"DELETE FROM OUTPUT WHERE {column} = '{value}';")
+
 def delete_all_model_data(cur,model):
-    cur.execute(f"DELETE FROM OUTPUT WHERE MODEL = '{model}';")
+    delete_output(cur,'MODEL',model)
     cur.execute(f"DELETE FROM PARAMETERS WHERE MODEL = '{model}';")
     cur.execute(f"DELETE FROM METADATA WHERE MODEL = '{model}';")
     con.commit()
     return
 
 def delete_by_run_id(cur,run_id):
-    cur.execute(f"DELETE FROM OUTPUT WHERE RUN_ID = '{run_id}';")
+    delete_output(cur,'RUN_ID',run_id)
     cur.execute(f"DELETE FROM PARAMETERS WHERE RUN_ID = '{run_id}';")
     cur.execute(f"DELETE FROM METADATA WHERE RUN_ID = '{run_id}';")
     con.commit()
@@ -48,6 +58,9 @@ def delete_model_run_data_from_redis(ModelName):
             continue
         r.delete(RunID)
 
+    # the timestamp index of the model's runs
+    r.delete(f"{ModelName}-by-time")
+
 
 MODEL = sys.argv[1]
 
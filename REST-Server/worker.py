@@ -0,0 +1,64 @@
+"""
+Starts an RQ worker with the GADM admin2 boundaries already loaded.
+
+RQ forks a work horse for every job, so anything loaded by the worker
+process before it starts listening is shared by every job it runs. The
+model controllers are only built inside the jobs, so the worker also marks
+a run as failed when its job raises before the controller could record the
+outcome itself.
+
+With --pool the worker serves the queues of a `[POOL-<name>]` section of
+config.ini and only starts a job once its estimated footprint fits into the
+pool's CPU and memory budget (see openapi_server/scheduler.py). Usage (from
+the REST-Server directory):
+
+    python worker.py --pool default
+    python worker.py fetch medium long
+"""
+import argparse
+import configparser
+
+import redis
+
+from openapi_server import gadm
+from openapi_server.scheduler import BudgetWorker, QUEUES, pool_budget
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+
+def fail_run(job, exc_type, exc_value, traceback):
+    """
+    Marks the run of a failed job as FAIL if it is still PENDING, since
+    /run_model does not resubmit pending runs.
+    """
+    run_id = job.meta.get('run_id')
+    if run_id and job.connection.hget(run_id, 'status') == b'PENDING':
+        job.connection.hmset(run_id, {'status': 'FAIL', 'output': str(exc_value)})
+    # fall through to RQ's default handling of the failed job
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('queues', nargs='*',
+                        help=f"queues to serve (default: the pool's, or {' '.join(QUEUES)})")
+    parser.add_argument('--pool', help='the worker pool whose budget jobs are admitted against')
+    args = parser.parse_args()
+
+    gadm.preload(config['GADM']['GADM_PATH'])
+
+    r = redis.Redis(host=config['REDIS']['HOST'],
+                    port=config['REDIS']['PORT'],
+                    db=config['REDIS']['DB'])
+
+    if args.pool:
+        queues, cpus, memory_mb = pool_budget(config, args.pool)
+        budget = (cpus, memory_mb)
+    else:
+        queues, budget = QUEUES, None
+    queues = args.queues or queues
+
+    BudgetWorker(queues, connection=r, pool=args.pool, budget=budget,
+                 exception_handlers=[fail_run]).work()
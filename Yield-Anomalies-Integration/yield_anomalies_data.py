@@ -1,9 +1,12 @@
+import sys
+sys.path.append("../db")
+
 import os
 import redis
 import configparser
-from hashlib import sha256
 import json
-from collections import OrderedDict
+from run_identity import canonical_config, make_run_id
+from run_index import add_run
 
 config = configparser.ConfigParser()
 config.read('../REST-Server/config.ini')
@@ -54,12 +57,12 @@ def gen_run(crop, irrig, nit, output, stat=None):
         model_config["config"]["area"] = "global"
         model_config["config"]["statistic"] = stat
 
-    model_config =sortOD(OrderedDict(model_config))
+    model_config = canonical_config(model_config)
 
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    run_id = make_run_id(model_config)
     print(model_config)
-    # Add to model set in Redis
-    r.sadd(model_name, run_id)
+    # Add to model set in Redis and its timestamp index
+    add_run(r, model_name, run_id)
     
     run_obj = {'status': 'SUCCESS',
      'name': model_name,
@@ -73,16 +76,6 @@ def gen_run(crop, irrig, nit, output, stat=None):
     
     r.hmset(run_id, run_obj)
 
-
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res    
-
 if __name__ == "__main__":
 
     # Wipe runs for the model
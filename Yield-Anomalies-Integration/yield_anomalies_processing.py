@@ -1,19 +1,18 @@
 import sys
 import os
 sys.path.append("../db")
+sys.path.append("../REST-Server")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id
+from loader import register_run
+from openapi_server import raster
+from openapi_server import gadm
 
-from shapely.geometry import Point
 import geopandas as gpd
-from osgeo import gdal
-from osgeo import gdalconst
 
 from datetime import datetime
-from hashlib import sha256
-from collections import OrderedDict
-import json
 
 def raster2gpd(InRaster,feature_name,nodataval=-9999):
     '''
@@ -23,41 +22,7 @@ def raster2gpd(InRaster,feature_name,nodataval=-9999):
         - InRaster: the path of the input raster file
         - feature_name: the name of the feature represented by the pixel values 
     '''
-
-    # open the raster and get some properties
-    ds       = gdal.OpenShared(InRaster,gdalconst.GA_ReadOnly)
-    GeoTrans = ds.GetGeoTransform()
-    ColRange = range(ds.RasterXSize)
-    RowRange = range(ds.RasterYSize)
-    rBand    = ds.GetRasterBand(1) # first band
-    nData    = rBand.GetNoDataValue()
-    if nData == None:
-        nData = nodataval # set it to something if not set
-    else:
-        print("NoData value is {0}".format(nData))
-
-    # specify the center offset (takes the point in middle of pixel)
-    HalfX    = GeoTrans[1] / 2
-    HalfY    = GeoTrans[5] / 2
-
-    points = []
-    for ThisRow in RowRange:
-        RowData = rBand.ReadAsArray(0,ThisRow,ds.RasterXSize,1)[0]
-        for ThisCol in ColRange:
-            if RowData[ThisCol] != nData:
-                
-                # TODO: implement filters on valid pixels
-                # for example, the below would ensure pixel values are between -100 and 100
-                #if (RowData[ThisCol] <= 100) and (RowData[ThisCol] >= -100):
-
-                X = GeoTrans[0] + ( ThisCol * GeoTrans[1] )
-                Y = GeoTrans[3] + ( ThisRow * GeoTrans[5] ) # Y is negative so it's a minus
-                # this gives the upper left of the cell, offset by half a cell to get centre
-                X += HalfX
-                Y += HalfY
-                points.append([Point(X, Y),X,Y,RowData[ThisCol],feature_name])
-
-    return gpd.GeoDataFrame(points, columns=['geometry','longitude','latitude','feature_value','feature_name'])
+    return raster.raster2gpd(InRaster,feature_name,nodataval=nodataval,mask_nan=False)
 
 
 def gen_global(crop, irrig, nit, stat):
@@ -89,35 +54,17 @@ def gen_run(crop, irrig, nit, stat):
                     'name': model_name
                    }
 
-    model_config =sortOD(OrderedDict(model_config))
+    model_config = canonical_config(model_config)
 
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    run_id = make_run_id(model_config)
     return run_id, model_config
 
-
-def sortOD(od):
-    '''
-    Sorts ordered dictionary to ensure consistency when hashing
-    '''
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res 
-
 if __name__ == "__main__":
 
     init_db()
 
     # Load Admin2 shape from GADM
-    admin2 = gpd.read_file('../gadm2/gadm36_2.shp')
-    admin2['country'] = admin2['NAME_0']
-    admin2['state'] = admin2['NAME_1']
-    admin2['admin1'] = admin2['NAME_1']
-    admin2['admin2'] = admin2['NAME_2']
-    admin2 = admin2[['geometry','country','state','admin1','admin2']]
+    admin2 = gadm.load_admin2('../gadm2')
 
     # Read in Yield Anomaly tiff files
     files = [i for i in os.listdir('C2P2_LPJmL_yield_backcasts_2018/') if '.tif' in i]
@@ -144,18 +91,16 @@ if __name__ == "__main__":
                                     raw_output_link= f"https://world-modelers.s3.amazonaws.com/results/yield_anomalies_model/{run_name}",
                                     run_label="LPJmL Yield Anomalies",
                                     point_resolution_meters=52000)
-                    db_session.add(meta)
-                    db_session.commit()
                     
                     # Add parameters to DB
+                    parameters = []
                     for name, val in params.items():                
                         param = Parameters(run_id=run_id,
                                           model=model_config['name'],
                                           parameter_name=name,
                                           parameter_value=val,
                                           parameter_type='string')
-                        db_session.add(param)
-                        db_session.commit()
+                        parameters.append(param)
                     
                     # Convert Raster to GeoPandas
                     InRaster = f"C2P2_LPJmL_yield_backcasts_2018/{run_name}"
@@ -174,5 +119,5 @@ if __name__ == "__main__":
                     del(gdf['index_right'])
 
                     # perform bulk insert of entire geopandas DF
-                    db_session.bulk_insert_mappings(Output, gdf.to_dict(orient="records"))
-                    db_session.commit()
\ No newline at end of file
+                    with register_run(meta, parameters) as loader:
+                        loader.copy(gdf)
\ No newline at end of file
@@ -0,0 +1,147 @@
+-- Normalized storage for model output.
+--
+-- The repeated text columns of output (run_id, model, feature name and
+-- description, admin names) move into lookup tables, and each output row
+-- keeps only small integer keys plus its value, location and datetime in
+-- output_value. A view named output keeps the previous column shape, so
+-- readers do not change.
+--
+-- Run it once, after partition_output.sql, then set NORMALIZED_OUTPUT = True
+-- in the [DATABASE] section of config.ini so that ingestion writes to
+-- output_value (see db/loader.py). The previous table is kept as
+-- output_flat until you drop it.
+
+BEGIN;
+
+-- polygon is never populated; refuse to migrate rather than drop data if it is
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM output WHERE polygon IS NOT NULL) THEN
+		RAISE EXCEPTION 'output.polygon has values, which the normalized layout does not store';
+	END IF;
+END
+$$;
+
+CREATE TABLE output_run (
+	id SERIAL PRIMARY KEY,
+	run_id VARCHAR(120) NOT NULL REFERENCES metadata (run_id),
+	model VARCHAR(120)
+);
+CREATE UNIQUE INDEX output_run_key_idx ON output_run (coalesce(run_id, ''), coalesce(model, ''));
+
+CREATE TABLE feature (
+	id SERIAL PRIMARY KEY,
+	model VARCHAR(120),
+	feature_name VARCHAR(120),
+	feature_description VARCHAR(240)
+);
+CREATE UNIQUE INDEX feature_key_idx ON feature (coalesce(model, ''), coalesce(feature_name, ''), coalesce(feature_description, ''));
+
+CREATE TABLE admin_unit (
+	id SERIAL PRIMARY KEY,
+	country VARCHAR(120),
+	state VARCHAR(120),
+	admin1 VARCHAR(120),
+	admin2 VARCHAR(120),
+	city VARCHAR(120)
+);
+CREATE UNIQUE INDEX admin_unit_key_idx ON admin_unit (coalesce(country, ''), coalesce(state, ''), coalesce(admin1, ''), coalesce(admin2, ''), coalesce(city, ''));
+CREATE INDEX admin_unit_admin_idx ON admin_unit (country, admin1, admin2);
+
+CREATE TABLE output_value (
+	id INTEGER NOT NULL DEFAULT nextval('output_id_seq'),
+	run_key INTEGER NOT NULL REFERENCES output_run (id),
+	feature_id INTEGER NOT NULL REFERENCES feature (id),
+	admin_id INTEGER REFERENCES admin_unit (id),
+	datetime TIMESTAMP WITHOUT TIME ZONE,
+	latitude DOUBLE PRECISION,
+	longitude DOUBLE PRECISION,
+	feature_value DOUBLE PRECISION,
+	created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+	updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+	geom geometry(Point, 4326) GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)) STORED,
+	PRIMARY KEY (id, run_key)
+) PARTITION BY HASH (run_key);
+
+DO $$
+BEGIN
+	FOR i IN 0..15 LOOP
+		EXECUTE format('CREATE TABLE output_value_p%s PARTITION OF output_value FOR VALUES WITH (MODULUS 16, REMAINDER %s)', i, i);
+		EXECUTE format('CREATE TRIGGER output_value_p%s_updated BEFORE UPDATE ON output_value_p%s FOR EACH ROW EXECUTE PROCEDURE updated()', i, i);
+	END LOOP;
+END
+$$;
+
+CREATE INDEX output_value_run_feature_datetime_idx ON output_value (run_key, feature_id, datetime);
+CREATE INDEX output_value_admin_idx ON output_value (admin_id);
+CREATE INDEX output_value_geom_idx ON output_value USING GIST (geom);
+
+-- fill the lookup tables and output_value from the existing rows; keys are
+-- compared with NULL and '' treated alike, as in the unique indexes
+INSERT INTO output_run (run_id, model)
+SELECT DISTINCT run_id, model FROM output WHERE run_id IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+INSERT INTO feature (model, feature_name, feature_description)
+SELECT DISTINCT model, feature_name, feature_description FROM output
+ON CONFLICT DO NOTHING;
+
+INSERT INTO admin_unit (country, state, admin1, admin2, city)
+SELECT DISTINCT country, state, admin1, admin2, city FROM output
+WHERE num_nonnulls(country, state, admin1, admin2, city) > 0
+ON CONFLICT DO NOTHING;
+
+INSERT INTO output_value (id, run_key, feature_id, admin_id, datetime, latitude,
+                          longitude, feature_value, created_at, updated_at)
+SELECT o.id, r.id, f.id, a.id, o.datetime, o.latitude,
+       o.longitude, o.feature_value, o.created_at, o.updated_at
+FROM output o
+JOIN output_run r
+  ON r.run_id = o.run_id AND coalesce(r.model, '') = coalesce(o.model, '')
+JOIN feature f
+  ON coalesce(f.model, '') = coalesce(o.model, '')
+ AND coalesce(f.feature_name, '') = coalesce(o.feature_name, '')
+ AND coalesce(f.feature_description, '') = coalesce(o.feature_description, '')
+LEFT JOIN admin_unit a
+  ON coalesce(a.country, '') = coalesce(o.country, '')
+ AND coalesce(a.state, '') = coalesce(o.state, '')
+ AND coalesce(a.admin1, '') = coalesce(o.admin1, '')
+ AND coalesce(a.admin2, '') = coalesce(o.admin2, '')
+ AND coalesce(a.city, '') = coalesce(o.city, '');
+
+ALTER TABLE output RENAME TO output_flat;
+ALTER SEQUENCE output_id_seq OWNED BY output_value.id;
+
+CREATE VIEW output AS
+SELECT v.id,
+       r.run_id,
+       r.model,
+       v.latitude,
+       v.longitude,
+       NULL::VARCHAR(1000) AS polygon,
+       v.datetime,
+       f.feature_name,
+       v.feature_value,
+       f.feature_description,
+       a.admin1,
+       a.admin2,
+       a.city,
+       a.state,
+       a.country,
+       v.created_at,
+       v.updated_at,
+       v.geom
+FROM output_value v
+JOIN output_run r ON r.id = v.run_key
+JOIN feature f ON f.id = v.feature_id
+LEFT JOIN admin_unit a ON a.id = v.admin_id;
+
+COMMIT;
+
+ANALYZE output_run;
+ANALYZE feature;
+ANALYZE admin_unit;
+ANALYZE output_value;
+
+-- Once the migrated data has been checked:
+-- DROP TABLE output_flat;
@@ -0,0 +1,70 @@
+-- Rebuilds the output table as a hash partitioned table (by run_id) with
+-- indexes for the common query patterns and a PostGIS point column.
+--
+-- Requires PostgreSQL 12+ (generated columns) with PostGIS available.
+-- Run it once, after create_update.sql. Existing rows are copied into the
+-- new table; the old table is kept as output_unpartitioned until you drop it.
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+BEGIN;
+
+ALTER TABLE output RENAME TO output_unpartitioned;
+ALTER TABLE output_unpartitioned RENAME CONSTRAINT output_pkey TO output_unpartitioned_pkey;
+DROP TRIGGER IF EXISTS output_updated ON output_unpartitioned;
+
+-- the primary key of a partitioned table has to include the partition key
+CREATE TABLE output (
+	id INTEGER NOT NULL DEFAULT nextval('output_id_seq'),
+	run_id VARCHAR(120) REFERENCES metadata (run_id),
+	model VARCHAR(120),
+	latitude DOUBLE PRECISION,
+	longitude DOUBLE PRECISION,
+	polygon VARCHAR(1000),
+	datetime TIMESTAMP WITHOUT TIME ZONE,
+	feature_name VARCHAR(120),
+	feature_value DOUBLE PRECISION,
+	feature_description VARCHAR(240),
+	admin1 VARCHAR(120),
+	admin2 VARCHAR(120),
+	city VARCHAR(120),
+	state VARCHAR(120),
+	country VARCHAR(120),
+	created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+	updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+	geom geometry(Point, 4326) GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)) STORED,
+	PRIMARY KEY (id, run_id)
+) PARTITION BY HASH (run_id);
+
+ALTER SEQUENCE output_id_seq OWNED BY output.id;
+
+-- a run always lands in a single partition, so queries and deletes by
+-- run_id only touch 1/16th of the table
+DO $$
+BEGIN
+	FOR i IN 0..15 LOOP
+		EXECUTE format('CREATE TABLE output_p%s PARTITION OF output FOR VALUES WITH (MODULUS 16, REMAINDER %s)', i, i);
+		EXECUTE format('CREATE TRIGGER output_p%s_updated BEFORE UPDATE ON output_p%s FOR EACH ROW EXECUTE PROCEDURE updated()', i, i);
+	END LOOP;
+END
+$$;
+
+CREATE INDEX output_run_feature_datetime_idx ON output (run_id, feature_name, datetime);
+CREATE INDEX output_model_feature_idx ON output (model, feature_name);
+CREATE INDEX output_admin_idx ON output (country, admin1, admin2);
+CREATE INDEX output_geom_idx ON output USING GIST (geom);
+
+INSERT INTO output (id, run_id, model, latitude, longitude, polygon, datetime,
+                    feature_name, feature_value, feature_description, admin1,
+                    admin2, city, state, country, created_at, updated_at)
+SELECT id, run_id, model, latitude, longitude, polygon, datetime,
+       feature_name, feature_value, feature_description, admin1,
+       admin2, city, state, country, created_at, updated_at
+FROM output_unpartitioned;
+
+COMMIT;
+
+ANALYZE output;
+
+-- Once the migrated data has been checked:
+-- DROP TABLE output_unpartitioned;
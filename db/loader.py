@@ -0,0 +1,172 @@
+from contextlib import contextmanager
+
+import pandas as pd
+from psycopg2.extras import execute_values
+from sqlalchemy import Float
+
+from database import engine, db_session, config
+from models import Output
+from output_csv import NULL, frame2csv
+
+# Columns of the output table which are filled in by the loader; the id and
+# timestamps are left to their database defaults, as with bulk_insert_mappings
+OUTPUT_COLUMNS = [c.name for c in Output.__table__.columns
+                  if c.name not in ('id', 'created_at', 'updated_at')]
+
+# Float columns are written with their full float64 repr, and NaN as 'NaN'
+FLOAT_COLUMNS = [c.name for c in Output.__table__.columns if isinstance(c.type, Float)]
+
+# With the normalized layout (db-setup/normalize_output.sql) output rows are
+# written to output_value, and their text columns are replaced by ids from
+# these lookup tables: (table, output columns it holds, output_value column)
+NORMALIZED_OUTPUT = config['DATABASE'].getboolean('NORMALIZED_OUTPUT', fallback=False)
+LOOKUPS = [('output_run', ['run_id', 'model'], 'run_key'),
+           ('feature', ['model', 'feature_name', 'feature_description'], 'feature_id'),
+           ('admin_unit', ['country', 'state', 'admin1', 'admin2', 'city'], 'admin_id')]
+VALUE_COLUMNS = ['run_key', 'feature_id', 'admin_id', 'datetime',
+                 'latitude', 'longitude', 'feature_value']
+
+
+class OutputLoader(object):
+    """
+    Streams data frames into the output table with COPY. Everything copied
+    within a `with OutputLoader() as loader:` block is committed as one
+    transaction when the block exits, or rolled back if it raises.
+
+    Given a `session`, the loader copies over that session's connection
+    instead, so the rows become part of the session's transaction and are
+    committed (or rolled back) with it; see `register_run`.
+
+    With `normalized` set, rows are written to output_value instead and
+    their run, feature and admin unit are replaced by lookup table ids.
+    """
+
+    def __init__(self, session=None, normalized=NORMALIZED_OUTPUT):
+        self.session = session
+        self.normalized = normalized
+        if normalized:
+            table, self.columns = 'output_value', VALUE_COLUMNS
+        else:
+            table, self.columns = Output.__tablename__, OUTPUT_COLUMNS
+        self.sql = f"COPY {table} ({', '.join(self.columns)}) FROM STDIN "\
+                   f"WITH (FORMAT csv, NULL '{NULL}')"
+        self.rows = 0
+        self.conn = None
+        # lookup ids already resolved by this loader, per table
+        self.ids = {table: {} for table, _, _ in LOOKUPS}
+        self.ids['admin_unit'][('',) * 5] = None
+
+    def __enter__(self):
+        if self.session is not None:
+            self.conn = self.session.connection().connection
+        else:
+            self.conn = engine.raw_connection()
+        self.cursor = self.conn.cursor()
+        return self
+
+    def copy(self, df):
+        """
+        Copies the rows of a data frame (e.g. one ingest chunk).
+        """
+        if len(df) == 0:
+            return
+        if self.normalized:
+            df = self.normalize(df)
+        self.cursor.copy_expert(self.sql, frame2csv(df, self.columns, FLOAT_COLUMNS))
+        self.rows += len(df)
+
+    def normalize(self, df):
+        """
+        Replaces the text columns of an output frame by lookup table ids.
+        """
+        values = df.reindex(columns=['datetime', 'latitude', 'longitude', 'feature_value'])
+        for table, columns, key in LOOKUPS:
+            values[key] = pd.array(self.lookup(table, columns, df), dtype='Int64')
+        return values
+
+    def lookup(self, table, columns, df):
+        """
+        The lookup table id of each row of `df`, adding any keys which are
+        not in the table yet. Keys are compared with NULL and '' treated
+        alike, as in the unique indexes of the lookup tables.
+        """
+        keys = df.reindex(columns=columns).astype(object)
+        keys = keys.where(keys.notna(), '').astype(str)
+        keys = list(keys.itertuples(index=False, name=None))
+        ids = self.ids[table]
+        missing = set(keys) - set(ids)
+        if missing:
+            ids.update(self.fetch_ids(table, columns, missing))
+            missing -= set(ids)
+        if missing:
+            self.insert_ids(table, columns, missing)
+            # pick up keys which a concurrent run inserted first
+            ids.update(self.fetch_ids(table, columns, missing))
+        return [ids[k] for k in keys]
+
+    def fetch_ids(self, table, columns, keys):
+        selected = ', '.join(f"coalesce(t.{c}, '')" for c in columns)
+        match = ' AND '.join(f"coalesce(t.{c}, '') = k.{c}" for c in columns)
+        sql = f"SELECT t.id, {selected} FROM {table} t "\
+              f"JOIN (VALUES %s) AS k ({', '.join(columns)}) ON {match}"
+        rows = execute_values(self.cursor, sql, list(keys), page_size=len(keys), fetch=True)
+        return {tuple(row[1:]): row[0] for row in rows}
+
+    def insert_ids(self, table, columns, keys):
+        # missing key values are stored as NULL
+        rows = [tuple(v if v != '' else None for v in k) for k in keys]
+        conflict = ', '.join(f"coalesce({c}, '')" for c in columns)
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s "\
+              f"ON CONFLICT ({conflict}) DO NOTHING"
+        execute_values(self.cursor, sql, rows, page_size=len(rows))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.session is None:
+                if exc_type is None:
+                    self.conn.commit()
+                else:
+                    self.conn.rollback()
+        finally:
+            self.cursor.close()
+            if self.session is None:
+                self.conn.close()
+        return False
+
+
+@contextmanager
+def register_run(metadata, parameters=(), session=db_session):
+    """
+    Stores a run in a single transaction: the Metadata row, its Parameters
+    rows (in one batched insert) and whatever Output rows are copied with
+    the yielded OutputLoader:
+
+        with register_run(meta, params) as loader:
+            for gdf in chunks:
+                loader.copy(gdf)
+
+    If anything fails before the block completes the whole run is rolled
+    back, so no metadata or parameters are left behind without output.
+    """
+    try:
+        session.add(metadata)
+        # the metadata row has to exist before the rows referencing it
+        session.flush()
+        session.bulk_save_objects(list(parameters))
+        with OutputLoader(session=session) as loader:
+            yield loader
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def copy_outputs(frames):
+    """
+    Loads an iterable of data frames into the output table in one
+    transaction and returns the number of rows copied.
+    """
+    with OutputLoader() as loader:
+        for df in frames:
+            loader.copy(df)
+    return loader.rows
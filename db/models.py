@@ -2,7 +2,6 @@
 from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Float
 from sqlalchemy.types import TIMESTAMP
 from datetime import datetime
-from geoalchemy2 import Geometry
 from database import Base
 from hashlib import sha256
 from sqlalchemy.sql import func
@@ -49,6 +48,9 @@ class Output(Base):
     country = Column(String(120), unique=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    # The geom point column is added by db-setup/partition_output.sql and is
+    # derived from longitude/latitude by the database; it is deliberately not
+    # mapped here, so the db-setup SQL stays the only source of the schema
 
     def __repr__(self):
         return '<Output %r>' % (self.id)
@@ -0,0 +1,31 @@
+"""
+Encodes output rows as the CSV that loader.py COPYs into the database. It
+is kept apart from loader.py, which connects to the database on import, so
+that it can be used (and tested) without one.
+"""
+import io
+
+import numpy as np
+
+NULL = '\\N'
+
+
+def frame2csv(df, columns, float_columns=()):
+    """
+    Writes the `columns` of `df` into an in-memory CSV buffer suitable for
+    COPY. Columns missing from `df` are loaded as NULL and other columns of
+    `df` are ignored, which is how bulk_insert_mappings treats a record
+    dict. `float_columns` are written with their full float64 repr, and NaN
+    as 'NaN'.
+    """
+    present = [c for c in float_columns if c in df and c in columns]
+    df = df.reindex(columns=columns)
+    for c in present:
+        # widen to float64 so values match what the ORM would insert and
+        # keep NaN as a float rather than NULL
+        values = df[c].to_numpy(dtype=np.float64, na_value=np.nan)
+        df[c] = np.where(np.isnan(values), 'NaN', values.astype(str))
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep=NULL)
+    buf.seek(0)
+    return buf
@@ -0,0 +1,179 @@
+"""
+The identity of a model run, shared by the REST server and the scripts
+which ingest precomputed runs: the sha256 of the JSON of its model name and
+configuration, with keys sorted and numbers in a canonical form.
+
+Numbers are canonical so that a value does not change a run's id depending
+on how it was written: floats with an integral value are written as ints
+(`rainfall: 1.0` is `rainfall: 1`), other floats are rounded to 12
+significant digits (so that `0.1 + 0.2` is 0.3) and numpy scalars are
+written as the Python numbers they hold.
+
+Run configurations submitted to /run_model are also normalized before they
+are hashed, filling in the default of every parameter they leave out from
+the model's metadata, so that a run which spells out a default (e.g. DSSAT
+with `rainfall: 1`) is the same run as one which does not. The normalized
+configuration is also the one the model is run with, so that a run's
+identity describes what actually ran.
+
+Runs registered before numbers were canonical are stored under their legacy
+id, the hash with numbers as they were written (`legacy_run_id`), which is
+checked as well before a run is considered new.
+"""
+import json
+import numbers
+from collections import OrderedDict
+from hashlib import sha256
+
+import redis
+
+# parameters whose defaults only hold when the others of their group are
+# left out as well: DSSAT runs an omitted number of years through 2018 from
+# a given start year, and ends planting three months after a given start
+PAIRED_DEFAULTS = {
+    'dssat': [('start_year', 'number_years'),
+              ('planting_start', 'planting_end')],
+}
+
+# parameters whose metadata default is not what the model does when they are
+# left out (DSSAT's controller applies its 100 kg/ha fertilizer baseline and
+# TWIST simulates 1975-2019); they are not filled in, so that leaving them
+# out runs what it always has and keeps its run id
+UNFILLED_DEFAULTS = {
+    'dssat': ['fertilizer'],
+    'multi_twist': ['start_year', 'end_year'],
+}
+
+# run ids checked per SMISMEMBER call
+CHECK_BATCH = 10000
+
+
+def parameter_defaults(model):
+    """
+    The defaults of the parameters of a model's metadata which have one.
+    """
+    defaults = {}
+    for parameter in model.get('parameters') or []:
+        default = (parameter.get('metadata') or {}).get('default')
+        if default is not None:
+            defaults[parameter['name']] = default
+    return defaults
+
+
+def normalize_config(model_name, config, defaults):
+    """
+    A run's configuration with the defaults of the parameters it leaves out
+    filled in. Values equal to their default are replaced by it.
+    """
+    unfilled = UNFILLED_DEFAULTS.get(model_name.lower(), [])
+    paired = [group for group in PAIRED_DEFAULTS.get(model_name.lower(), [])
+              if any(p in config for p in group)]
+    normalized = dict(config)
+    for name, default in defaults.items():
+        if name in normalized:
+            if normalized[name] == default:
+                normalized[name] = default
+        elif name not in unfilled and not any(name in group for group in paired):
+            normalized[name] = default
+    return normalized
+
+
+def canonical(value):
+    """
+    A configuration value with its numbers in canonical form and its dicts
+    sorted by key.
+    """
+    if isinstance(value, dict):
+        return OrderedDict((k, canonical(v)) for k, v in sorted(value.items()))
+    if isinstance(value, (list, tuple)):
+        return [canonical(v) for v in value]
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        if value.is_integer():
+            return int(value)
+        return float(f"{value:.12g}")
+    return value
+
+
+def canonical_config(model_config):
+    """
+    A run's `{'config': ..., 'name': ...}` in canonical form; this is what
+    its id is the hash of.
+    """
+    return canonical(model_config)
+
+
+def make_run_id(model_config):
+    """
+    The id of a run from its `{'config': ..., 'name': ...}`.
+    """
+    model_config = canonical_config(model_config)
+    return sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+
+
+def sorted_keys(value):
+    """
+    A dict with its keys, and those of the dicts it holds, sorted.
+    """
+    if isinstance(value, dict):
+        return OrderedDict((k, sorted_keys(v)) for k, v in sorted(value.items()))
+    return value
+
+
+def legacy_run_id(model_config):
+    """
+    The id a run from its `{'config': ..., 'name': ...}` had before numbers
+    were hashed in canonical form: the hash of the JSON with keys sorted and
+    numbers as they were written, so `rainfall: 1.0` and `rainfall: 1` had
+    different ids.
+    """
+    return sha256(json.dumps(sorted_keys(model_config)).encode('utf-8')).hexdigest()
+
+
+def check_runs_exist(r, set_name, run_ids, legacy_ids=None):
+    """
+    Whether each of `run_ids` is in the Redis set of a model's runs, checked
+    with SMISMEMBER in batches rather than one round trip per run. Falls back
+    to a pipeline of SISMEMBER on Redis servers older than 6.2. Runs which
+    are not in the set under their id are checked again under their id in
+    `legacy_ids`, if given.
+    """
+    exists = set_members(r, set_name, run_ids)
+    if legacy_ids is not None:
+        legacy_ids = list(legacy_ids)
+        missing = [i for i, e in enumerate(exists) if not e]
+        found = set_members(r, set_name, [legacy_ids[i] for i in missing])
+        for i, e in zip(missing, found):
+            exists[i] = e
+    return exists
+
+
+def run_exists(r, set_name, model_config):
+    """
+    Whether the run of a `{'config': ..., 'name': ...}` as it was written is
+    in the Redis set of a model's runs, under its id or its legacy id.
+    """
+    return check_runs_exist(r, set_name, [make_run_id(model_config)],
+                            [legacy_run_id(model_config)])[0]
+
+
+def set_members(r, set_name, run_ids):
+    """
+    Whether each of `run_ids` is in a Redis set.
+    """
+    run_ids = list(run_ids)
+    exists = []
+    for i in range(0, len(run_ids), CHECK_BATCH):
+        batch = run_ids[i:i + CHECK_BATCH]
+        try:
+            exists.extend(bool(e) for e in r.execute_command('SMISMEMBER', set_name, *batch))
+        except redis.exceptions.ResponseError:
+            pipe = r.pipeline(transaction=False)
+            for run_id in batch:
+                pipe.sismember(set_name, run_id)
+            exists.extend(bool(e) for e in pipe.execute())
+    return exists
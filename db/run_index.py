@@ -0,0 +1,47 @@
+"""
+The timestamp index of a model's runs: a sorted set `<set name>-by-time`
+next to the model's set of run ids, scored by each run's `timestamp` (epoch
+millis), which /list_runs reads to page through runs newest first.
+
+Whatever adds a run to a model's set adds it to the index in the same
+transaction: /run_model, and the scripts which ingest precomputed runs. Runs
+without a timestamp (precomputed runs have none) sort as the oldest.
+`rebuild` recreates an index from the set and the run hashes, for indexes
+written before this was the case (see REST-Server/index_runs.py).
+"""
+
+
+def index_name(set_name):
+    """
+    The name of the sorted set indexing the runs of the Redis set `set_name`.
+    """
+    return f"{set_name}-by-time"
+
+
+def add_run(r, set_name, run_id, timestamp=0):
+    """
+    Adds a run to a model's set of runs and to its timestamp index.
+    """
+    pipe = r.pipeline()
+    pipe.sadd(set_name, run_id)
+    pipe.zadd(index_name(set_name), {run_id: timestamp})
+    pipe.execute()
+
+
+def rebuild(r, set_name):
+    """
+    Recreates the timestamp index of a model's runs from its set and the
+    `timestamp` of each run. Returns the number of runs indexed.
+    """
+    run_ids = [run.decode('utf-8') for run in r.sscan_iter(set_name, count=1000)]
+    pipe = r.pipeline(transaction=False)
+    for run_id in run_ids:
+        pipe.hget(run_id, 'timestamp')
+    scores = {run_id: float(timestamp or 0) for run_id, timestamp in zip(run_ids, pipe.execute())}
+
+    pipe = r.pipeline()
+    pipe.delete(index_name(set_name))
+    if scores:
+        pipe.zadd(index_name(set_name), scores)
+    pipe.execute()
+    return len(scores)
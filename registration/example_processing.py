@@ -6,8 +6,11 @@ sys.path.append("../db")
 if not sys.warnoptions:
     warnings.simplefilter("ignore")
 
-from database import init_db, db_session
-from models import Metadata, Output, Parameters
+from database import init_db
+from models import Metadata, Parameters
+from run_identity import canonical_config, make_run_id
+from run_index import add_run
+from loader import register_run
 
 import pandas as pd
 import geopandas as gpd
@@ -19,8 +22,6 @@ import configparser
 import redis
 import boto3
 from datetime import datetime
-from collections import OrderedDict
-from hashlib import sha256
 import urllib.request
 import shutil
 import time
@@ -45,11 +46,11 @@ def gen_run(model_name, params, file):
                     'name': model_name
                    }
 
-    model_config = sortOD(OrderedDict(model_config))
-    run_id = sha256(json.dumps(model_config).encode('utf-8')).hexdigest()
+    model_config = canonical_config(model_config)
+    run_id = make_run_id(model_config)
 
-    # Add to model set in Redis
-    r.sadd(model_name, run_id)
+    # Add to model set in Redis and its timestamp index
+    add_run(r, model_name, run_id)
     
     run_obj = {'status': 'SUCCESS',
      'name': model_name,
@@ -66,15 +67,6 @@ def gen_run(model_name, params, file):
     
     return run_id, model_config, run_obj
 
-def sortOD(od):
-    res = OrderedDict()
-    for k, v in sorted(od.items()):
-        if isinstance(v, dict):
-            res[k] = sortOD(v)
-        else:
-            res[k] = v
-    return res                                
-
 def process(df, params, m, model_name, file):
     """
     Primary function for processing DSSAT
@@ -98,10 +90,9 @@ def process(df, params, m, model_name, file):
                     raw_output_link= f"https://model-service.worldmodelers.com/results/{model_name}_results/{file}",
                     run_label=f"Run for {model_name}",
                     point_resolution_meters=m.get("point_resolution_meters",1000))
-    db_session.add(meta)
-    db_session.commit()
 
     # Add parameters to DB
+    parameters = []
     for p_name, p_value in params.items():
         param = Parameters(run_id=run_id,
                           model=model_name,
@@ -109,8 +100,7 @@ def process(df, params, m, model_name, file):
                           parameter_value=p_value,
                           parameter_type=get_type(p_value)
                           )
-        db_session.add(param)
-        db_session.commit()
+        parameters.append(param)
     
     df['geometry'] = df.apply(lambda x: Point(x.longitude, x.latitude), axis=1)    
     gdf = gpd.GeoDataFrame(df)
@@ -121,7 +111,7 @@ def process(df, params, m, model_name, file):
         del(gdf['geometry'])
         del(gdf['index_right'])
         
-    return gdf, run_id
+    return gdf, run_id, meta, parameters
 
 
 ##################################################
@@ -186,13 +176,13 @@ if __name__ == "__main__":
                 params[p] = df[p].iloc[0]
         print(params)
         print(f"Processing runs with params: {json.dumps(params)}")
-        gdf, run_id = process(df, params, m, model_name, file)
-
-        for kk, vv in outputs.items():
-            gdf_ = gdf
-            gdf_['feature_name'] = kk
-            gdf_['feature_value'] = gdf_[kk]
-            gdf_['feature_description'] = vv['description']
-            gdf_ = gdf_.dropna(subset=['country','feature_value','admin1'])
-            db_session.bulk_insert_mappings(Output, gdf_.to_dict(orient="records"))
-            db_session.commit()
\ No newline at end of file
+        gdf, run_id, meta, parameters = process(df, params, m, model_name, file)
+
+        with register_run(meta, parameters) as loader:
+            for kk, vv in outputs.items():
+                gdf_ = gdf
+                gdf_['feature_name'] = kk
+                gdf_['feature_value'] = gdf_[kk]
+                gdf_['feature_description'] = vv['description']
+                gdf_ = gdf_.dropna(subset=['country','feature_value','admin1'])
+                loader.copy(gdf_)
\ No newline at end of file
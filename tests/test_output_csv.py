@@ -0,0 +1,68 @@
+import csv
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "db"))
+from output_csv import NULL, frame2csv
+
+COLUMNS = ['run_id', 'latitude', 'datetime', 'feature_name', 'feature_value', 'admin1']
+FLOAT_COLUMNS = ['latitude', 'feature_value']
+
+
+def rows(df, columns=COLUMNS):
+    return list(csv.reader(frame2csv(df, columns, FLOAT_COLUMNS)))
+
+
+def test_columns():
+    # missing columns are NULL, unknown ones are ignored, the order is the table's
+    df = pd.DataFrame({'feature_value': [1.5], 'run_id': ['run'], 'geometry': ['POINT (1 2)']})
+    assert rows(df) == [['run', NULL, NULL, NULL, '1.5', NULL]]
+
+
+def test_nulls():
+    df = pd.DataFrame({'run_id': ['run', None], 'admin1': [np.nan, 'Oromia'],
+                       'feature_name': ['yield', 'yield'],
+                       'datetime': [datetime(2018, 1, 1), pd.NaT]})
+    assert rows(df) == [['run', NULL, '2018-01-01', 'yield', NULL, NULL],
+                        [NULL, NULL, NULL, 'yield', NULL, 'Oromia']]
+
+
+def test_floats():
+    df = pd.DataFrame({'latitude': np.array([0.1, 7.0], dtype=np.float32),
+                       'feature_value': [np.nan, 1e-20]})
+    values = rows(df)
+    # float32 values are widened, as the ORM would store them
+    assert values[0][1] == repr(float(np.float32(0.1)))
+    assert values[1][1] == '7.0'
+    # NaN is kept as a float rather than NULL
+    assert values[0][4] == 'NaN'
+    assert float(values[1][4]) == 1e-20
+
+
+def test_integer_floats():
+    df = pd.DataFrame({'feature_value': pd.array([3, None], dtype='Int64')})
+    assert [r[4] for r in rows(df)] == ['3.0', 'NaN']
+
+
+def test_datetimes():
+    df = pd.DataFrame({'datetime': [datetime(2018, 3, 1, 12, 30), datetime(2018, 3, 2)]})
+    assert [r[2] for r in rows(df)] == ['2018-03-01 12:30:00', '2018-03-02 00:00:00']
+    df = pd.DataFrame({'datetime': ['2018-03-01']})
+    assert rows(df)[0][2] == '2018-03-01'
+
+
+def test_quoting():
+    names = ['Addis Ababa, "city"', 'line\nbreak', '', None]
+    df = pd.DataFrame({'run_id': names})
+    text = frame2csv(df, ['run_id']).read()
+    assert text == '"Addis Ababa, ""city"""\n"line\nbreak"\n""\n' + NULL + '\n'
+    # an empty string is quoted, so that COPY does not read it as NULL
+    assert [r[0] for r in csv.reader(text.splitlines(keepends=True))] == names[:3] + [NULL]
+
+
+def test_empty():
+    assert frame2csv(pd.DataFrame(columns=COLUMNS), COLUMNS, FLOAT_COLUMNS).read() == ''
@@ -0,0 +1,139 @@
+import os
+import sys
+from unittest import mock
+
+import numpy as np
+import redis
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "db"))
+from run_identity import (canonical, make_run_id, legacy_run_id, check_runs_exist,
+                          normalize_config, parameter_defaults)
+
+# the id of a DSSAT baseline run as ingested before numbers were canonical
+# (the sortOD and sha256 of the ingest scripts), with rainfall written as 1.0
+DSSAT_CONFIG = {'name': 'DSSAT',
+                'config': {'rainfall': 1.0, 'fertilizer': 100, 'start_year': 2007,
+                           'management_practice': 'irrig', 'season': 'Meher'}}
+LEGACY_DSSAT_ID = '1ecdf0022f24c678506076ec04c81587b2ee792947364ca1d030a8f5cf82d4b1'
+
+
+class FakeRunSet(object):
+    """A Redis set of run ids, optionally on a server without SMISMEMBER"""
+
+    def __init__(self, members, smismember=True):
+        self.members = set(members)
+        self.smismember = smismember
+        self.sismember_calls = 0
+
+    def execute_command(self, command, set_name, *values):
+        assert command == 'SMISMEMBER'
+        if not self.smismember:
+            raise redis.exceptions.ResponseError("unknown command 'SMISMEMBER'")
+        return [int(v in self.members) for v in values]
+
+    def pipeline(self, transaction=True):
+        pipe = mock.Mock()
+        checked = []
+        pipe.sismember.side_effect = lambda set_name, value: checked.append(value)
+        pipe.execute.side_effect = lambda: [v in self.members for v in checked]
+        self.sismember_calls += 1
+        return pipe
+
+DSSAT_DEFAULTS = {'rainfall': 1, 'fertilizer': 50, 'start_year': 2008, 'number_years': 10,
+                  'planting_start': '03-01', 'planting_end': '05-01', 'season': 'Meher'}
+
+
+def test_parameter_defaults():
+    model = {'parameters': [{'name': 'rainfall', 'metadata': {'default': 1}},
+                            {'name': 'season', 'metadata': {}},
+                            {'name': 'crop'},
+                            {'name': 'irrigation', 'metadata': {'default': False}}]}
+    assert parameter_defaults(model) == {'rainfall': 1, 'irrigation': False}
+    assert parameter_defaults({'parameters': None}) == {}
+
+
+def test_normalize_config():
+    normalized = normalize_config('DSSAT', {'rainfall': 1.0, 'season': 'Belg', 'crop': 'maize'},
+                                  DSSAT_DEFAULTS)
+    # left out parameters are filled in, except the fertilizer baseline
+    assert normalized == {'rainfall': 1, 'season': 'Belg', 'crop': 'maize',
+                          'start_year': 2008, 'number_years': 10,
+                          'planting_start': '03-01', 'planting_end': '05-01'}
+    # values equal to their default are the default
+    assert isinstance(normalized['rainfall'], int)
+    assert make_run_id({'name': 'DSSAT', 'config': normalized}) == \
+        make_run_id({'name': 'DSSAT', 'config': normalize_config('DSSAT', {'season': 'Belg', 'crop': 'maize'},
+                                                                 DSSAT_DEFAULTS)})
+
+
+def test_normalize_config_paired():
+    # a parameter given alone does not get its pair's default
+    normalized = normalize_config('dssat', {'start_year': 2010, 'planting_end': '06-01'},
+                                  DSSAT_DEFAULTS)
+    assert 'number_years' not in normalized
+    assert 'planting_start' not in normalized
+    assert normalized['rainfall'] == 1 and normalized['season'] == 'Meher'
+
+
+def test_normalize_config_unfilled():
+    defaults = {'start_year': 1975, 'end_year': 2019, 'rainfall': 1}
+    assert normalize_config('multi_twist', {}, defaults) == {'rainfall': 1}
+    # other models fill them in
+    assert normalize_config('other', {}, defaults) == defaults
+    config = {'rainfall': 2}
+    normalize_config('other', config, defaults)
+    assert config == {'rainfall': 2}
+
+
+def test_canonical():
+    assert canonical(1.0) == 1 and isinstance(canonical(1.0), int)
+    assert canonical(0.1 + 0.2) == 0.3
+    assert canonical(True) is True
+    assert canonical(None) is None
+    assert canonical('1.0') == '1.0'
+    assert canonical({'b': [2.0, {'d': 1.5, 'c': 3}], 'a': 1}) == {'a': 1, 'b': [2, {'c': 3, 'd': 1.5}]}
+    assert list(canonical({'b': 1, 'a': 2})) == ['a', 'b']
+
+
+def test_canonical_numpy():
+    assert canonical(np.float64(2.0)) == 2
+    assert type(canonical(np.int64(3))) is int
+    assert type(canonical(np.float32(0.5))) is float
+
+
+def test_make_run_id():
+    spelled_out = {'name': 'DSSAT', 'config': {'fertilizer': 100, 'rainfall': 1}}
+    written = {'config': {'rainfall': 1.0, 'fertilizer': 100.0}, 'name': 'DSSAT'}
+    assert make_run_id(spelled_out) == make_run_id(written)
+    assert len(make_run_id(written)) == 64
+    assert make_run_id(written) != make_run_id({'name': 'DSSAT', 'config': {'rainfall': 0.9}})
+
+
+def test_legacy_run_id():
+    # numbers are hashed as written, keys are still sorted
+    assert legacy_run_id(DSSAT_CONFIG) == LEGACY_DSSAT_ID
+    reordered = {'config': dict(reversed(list(DSSAT_CONFIG['config'].items()))), 'name': 'DSSAT'}
+    assert legacy_run_id(reordered) == LEGACY_DSSAT_ID
+    assert legacy_run_id(DSSAT_CONFIG) != make_run_id(DSSAT_CONFIG)
+    # configs without integral floats kept their id
+    config = {'name': 'DSSAT', 'config': {'rainfall': 0.9, 'fertilizer': 50}}
+    assert legacy_run_id(config) == make_run_id(config)
+
+
+def test_check_runs_exist():
+    r = FakeRunSet(['a', 'c'])
+    assert check_runs_exist(r, 'DSSAT', ['a', 'b', 'c']) == [True, False, True]
+    assert r.sismember_calls == 0
+
+
+def test_check_runs_exist_sismember_fallback():
+    r = FakeRunSet(['a', 'c'], smismember=False)
+    assert check_runs_exist(r, 'DSSAT', ['a', 'b', 'c']) == [True, False, True]
+    assert r.sismember_calls == 1
+
+
+def test_check_runs_exist_legacy_ids():
+    new_id = make_run_id(DSSAT_CONFIG)
+    for smismember in (True, False):
+        r = FakeRunSet([LEGACY_DSSAT_ID, 'b'], smismember=smismember)
+        assert check_runs_exist(r, 'DSSAT', [new_id, 'b', 'x'], [LEGACY_DSSAT_ID, 'b', 'y']) == [True, True, False]